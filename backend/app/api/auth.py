@@ -1,16 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_
-from typing import List
+from typing import List, Optional
 
 from ..database import get_db
 from ..models.users import User, Profile
 from ..schemas.users import UserCreate, UserLogin, UserOut, UserUpdate
-from ..core.security import get_password_hash, verify_password, create_access_token
-from .deps import get_current_user
+from ..core.metrics import password_hash_upgrades
+from ..core.security import HasherBusy, create_access_token, password_hasher
+from ..core.principal import Principal, principal_cache
+from ..services.user_search import search_key, search_users as find_users
+from .deps import get_current_user, get_read_db, get_token
+from .pagination import decode_name_cursor, encode_name_cursor
 
 router = APIRouter()
 
+def hashing_busy() -> HTTPException:
+    # Shed the request instead of queueing it behind a login storm
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins in progress, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register/", response_model=UserOut)
 async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     if user_in.password != user_in.password2:
@@ -24,8 +36,13 @@ async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     )
     if result.scalars().first():
         raise HTTPException(status_code=400, detail="User with this username or phone number already exists")
+    # Hand the connection back to the pool while bcrypt runs
+    await db.commit()
     
-    hashed_password = get_password_hash(user_in.password)
+    try:
+        hashed_password = await password_hasher.hash(user_in.password)
+    except HasherBusy:
+        raise hashing_busy()
     user = User(
         username=user_in.username,
         phone_number=user_in.phone_number,
@@ -52,10 +69,25 @@ async def login(response: Response, user_in: UserLogin, db: AsyncSession = Depen
     )
     user = result.scalars().first()
     
-    if not user or not verify_password(user_in.password, user.password):
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect identifier or password")
+    # Hand the connection back to the pool while bcrypt runs (objects stay loaded)
+    await db.commit()
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(user_in.password, user.password)
+    except HasherBusy:
+        raise hashing_busy()
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect identifier or password")
+    if new_hash:
+        # Stored with an older cost factor; rehash now that we have the plaintext
+        user.password = new_hash
+        await db.commit()
+        password_hash_upgrades.inc()
     
     access_token = create_access_token(subject=user.id)
+    # Warm the cache so the first authenticated request doesn't look the user up again
+    principal_cache.put(access_token, Principal.from_user(user))
     
     # Set cookie for frontend compatibility
     response.set_cookie(
@@ -70,23 +102,34 @@ async def login(response: Response, user_in: UserLogin, db: AsyncSession = Depen
     return {"detail": "Successfully logged in", "user": user}
 
 @router.post("/logout/")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
+    token = get_token(request)
+    if token:
+        principal_cache.invalidate_token(token)
     response.delete_cookie("sessionid")
     return {"detail": "Successfully logged out"}
 
 @router.get("/me/", response_model=UserOut)
-async def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 @router.get("/search/", response_model=List[UserOut])
-async def search_users(q: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    result = await db.execute(
-        select(User).where(
-            or_(
-                User.username.ilike(f"%{q}%"), 
-                User.display_name.ilike(f"%{q}%"),
-                User.phone_number.ilike(f"%{q}%")
-            )
-        ).limit(10)
-    )
-    return result.scalars().all()
+async def search_users(
+    q: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Users matching q, best matches first. Keyset-paginated: pass
+    X-Next-Cursor back as `cursor` for the next page.
+    """
+    after = decode_name_cursor(cursor) if cursor else None
+    # One extra row tells us whether there is another page
+    users = await find_users(db, q, limit + 1, after)
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers["X-Next-Cursor"] = encode_name_cursor(*search_key(q, users[-1]))
+    return users
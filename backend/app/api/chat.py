@@ -1,40 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, desc
-from typing import List
-from uuid import UUID
+from sqlalchemy import select, delete, update, or_, func, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import List, Optional
+import html
+import math
+from datetime import datetime
+from uuid import UUID, uuid4
 
-from ..database import get_db
+from ..database import get_db, record_write
 from ..models.users import User
-from ..models.chats import Thread, ChatMessage
-from ..schemas.chats import ThreadOut, MessageOut, ThreadCreate, MessageCreate
-from .deps import get_current_user
+from ..models.chats import Thread, ThreadMember, ChatMessage, SEARCH_CONFIG
+from ..schemas.chats import (
+    ThreadOut, MessageOut, ThreadCreate, MessageCreate, MessageSearchResult, GroupCreate, MembersAdd, ThreadMemberOut,
+)
+from ..schemas.events import json_response, message_data, message_event, thread_data, user_data
+from ..core.config import settings
+from ..core.principal import Principal
+from ..core.rate_limit import message_limits
+from .deps import get_current_user, get_read_db
+from .pagination import encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor
 from ..websockets.manager import manager
-from ..services.tasks import handle_bot_response
+from ..services.archive import archive
+from ..services.recent_messages import MESSAGE_COLUMNS, message_row_data, recent_messages, sender_data
+from ..services.tasks import bot_pool
+from ..services.threads import broadcast_members_changed, get_thread_info, record_last_message, user_thread_ids
+from ..services.transfer import csv_chunks, export_records, ndjson_chunks
 
 router = APIRouter()
 
+# Everything ThreadOut needs, without loading whole Thread objects
+THREAD_COLUMNS = (
+    Thread.id, Thread.first_person_id, Thread.second_person_id, Thread.is_group, Thread.name, Thread.updated,
+    Thread.last_message_id, Thread.last_message_preview, Thread.last_message_at, Thread.last_message_user_id,
+)
+
 @router.get("/threads/", response_model=List[ThreadOut])
 async def get_threads(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    before: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
+    """
+    The caller's inbox, most recently active first, keyset-paginated on
+    (updated, id). Pass X-Older-Cursor back as `before` for the next page.
+    """
+    # One ordered index scan per side of the thread, and one for groups, instead of an OR over the table
+    sides = [
+        select(*THREAD_COLUMNS).where(Thread.first_person_id == current_user.id),
+        # Don't list a self-thread twice
+        select(*THREAD_COLUMNS).where(Thread.second_person_id == current_user.id, Thread.first_person_id != current_user.id),
+        select(*THREAD_COLUMNS).join(ThreadMember, ThreadMember.thread_id == Thread.id).where(ThreadMember.user_id == current_user.id),
+    ]
+    for n, side in enumerate(sides):
+        if before:
+            side = side.where(tuple_(Thread.updated, Thread.id) < tuple_(*decode_cursor(before)))
+        sides[n] = side.order_by(Thread.updated.desc(), Thread.id.desc()).limit(limit + 1)
+
+    inbox = union_all(*sides).subquery()
     result = await db.execute(
-        select(Thread).where(
-            or_(Thread.first_person_id == current_user.id, Thread.second_person_id == current_user.id)
-        ).order_by(desc(Thread.updated))
+        select(inbox).order_by(inbox.c.updated.desc(), inbox.c.id.desc()).limit(limit + 1)
     )
-    threads = result.scalars().all()
-    
-    # TODO: Populate last_message efficiently if needed
-    # For now, ThreadOut schema might need adjustment or we do a subquery
-    return threads
+    threads = result.all()
+    headers = {}
+    if len(threads) > limit:
+        threads = threads[:limit]
+        oldest = threads[-1]
+        headers["X-Older-Cursor"] = encode_cursor(oldest.updated, oldest.id)
+
+    return json_response([thread_data(thread) for thread in threads], headers)
 
 @router.post("/threads/", response_model=ThreadOut)
 async def create_thread(
     thread_in: ThreadCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     # Check if thread already exists
     result = await db.execute(
@@ -61,77 +103,380 @@ async def create_thread(
         db.add(thread)
         await db.commit()
         await db.refresh(thread)
+        # Both inboxes changed; keep their next reads on the primary
+        record_write(current_user.id, thread_in.user_id)
         
+    return ThreadOut.from_thread(thread)
+
+async def _existing_users(db: AsyncSession, user_ids) -> set:
+    result = await db.execute(select(User.id).where(User.id.in_(user_ids)))
+    return set(result.scalars().all())
+
+@router.post("/groups/", response_model=ThreadOut)
+async def create_group(
+    group_in: GroupCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """A group thread with the caller as its admin and `member_ids` as members."""
+    member_ids = set(group_in.member_ids) - {current_user.id}
+    if len(member_ids) + 1 > settings.GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"Groups are limited to {settings.GROUP_MAX_MEMBERS} members")
+    if len(await _existing_users(db, member_ids)) != len(member_ids):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    now = datetime.utcnow()
+    thread = Thread(id=uuid4(), is_group=True, name=group_in.name, updated=now)
+    db.add(thread)
+    await db.flush()
+    db.add(ThreadMember(thread_id=thread.id, user_id=current_user.id, is_admin=True, joined_at=now))
+    db.add_all(ThreadMember(thread_id=thread.id, user_id=user_id, joined_at=now) for user_id in member_ids)
+    await db.commit()
+    await db.refresh(thread)
+    record_write(current_user.id, *member_ids)
+
+    data = thread_data(thread)
+    await manager.broadcast_to_users([current_user.id, *member_ids], {"type": "thread_created", "data": data})
+    return json_response(data)
+
+async def _member_group(db: AsyncSession, thread_id: UUID, user_id: UUID):
+    thread = await get_thread_info(db, thread_id)
+    if not thread or user_id not in thread.participant_ids:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    if not thread.is_group:
+        raise HTTPException(status_code=400, detail="Only group threads have members to change")
     return thread
 
+async def _lock_members(db: AsyncSession, thread_id: UUID):
+    # Membership changes to one group run one at a time (until commit), so the member
+    # cap and the last-admin check see every change that committed before them
+    await db.execute(select(Thread.id).where(Thread.id == thread_id).with_for_update())
+
+async def _is_admin(db: AsyncSession, thread_id: UUID, user_id: UUID) -> bool:
+    return bool(await db.scalar(
+        select(ThreadMember.is_admin).where(ThreadMember.thread_id == thread_id, ThreadMember.user_id == user_id)
+    ))
+
+@router.get("/threads/{thread_id}/members/", response_model=List[ThreadMemberOut])
+async def get_members(
+    thread_id: UUID,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """A group's members in the order they joined."""
+    thread = await get_thread_info(db, thread_id)
+    if not thread or current_user.id not in thread.participant_ids:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    if not thread.is_group:
+        raise HTTPException(status_code=400, detail="Only group threads have members")
+
+    result = await db.execute(
+        select(ThreadMember.is_admin, ThreadMember.joined_at, User.id, User.username, User.phone_number, User.display_name, User.is_bot)
+        .join(User, User.id == ThreadMember.user_id)
+        .where(ThreadMember.thread_id == thread_id)
+        .order_by(ThreadMember.joined_at, User.id)
+    )
+    return json_response([
+        {"user": user_data(row), "is_admin": row.is_admin, "joined_at": row.joined_at}
+        for row in result.all()
+    ])
+
+@router.post("/threads/{thread_id}/members/", response_model=List[ThreadMemberOut])
+async def add_members(
+    thread_id: UUID,
+    members_in: MembersAdd,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Add users to a group; admins only. Users already in it are skipped."""
+    thread = await _member_group(db, thread_id, current_user.id)
+    await _lock_members(db, thread_id)
+    if not await _is_admin(db, thread_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Only group admins can add members")
+
+    user_ids = set(members_in.user_ids) - thread.participant_ids
+    count = await db.scalar(select(func.count()).select_from(ThreadMember).where(ThreadMember.thread_id == thread_id))
+    if count + len(user_ids) > settings.GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"Groups are limited to {settings.GROUP_MAX_MEMBERS} members")
+    if len(await _existing_users(db, user_ids)) != len(user_ids):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if user_ids:
+        now = datetime.utcnow()
+        # The cached members can be behind; whoever is already in is skipped, not a conflict
+        result = await db.execute(
+            pg_insert(ThreadMember)
+            .values([{"thread_id": thread_id, "user_id": user_id, "is_admin": False, "joined_at": now} for user_id in user_ids])
+            .on_conflict_do_nothing()
+            .returning(ThreadMember.user_id)
+        )
+        added = set(result.scalars().all())
+        await db.commit()
+        if added:
+            record_write(*thread.participant_ids, *added)
+            await broadcast_members_changed(thread, added=added)
+    return await get_members(thread_id, db, current_user)
+
+@router.delete("/threads/{thread_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_member(
+    thread_id: UUID,
+    user_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Remove someone from a group (admins), or leave it (anyone, with their own id)."""
+    thread = await _member_group(db, thread_id, current_user.id)
+    await _lock_members(db, thread_id)
+    if user_id != current_user.id and not await _is_admin(db, thread_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Only group admins can remove members")
+
+    was_admin = await db.scalar(
+        delete(ThreadMember)
+        .where(ThreadMember.thread_id == thread_id, ThreadMember.user_id == user_id)
+        .returning(ThreadMember.is_admin)
+    )
+    if was_admin is None:
+        raise HTTPException(status_code=404, detail="Not a member")
+    if was_admin and not await db.scalar(
+        select(ThreadMember.user_id).where(ThreadMember.thread_id == thread_id, ThreadMember.is_admin).limit(1)
+    ):
+        # A group always keeps an admin: the longest-standing member takes over from the last one
+        successor = (
+            select(ThreadMember.user_id)
+            .where(ThreadMember.thread_id == thread_id)
+            .order_by(ThreadMember.joined_at, ThreadMember.user_id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(ThreadMember).where(ThreadMember.thread_id == thread_id, ThreadMember.user_id == successor).values(is_admin=True)
+        )
+    await db.commit()
+    record_write(*thread.participant_ids)
+    await broadcast_members_changed(thread, removed=[user_id])
+
 @router.get("/threads/{thread_id}/messages/", response_model=List[MessageOut])
 async def get_messages(
     thread_id: UUID,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
 ):
+    """
+    One page of history, keyset-paginated on (timestamp, id).
+
+    Without a cursor this is the newest page. Pass X-Older-Cursor back as
+    `before` to scroll up, or X-Newer-Cursor as `after` to fetch what came
+    in since. Rows within a page are always in chronological order.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
     # Verify access
-    thread_res = await db.execute(select(Thread).where(Thread.id == thread_id))
-    thread = thread_res.scalars().first()
-    if not thread or current_user.id not in [thread.first_person_id, thread.second_person_id]:
+    thread = await get_thread_info(db, thread_id)
+    if not thread or current_user.id not in thread.participant_ids:
         raise HTTPException(status_code=404, detail="Thread not found")
-        
-    result = await db.execute(
-        select(ChatMessage).where(ChatMessage.thread_id == thread_id).order_by(ChatMessage.timestamp.asc())
-    )
-    return result.scalars().all()
+
+    # The newest page is what every chat open asks for; it usually comes from memory
+    cached = None if before or after else await recent_messages.latest(thread_id, limit)
+    if cached is not None:
+        messages, has_more = cached
+        # Anything older than the cache holds may only be left in the archive
+        if not has_more and await archive.has_thread(thread_id):
+            has_more = True
+    else:
+        before_key = decode_cursor(before) if before else None
+        after_key = decode_cursor(after) if after else None
+        # One extra row tells us whether there is another page
+        messages = []
+        if after_key and await archive.has_thread(thread_id) and archive.covers(after_key[0]):
+            # Archived months are older than anything in Postgres, so they come first
+            messages = await archive.messages(db, thread_id, after=after_key, limit=limit + 1)
+            if messages:
+                after_key = (messages[-1]["timestamp"], messages[-1]["id"])
+
+        remaining = limit + 1 - len(messages)
+        if remaining > 0:
+            key = tuple_(ChatMessage.timestamp, ChatMessage.id)
+            query = select(*MESSAGE_COLUMNS).join(User, User.id == ChatMessage.user_id).where(ChatMessage.thread_id == thread_id)
+            if after_key:
+                query = query.where(key > tuple_(*after_key)).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+            else:
+                if before_key:
+                    query = query.where(key < tuple_(*before_key))
+                query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+            result = await db.execute(query.limit(remaining))
+            rows = [message_row_data(row) for row in result.all()]
+            messages += rows
+            if not after and len(rows) < remaining and await archive.has_thread(thread_id):
+                # Postgres has nothing older; carry on into the archive
+                oldest = (rows[-1]["timestamp"], rows[-1]["id"]) if rows else before_key
+                messages += await archive.messages(db, thread_id, before=oldest, limit=remaining - len(rows))
+
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if not after:
+            messages.reverse()
+
+    headers = {}
+    if messages:
+        if has_more or after:
+            oldest = messages[0]
+            headers["X-Older-Cursor"] = encode_cursor(oldest["timestamp"], oldest["id"])
+        newest = messages[-1]
+        headers["X-Newer-Cursor"] = encode_cursor(newest["timestamp"], newest["id"])
+    return json_response(messages, headers)
 
 @router.post("/threads/{thread_id}/messages/", response_model=MessageOut)
 async def send_message(
     thread_id: UUID,
     message_in: MessageCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    thread_res = await db.execute(select(Thread).where(Thread.id == thread_id))
-    thread = thread_res.scalars().first()
-    if not thread or current_user.id not in [thread.first_person_id, thread.second_person_id]:
+    thread = await get_thread_info(db, thread_id)
+    if not thread or current_user.id not in thread.participant_ids:
         raise HTTPException(status_code=404, detail="Thread not found")
+
+    # Shares the user's budget with their sockets
+    retry_after = message_limits.take(current_user.id)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many messages, slow down",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
         
     message = ChatMessage(
+        id=uuid4(),
         thread_id=thread_id,
         user_id=current_user.id,
-        message=message_in.message
+        message=message_in.message,
+        timestamp=datetime.utcnow(),
     )
     db.add(message)
     
-    # Update thread timestamp
-    thread.updated = datetime.utcnow()
+    # Update the thread summary in the same transaction
+    await record_last_message(db, thread_id, message.id, current_user.id, message.message, message.timestamp)
     
     await db.commit()
-    await db.refresh(message)
+    record_write(*thread.participant_ids)
     
-    # WebSocket broadcast
-    serialized = {
-        "type": "new_message",
-        "data": {
-            "id": str(message.id),
-            "thread_id": str(thread.id),
-            "user": {
-                "id": str(current_user.id),
-                "username": current_user.username,
-                "display_name": current_user.display_name,
-                "is_bot": current_user.is_bot,
-            },
-            "message": message.message,
-            "timestamp": message.timestamp.isoformat(),
-        }
-    }
-    await manager.broadcast_to_user(thread.first_person_id, serialized)
-    await manager.broadcast_to_user(thread.second_person_id, serialized)
+    # The same payload goes out over WebSocket and back as the response
+    data = message_data(message.id, thread_id, user_data(current_user), message.message, message.timestamp)
+    await manager.broadcast_to_thread(thread, message_event(data))
+    recent_messages.add(data)
     
     # Trigger AI response
-    other_user_id = thread.second_person_id if thread.first_person_id == current_user.id else thread.first_person_id
-    other_user_res = await db.execute(select(User).where(User.id == other_user_id))
-    other_user = other_user_res.scalars().first()
-    
-    if other_user and other_user.is_bot:
-        background_tasks.add_task(handle_bot_response, thread.id, message_in.message)
+    if thread.bot_user_id and thread.bot_user_id != current_user.id:
+        bot_pool.submit(thread_id)
     
-    return message
+    return json_response(data)
+
+# Control characters can't appear in ts_headline's output otherwise, so they
+# survive HTML-escaping and are swapped for <mark> tags afterwards
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+@router.get("/search/", response_model=List[MessageSearchResult])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    thread_id: Optional[UUID] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Full-text search over messages in the caller's threads (or one of them),
+    best matches first. `q` takes web search syntax: quoted phrases, OR, -word.
+
+    Keyset-paginated on (rank, timestamp, id): pass X-Next-Cursor back as
+    `cursor` for the next page.
+    """
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank(ChatMessage.search_vector, ts_query)
+
+    my_threads = user_thread_ids(current_user.id)
+    matches = (
+        select(
+            ChatMessage.id, ChatMessage.thread_id, ChatMessage.user_id,
+            ChatMessage.message, ChatMessage.timestamp, rank.label("rank"),
+        )
+        .where(ChatMessage.search_vector.bool_op("@@")(ts_query), ChatMessage.thread_id.in_(my_threads))
+    )
+    if thread_id:
+        matches = matches.where(ChatMessage.thread_id == thread_id)
+    if cursor:
+        matches = matches.where(
+            tuple_(rank, ChatMessage.timestamp, ChatMessage.id) < tuple_(*decode_rank_cursor(cursor))
+        )
+    # One extra row tells us whether there is another page
+    page = (
+        matches.order_by(rank.desc(), ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+        .subquery()
+    )
+
+    # Headlines are expensive, so only build them for the page itself
+    result = await db.execute(
+        select(
+            page, func.ts_headline(SEARCH_CONFIG, page.c.message, ts_query, HEADLINE_OPTIONS),
+            User.username, User.phone_number, User.display_name, User.is_bot,
+        )
+        .join(User, User.id == page.c.user_id)
+        .order_by(page.c.rank.desc(), page.c.timestamp.desc(), page.c.id.desc())
+    )
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    headers = {}
+    if has_more:
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_rank_cursor(last.rank, last.timestamp, last.id)
+    return json_response([
+        {
+            "id": row.id,
+            "thread_id": row.thread_id,
+            "user": sender_data(row),
+            "timestamp": row.timestamp,
+            "snippet": html.escape(row.ts_headline)
+                .replace(HIGHLIGHT_START, "<mark>")
+                .replace(HIGHLIGHT_STOP, "</mark>"),
+        }
+        for row in rows
+    ], headers)
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_chunks, "application/x-ndjson"),
+    "csv": (csv_chunks, "text/csv"),
+}
+
+@router.get("/export/")
+async def export_messages(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    thread_id: Optional[UUID] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    All of the caller's conversations (or one of them), streamed.
+
+    NDJSON is the format `python -m app.cli import` loads: participants,
+    threads, then every message oldest first. CSV is just the messages.
+    """
+    if thread_id:
+        thread = await get_thread_info(db, thread_id)
+        if not thread or current_user.id not in thread.participant_ids:
+            raise HTTPException(status_code=404, detail="Thread not found")
+
+    chunks, media_type = EXPORT_FORMATS[format]
+    # The response outlives this request's session, so the export opens its own
+    return StreamingResponse(
+        chunks(export_records(current_user.id, thread_id)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="messages.{format}"'},
+    )
@@ -1,19 +1,77 @@
-from typing import Annotated, Optional
+import asyncio
+from typing import Annotated, Iterable, Optional, Set
+from uuid import UUID
+
+import orjson
 from fastapi import Depends, HTTPException, Request, status
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from pydantic import ValidationError
 
-from ..database import get_db
-from ..models.users import User
+from ..database import get_db, SessionLocal, ReadSessionLocal, mark_written, write_listeners, wrote_recently
+from ..models.users import User, Profile
 from ..core.config import settings
 from ..core.security import ALGORITHM
+from ..core.principal import Principal, invalidation_listeners, principal_cache, register_invalidation
+from ..websockets.manager import manager
 
-async def get_current_user(
-    request: Request,
-    db: Annotated[AsyncSession, Depends(get_db)]
-) -> User:
+# Drop cached principals whenever an account or profile is written through the ORM
+register_invalidation(User, Profile)
+
+_publish_tasks = set()
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _publish_tasks.add(task)
+    task.add_done_callback(_publish_tasks.discard)
+
+async def _publish(message: dict):
+    try:
+        await manager.publish_to_workers(message)
+    except Exception as e:
+        print(f"Error publishing {message['type']}: {e}")
+
+# Committed account changes; other workers drop their cached principals for these users
+def _on_principals_changed(user_ids: Iterable[UUID]):
+    _spawn(_publish({"type": "principals_changed", "data": {"user_ids": list(user_ids)}}))
+
+# Writes recorded in one event-loop pass go to the other workers as one user_writes event,
+# so a user who writes on one worker and reads on another still reads from the primary
+_unpublished_writes: Set[UUID] = set()
+
+async def _publish_writes():
+    user_ids = list(_unpublished_writes)
+    _unpublished_writes.clear()
+    await _publish({"type": "user_writes", "data": {"user_ids": user_ids}})
+
+def _on_write(user_ids: Iterable[UUID]):
+    if not _unpublished_writes:
+        _spawn(_publish_writes())
+    _unpublished_writes.update(user_ids)
+
+def _invalidate_principals(user_ids: Iterable[UUID]):
+    for user_id in user_ids:
+        principal_cache.invalidate_user(user_id)
+
+def _on_remote_event(data: str):
+    # Events are encoded with "type" first, so everything else is skipped unparsed
+    if data.startswith('{"type":"user_writes"'):
+        apply = mark_written
+    elif data.startswith('{"type":"principals_changed"'):
+        apply = _invalidate_principals
+    else:
+        return
+    try:
+        apply([UUID(user_id) for user_id in orjson.loads(data)["data"]["user_ids"]])
+    except Exception as e:
+        print(f"Ignoring malformed event: {e}")
+
+write_listeners.append(_on_write)
+invalidation_listeners.append(_on_principals_changed)
+manager.remote_listeners.append(_on_remote_event)
+
+def get_token(request: Request) -> Optional[str]:
     # Try to get token from cookie (compatibility with frontend)
     token = request.cookies.get("sessionid")
     
@@ -22,12 +80,24 @@ async def get_current_user(
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
+    return token
+
+async def get_current_user(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_db)]
+) -> Principal:
+    token = get_token(request)
 
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
         )
+
+    # Common case: token seen recently, no decode and no database
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     
     try:
         payload = jwt.decode(
@@ -39,16 +109,31 @@ async def get_current_user(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials",
             )
-    except (JWTError, ValidationError):
+        user_id = UUID(token_data_sub)
+    except (JWTError, ValidationError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
         )
     
-    result = await db.execute(select(User).where(User.id == token_data_sub))
+    generation = principal_cache.generation
+    result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalars().first()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(token, principal, payload.get("exp"), generation)
+    return principal
+
+async def get_read_db(
+    current_user: Annotated[Principal, Depends(get_current_user)]
+):
+    """
+    Session for read-only endpoints: the replica, unless the caller wrote
+    something in the last DB_READ_YOUR_WRITES_WINDOW seconds.
+    """
+    session_factory = SessionLocal if wrote_recently(current_user.id) else ReadSessionLocal
+    async with session_factory() as session:
+        yield session
@@ -0,0 +1,97 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..core.metrics import registry
+from ..core.config import settings
+from ..core.principal import principal_cache
+from ..core.rate_limit import frame_limits, message_limits
+from ..core.security import password_hasher
+from ..database import pool_stats
+from ..services.archive import archive
+from ..services.ingest import ingestor
+from ..services.presence import presence
+from ..services.recent_messages import recent_messages
+from ..services.tasks import bot_pool
+from ..services.user_search import user_index
+from ..websockets.manager import manager
+
+router = APIRouter()
+
+def _pool(key: str):
+    return lambda: {engine: stats[key] for engine, stats in pool_stats().items()}
+
+# Read from the components' own counters when scraped
+registry.callback("ws_connections", "Open WebSocket connections on this worker.", lambda: manager.stats()["connections"])
+registry.callback("ws_connected_users", "Users with at least one open WebSocket on this worker.", lambda: manager.stats()["users"])
+registry.callback("ws_queued_frames", "Frames waiting in send queues.", lambda: manager.stats()["queued_frames"])
+registry.callback("broadcast_queued_events", "Events waiting to be published to the other workers.", lambda: manager.stats()["unpublished_events"])
+registry.callback(
+    "ws_evicted_connections_total", "Sockets closed for falling behind or failing a send.",
+    lambda: manager.stats()["dropped_connections"], type="counter",
+)
+
+registry.callback(
+    "rate_limit_buckets", "Token buckets held, by limit.",
+    lambda: {"messages": message_limits.stats()["buckets"], "frames": frame_limits.stats()["buckets"]}, labelnames=("limit",),
+)
+registry.callback(
+    "rate_limited_total", "Chat messages refused and frames delayed for being over their limit, by limit.",
+    lambda: {"messages": message_limits.limited, "frames": frame_limits.limited}, type="counter", labelnames=("limit",),
+)
+
+registry.callback("db_pool_size", "Connections held by the pool.", _pool("size"), labelnames=("engine",))
+registry.callback("db_pool_checked_out", "Connections currently in use.", _pool("checked_out"), labelnames=("engine",))
+registry.callback("db_pool_saturation", "Share of pool capacity (size + max overflow) in use.", _pool("saturation"), labelnames=("engine",))
+registry.callback("db_pool_checkouts_total", "Connection checkouts.", _pool("checkouts"), type="counter", labelnames=("engine",))
+registry.callback(
+    "db_pool_checkout_wait_seconds_total", "Time spent waiting for a connection.",
+    _pool("checkout_wait_total"), type="counter", labelnames=("engine",),
+)
+registry.callback(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT.",
+    _pool("checkout_timeouts"), type="counter", labelnames=("engine",),
+)
+
+registry.callback("bot_queue_depth", "Threads waiting for a bot reply.", lambda: bot_pool.stats()["queued"])
+registry.callback("bot_running", "Bot replies being generated.", lambda: bot_pool.stats()["running"])
+registry.callback(
+    "bot_requests_coalesced_total", "Bot requests folded into one already queued or running.",
+    lambda: bot_pool.stats()["coalesced"], type="counter",
+)
+registry.callback(
+    "bot_requests_dropped_total", "Bot requests rejected because the queue was full.",
+    lambda: bot_pool.stats()["dropped"], type="counter",
+)
+
+registry.callback(
+    "principal_cache_lookups_total", "Token lookups in the principal cache, by result.",
+    lambda: {"hit": principal_cache.hits, "miss": principal_cache.misses}, type="counter", labelnames=("result",),
+)
+registry.callback("principal_cache_size", "Tokens cached.", lambda: principal_cache.stats()["size"])
+
+registry.callback(
+    "recent_messages_lookups_total", "First-page and bot-context reads of the recent-messages cache, by result.",
+    lambda: {"hit": recent_messages.hits, "miss": recent_messages.misses}, type="counter", labelnames=("result",),
+)
+registry.callback("recent_messages_threads", "Threads held in the recent-messages cache.", lambda: recent_messages.stats()["threads"])
+registry.callback("recent_messages_bytes", "Estimated size of the recent-messages cache.", lambda: recent_messages.stats()["bytes"])
+
+registry.callback("message_archive_partitions", "Monthly message partitions archived to ARCHIVE_DIR.", lambda: archive.stats()["partitions"])
+registry.callback(
+    "message_archive_reads_total", "History reads that fell through to the archive.",
+    lambda: archive.stats()["reads"], type="counter",
+)
+
+registry.callback("password_hash_pending", "Hash and verify calls queued or running.", lambda: password_hasher.pending)
+registry.callback("password_hash_rounds", "Configured bcrypt cost factor (log2 of iterations).", lambda: settings.BCRYPT_ROUNDS)
+
+registry.callback("ingest_pending_messages", "Chat messages waiting to be written.", lambda: ingestor.stats()["pending"])
+registry.callback("presence_online_users", "Users online on this worker.", lambda: presence.stats()["online_users"])
+registry.callback(
+    "user_search_index_users", "Users in the in-memory search index (USER_SEARCH_BACKEND=memory).",
+    lambda: len(user_index) if user_index.loaded else None,
+)
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
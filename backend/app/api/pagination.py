@@ -0,0 +1,48 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+
+# Cursors are opaque to clients: base64url("<timestamp iso>|<uuid>")
+
+def encode_cursor(timestamp: datetime, id: UUID) -> str:
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Ranked results (search) page on (rank, timestamp, id): base64url("<rank>|<timestamp iso>|<uuid>")
+
+def encode_rank_cursor(rank: float, timestamp: datetime, id: UUID) -> str:
+    raw = f"{rank!r}|{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, timestamp, id = raw.split("|", 2)
+        return float(rank), datetime.fromisoformat(timestamp), UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# User search pages on (tier, name, id): base64url("<tier>|<uuid>|<name>"), name last as it may hold "|"
+
+def encode_name_cursor(tier: int, name: str, id: UUID) -> str:
+    raw = f"{tier}|{id}|{name}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_name_cursor(cursor: str) -> Tuple[int, str, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        tier, id, name = raw.split("|", 2)
+        return int(tier), name, UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,98 @@
+"""
+Maintenance commands, run from backend/ against the configured DATABASE_URL.
+
+    python -m app.cli export alice -o alice.ndjson.gz
+    python -m app.cli export alice --thread <uuid> --format csv -o thread.csv
+    python -m app.cli export alice --with-passwords -o alice.ndjson.gz
+    python -m app.cli import alice.ndjson.gz
+    python -m app.cli archive
+
+`export` streams a user's conversations as NDJSON (the import format) or
+CSV; `-o` defaults to stdout, and a .gz name is compressed. `--with-passwords`
+includes password hashes so users can log in after an import elsewhere.
+`import` loads an NDJSON export (.gz or plain, `-` for stdin) with COPY,
+skipping anything that already exists. `archive` writes partitions older
+than ARCHIVE_AFTER_MONTHS to ARCHIVE_DIR; run it from cron.
+"""
+import argparse
+import asyncio
+import gzip
+import sys
+from uuid import UUID
+
+from sqlalchemy import or_, select
+
+from .database import ReadSessionLocal, dispose_engines
+from .models.users import User
+from .services.archive import archive_old_partitions
+from .services.transfer import csv_chunks, export_records, import_records, ndjson_chunks
+
+def _open(path: str, mode: str):
+    if path == "-":
+        return sys.stdin.buffer if mode == "rb" else sys.stdout.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+async def _find_user(name: str) -> UUID:
+    try:
+        condition = User.id == UUID(name)
+    except ValueError:
+        condition = or_(User.username == name, User.phone_number == name)
+    async with ReadSessionLocal() as db:
+        user_id = await db.scalar(select(User.id).where(condition))
+    if user_id is None:
+        raise SystemExit(f"No such user: {name}")
+    return user_id
+
+async def export(args):
+    user_id = await _find_user(args.user)
+    chunks = csv_chunks if args.format == "csv" else ndjson_chunks
+    out = _open(args.output, "wb")
+    try:
+        async for chunk in chunks(export_records(user_id, args.thread, passwords=args.with_passwords)):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+async def import_(args):
+    with _open(args.path, "rb") as lines:
+        counts = await import_records(lines)
+    print(", ".join(f"{count} {kind}" for kind, count in counts.items()), file=sys.stderr)
+
+async def archive(args):
+    for name, rows in (await archive_old_partitions()).items():
+        print(f"Archived {name}: {rows} messages")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="stream a user's conversations")
+    export_parser.add_argument("user", help="username, phone number or id")
+    export_parser.add_argument("--thread", type=UUID, help="only this thread")
+    export_parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    export_parser.add_argument("-o", "--output", default="-")
+    export_parser.add_argument("--with-passwords", action="store_true")
+    export_parser.set_defaults(run=export)
+
+    import_parser = commands.add_parser("import", help="load an NDJSON export")
+    import_parser.add_argument("path")
+    import_parser.set_defaults(run=import_)
+
+    archive_parser = commands.add_parser("archive", help="archive old message partitions")
+    archive_parser.set_defaults(run=archive)
+
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await args.run(args)
+        finally:
+            await dispose_engines()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
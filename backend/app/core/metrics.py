@@ -0,0 +1,273 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters and histograms are updated inline on hot paths, so they are plain
+dicts keyed by label values with no locking (everything runs on the event
+loop). Numbers that components already track (connection counts, pool
+stats, cache hits) are read through callbacks at scrape time instead of
+being duplicated.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Seconds; covers sub-millisecond cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, *labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Callback:
+    """
+    A gauge or counter read at scrape time. `fn` returns a number, or a dict
+    of label value (or tuple of values) -> number.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable, type: str = "gauge", labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for labels, number in value.items():
+                if number is None:
+                    continue
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(number)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable, type: str = "gauge", labelnames: Sequence[str] = ()) -> Callback:
+        return self._add(Callback(name, help, fn, type, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Error rendering metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# HTTP
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, by route template.", ("method", "route")
+)
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests handled, by route template and status code.", ("method", "route", "status")
+)
+
+# WebSockets
+ws_messages = registry.counter("ws_messages_received_total", "Frames received from clients, by type.", ("type",))
+ws_broadcast_duration = registry.histogram(
+    "ws_broadcast_duration_seconds", "Time to encode an event and hand it to every recipient's queue and the broadcast backend's."
+)
+broadcast_publish_failures = registry.counter(
+    "broadcast_publish_failures_total", "Events that never reached the other workers, by reason (error, timeout, queue_full).", ("reason",)
+)
+ws_broadcast_recipients = registry.histogram(
+    "ws_broadcast_recipients", "Local sockets an event was queued on.", buckets=(0, 1, 2, 5, 10, 50, 100, 500, 1000)
+)
+ws_batch_events = registry.histogram(
+    "ws_batch_events", "Events per frame sent to batching (v2) sockets.", buckets=(1, 2, 3, 5, 10, 25, 50, 100)
+)
+ws_catch_up_messages = registry.histogram(
+    "ws_catch_up_messages", "Messages replayed to a reconnecting socket.", buckets=(0, 1, 5, 10, 50, 100, 500)
+)
+ws_frames_dropped = registry.counter(
+    "ws_frames_dropped_total", "Frames discarded because the socket's send queue was full or the send failed."
+)
+ws_frames_oversized = registry.counter(
+    "ws_frames_oversized_total", "Client frames over WS_MAX_FRAME_BYTES; each closes its socket."
+)
+
+# Database
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements, by engine and statement type.", ("engine", "statement")
+)
+
+# Messages
+messages_dropped = registry.counter(
+    "messages_dropped_total", "Chat messages broadcast but never persisted, by reason (rejected, flush_failed, shutdown).", ("reason",)
+)
+
+# Bots
+bot_generation_duration = registry.histogram(
+    "bot_generation_duration_seconds", "Time from a bot reply being picked up to it being sent.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+bot_ttft = registry.histogram(
+    "bot_time_to_first_token_seconds", "Time from a bot reply being picked up to its first chunk.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+bot_generations = registry.counter("bot_generations_total", "Bot replies attempted, by outcome.", ("outcome",))
+
+# Passwords
+password_hash_duration = registry.histogram(
+    "password_hash_duration_seconds", "CPU time of one bcrypt hash or verify at the configured cost, by operation.",
+    ("operation",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0),
+)
+password_hash_queue_wait = registry.histogram(
+    "password_hash_queue_wait_seconds", "Time a hash or verify waited for a free hashing worker, by operation.", ("operation",)
+)
+password_hash_rejected = registry.counter(
+    "password_hash_rejected_total", "Hash or verify calls refused because PASSWORD_HASH_MAX_PENDING were in flight."
+)
+password_hash_upgrades = registry.counter(
+    "password_hash_upgrades_total", "Stored hashes rewritten at the current cost factor on login."
+)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/stream overhead) that
+    records per-route latency. Routes are labelled by their template, e.g.
+    /api/chat/threads/{thread_id}/messages/, to keep cardinality bounded.
+    """
+
+    def __init__(self, app, exclude: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - started, method, template)
+            http_requests.inc(method, template, status_code)
+
+def instrument_engine(engine, name: str):
+    """Time every statement run through an (async) engine via cursor events."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else "OTHER"
+        if verb not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            verb = "OTHER"
+        db_query_duration.observe(time.perf_counter() - started, name, verb)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # after_cursor_execute doesn't fire for a failed statement
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
@@ -0,0 +1,142 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .config import settings
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    The authenticated user as seen by request handlers. A plain immutable
+    snapshot rather than a live ORM User, so it can be cached and shared
+    across requests and sessions.
+    """
+    id: UUID
+    username: str
+    phone_number: str
+    display_name: str
+    is_bot: bool
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            phone_number=user.phone_number,
+            display_name=user.display_name,
+            is_bot=user.is_bot,
+            is_active=user.is_active,
+        )
+
+class PrincipalCache:
+    """
+    LRU + TTL cache of session token -> Principal. An entry never outlives
+    the token's own expiry. Committed account changes drop the user's
+    entries here and, through invalidation_listeners, on the other workers.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[UUID, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation; read it before loading a user and pass it to put()
+        self.generation = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        entry = self._entries.get(token)
+        if entry is not None:
+            principal, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return principal
+            self._remove(token)
+        self.misses += 1
+        return None
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None, generation: Optional[int] = None):
+        # A load that raced an invalidation may have read the old row; don't cache it
+        if generation is not None and generation != self.generation:
+            return
+        ttl = self.ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+        self._remove(token)
+        self._entries[token] = (principal, time.monotonic() + ttl)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_token(self, token: str):
+        self._remove(token)
+
+    def invalidate_user(self, user_id: UUID):
+        self.generation += 1
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+# Called with the user ids each commit invalidated, to tell the other workers (api/deps.py)
+invalidation_listeners: List[Callable[[Set[UUID]], None]] = []
+
+_PENDING = "principal_invalidations"
+
+def _invalidate_on_change(mapper, connection, target):
+    # Any ORM write to an account or its profile drops the cached principal. This runs
+    # at flush; until the commit other sessions still read the old row, so only note it.
+    user_id = getattr(target, "user_id", None) or target.id
+    session = object_session(target)
+    if session is None:
+        principal_cache.invalidate_user(user_id)
+        return
+    session.info.setdefault(_PENDING, set()).add(user_id)
+
+def _after_commit(session):
+    user_ids = session.info.pop(_PENDING, None)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        principal_cache.invalidate_user(user_id)
+    for listener in invalidation_listeners:
+        listener(user_ids)
+
+def _after_rollback(session):
+    # Nothing changed
+    session.info.pop(_PENDING, None)
+
+def register_invalidation(*models):
+    for model in models:
+        event.listen(model, "after_update", _invalidate_on_change)
+        event.listen(model, "after_delete", _invalidate_on_change)
+    if not event.contains(Session, "after_commit", _after_commit):
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
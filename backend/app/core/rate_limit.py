@@ -0,0 +1,91 @@
+import time
+from array import array
+from typing import Dict, Hashable, List, Optional
+
+from .config import settings
+
+# Slots checked for reuse on each take; more than one so the sweep outpaces new keys
+SWEEP_STEP = 2
+
+class TokenBuckets:
+    """
+    One token bucket per key (a user id, a connection), refilling at `rate`
+    tokens per second up to `burst`. A rate of 0 disables the limit.
+
+    State is a slot per key in two flat arrays of doubles (tokens, last
+    update), plus the key -> slot dict: about 100 bytes per key. A bucket
+    that has been idle long enough to refill is the same as no bucket, so a
+    clock hand sweeping a couple of slots per take hands those back for
+    reuse. Memory follows the number of recently active keys rather than
+    every key ever seen.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._slots: Dict[Hashable, int] = {}
+        self._keys: List[Optional[Hashable]] = []
+        self._tokens = array("d")
+        self._updated = array("d")
+        self._free: List[int] = []
+        self._hand = 0
+        self.limited = 0
+
+    def take(self, key: Hashable, cost: float = 1.0) -> float:
+        """Spend `cost` tokens. Returns 0 if allowed, otherwise the seconds until it would be."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._sweep(now)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, self._tokens[slot] + (now - self._updated[slot]) * self.rate)
+        self._updated[slot] = now
+        if tokens >= cost:
+            self._tokens[slot] = tokens - cost
+            return 0.0
+        self._tokens[slot] = tokens
+        self.limited += 1
+        return (cost - tokens) / self.rate
+
+    def release(self, key: Hashable):
+        """Forget a key that won't be seen again (a closed connection)."""
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._keys[slot] = None
+            self._free.append(slot)
+
+    def stats(self) -> dict:
+        return {"buckets": len(self._slots), "slots": len(self._keys), "limited": self.limited}
+
+    def _allocate(self, key: Hashable) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._tokens.append(0.0)
+            self._updated.append(0.0)
+        self._slots[key] = slot
+        return slot
+
+    def _sweep(self, now: float):
+        keys = self._keys
+        if not keys:
+            return
+        refill = self.burst / self.rate
+        for _ in range(min(SWEEP_STEP, len(keys))):
+            slot = self._hand
+            self._hand = (slot + 1) % len(keys)
+            key = keys[slot]
+            if key is not None and now - self._updated[slot] >= refill:
+                self.release(key)
+
+# Chat messages per user, across all of their sockets and the REST endpoint
+message_limits = TokenBuckets(settings.RATE_LIMIT_MESSAGES_PER_SECOND, settings.RATE_LIMIT_MESSAGES_BURST)
+# Frames of any kind per socket
+frame_limits = TokenBuckets(settings.RATE_LIMIT_FRAMES_PER_SECOND, settings.RATE_LIMIT_FRAMES_BURST)
@@ -1,10 +1,21 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Union
+from typing import Any, Optional, Tuple, Union
 from jose import jwt
 from passlib.context import CryptContext
 from .config import settings
+from .metrics import password_hash_duration, password_hash_queue_wait, password_hash_rejected
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below BCRYPT_ROUNDS are flagged by verify_and_update and rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+)
 
 ALGORITHM = "HS256"
 
@@ -24,5 +35,75 @@ def create_access_token(
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # (valid, new hash if the stored one is below the current cost, else None)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+def _timed(fn, submitted: float, *args):
+    # Runs in the worker; time.monotonic is system-wide, so it works across processes too
+    started = time.monotonic()
+    result = fn(*args)
+    return result, started - submitted, time.monotonic() - started
+
+class HasherBusy(Exception):
+    """More password hashes are queued than PASSWORD_HASH_MAX_PENDING allows."""
+
+class PasswordHasher:
+    """
+    Runs bcrypt off the event loop on a dedicated, bounded executor.
+
+    Each hash or verify takes ~100-300ms of CPU at production cost factors; done
+    inline it stalls every socket on the worker. bcrypt releases the GIL, so
+    threads already hash in parallel. "process" trades startup cost for
+    isolation from the loop's own CPU use. Once PASSWORD_HASH_MAX_PENDING calls
+    are in flight, new ones fail fast with HasherBusy instead of queueing for
+    seconds behind a login storm.
+    """
+
+    def __init__(self):
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if settings.PASSWORD_HASH_EXECUTOR == "process":
+                # spawn, not fork: forking a process with a running event loop and threads isn't safe
+                self._executor = ProcessPoolExecutor(
+                    settings.PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        if self.pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            self.rejected += 1
+            password_hash_rejected.inc()
+            raise HasherBusy()
+        self.pending += 1
+        try:
+            result, waited, took = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _timed, fn, time.monotonic(), *args
+            )
+        finally:
+            self.pending -= 1
+        password_hash_queue_wait.observe(waited, operation)
+        password_hash_duration.observe(took, operation)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("verify", verify_and_update_password, plain_password, hashed_password)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
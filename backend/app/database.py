@@ -1,17 +1,123 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .core.config import settings
+from .core.metrics import instrument_engine
 
 # asyncpg requires postgresql+asyncpg://
 DATABASE_URL = settings.DATABASE_URL.replace("postgres://", "postgresql+asyncpg://")
+DATABASE_READ_URL = settings.DATABASE_READ_URL.replace("postgres://", "postgresql+asyncpg://")
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """QueuePool that records how long callers wait to check out a connection."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+    def stats(self) -> dict:
+        capacity = self.size() + self._max_overflow
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            # Share of the pool's capacity (size + max overflow) in use right now
+            "saturation": self.checkedout() / capacity if capacity else 0.0,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "checkout_wait_total": self.checkout_wait_total,
+            "checkout_wait_max": self.checkout_wait_max,
+        }
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        # Set to 0 behind PgBouncer in transaction pooling mode
+        connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    )
+
+class _Sessions(async_sessionmaker):
+    # Sessions bind to the engines on first use, so importing this module stays cheap
+    def __call__(self, **local_kw) -> AsyncSession:
+        if engine is None:
+            init_engines()
+        return super().__call__(**local_kw)
+
+SessionLocal = _Sessions(class_=AsyncSession, expire_on_commit=False)
+ReadSessionLocal = _Sessions(class_=AsyncSession, expire_on_commit=False)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Created by init_engines(): at startup by the app, on first use by scripts
+engine: Optional[AsyncEngine] = None
+# Reads that can tolerate replica lag go here; without a replica it's the primary
+read_engine: Optional[AsyncEngine] = None
 
-SessionLocal = async_sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+def init_engines():
+    global engine, read_engine
+    if engine is not None:
+        return
+    engine = _create_engine(DATABASE_URL)
+    instrument_engine(engine, "primary")
+    read_engine = engine
+    if DATABASE_READ_URL:
+        read_engine = _create_engine(DATABASE_READ_URL)
+        instrument_engine(read_engine, "replica")
+    SessionLocal.configure(bind=engine)
+    ReadSessionLocal.configure(bind=read_engine)
+
+def get_engine() -> AsyncEngine:
+    init_engines()
+    return engine
+
+async def warm_up_pools(connections: int):
+    """Open this many connections per engine now, rather than on the first requests."""
+    init_engines()
+    engines = [engine] if read_engine is engine else [engine, read_engine]
+    for target in engines:
+        opened = await asyncio.gather(*(target.connect() for _ in range(connections)), return_exceptions=True)
+        # Closing hands them back to the pool, which keeps up to DB_POOL_SIZE
+        for conn in opened:
+            if isinstance(conn, BaseException):
+                print(f"Pool warmup failed: {conn}")
+            else:
+                await conn.close()
+
+async def dispose_engines():
+    global engine, read_engine
+    if engine is None:
+        return
+    if read_engine is not engine:
+        await read_engine.dispose()
+    await engine.dispose()
+    engine = read_engine = None
 
 class Base(DeclarativeBase):
     pass
@@ -19,3 +125,38 @@ class Base(DeclarativeBase):
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+# user id -> when they last wrote (monotonic), so their own reads can skip the replica
+_last_write: Dict[UUID, float] = {}
+# Called with the users of every record_write here, to mark them on the other workers too (api/deps.py)
+write_listeners: List[Callable[[Iterable[UUID]], None]] = []
+
+def record_write(*user_ids: UUID):
+    """Note that these users' data just changed on the primary, on every worker."""
+    if read_engine is engine:
+        return
+    mark_written(user_ids)
+    for listener in write_listeners:
+        listener(user_ids)
+
+def mark_written(user_ids: Iterable[UUID]):
+    """record_write for this worker only; how other workers' writes arrive."""
+    now = time.monotonic()
+    for user_id in user_ids:
+        _last_write[user_id] = now
+    if len(_last_write) > 100_000:
+        cutoff = now - settings.DB_READ_YOUR_WRITES_WINDOW
+        for user_id in [u for u, t in _last_write.items() if t < cutoff]:
+            del _last_write[user_id]
+
+def wrote_recently(user_id: UUID) -> bool:
+    written = _last_write.get(user_id)
+    return written is not None and time.monotonic() - written < settings.DB_READ_YOUR_WRITES_WINDOW
+
+def pool_stats() -> dict:
+    if engine is None:
+        return {}
+    stats = {"primary": engine.pool.stats()}
+    if read_engine is not engine:
+        stats["replica"] = read_engine.pool.stats()
+    return stats
@@ -1,25 +1,83 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
-from .api import auth, chat
+from .core.metrics import MetricsMiddleware
+from .core.security import password_hasher
+from .database import dispose_engines, warm_up_pools
+from .api import auth, chat, metrics
 from .websockets import router as ws_router
+from .websockets.manager import manager
+from .services.archive import archive
+from .services.ingest import ingestor
+from .services.presence import presence
+from .services.recent_messages import recent_messages
+from .services.tasks import bot_pool
+from .services.user_search import user_index
 
-app = FastAPI(title=settings.PROJECT_NAME)
-
-# CORS (Keep existing configuration)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Routes
-app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
-app.include_router(chat.router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
-app.include_router(ws_router.router, tags=["websockets"])
-
-@app.get("/")
-async def root():
-    return {"message": "Welcome to Realtime Chat API"}
+# Started in this order, stopped in reverse: background producers stop first,
+# then queued chat messages and presence are flushed before the broadcast
+# backend goes away
+COMPONENTS = (manager, presence, ingestor, bot_pool, recent_messages, user_index, archive)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The first requests shouldn't each pay for a new database connection
+    await warm_up_pools(settings.DB_POOL_WARMUP)
+    started = []
+    try:
+        for component in COMPONENTS:
+            await component.start()
+            started.append(component)
+        yield
+    finally:
+        # Only what actually started, so a failed startup still shuts down cleanly
+        for component in reversed(started):
+            try:
+                await component.stop()
+            except Exception as e:
+                print(f"Error stopping {type(component).__name__}: {e}")
+        password_hasher.stop()
+        await dispose_engines()
+
+def create_app() -> FastAPI:
+    """
+    Build the application. `uvicorn --factory app.main:create_app` calls it
+    once per worker; nothing connects to the database before the lifespan runs.
+    """
+    app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
+
+    # CORS (Keep existing configuration)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Pagination cursors for message history and search
+        expose_headers=["X-Older-Cursor", "X-Newer-Cursor", "X-Next-Cursor"],
+    )
+
+    # Per-route request latency, served from /metrics
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+
+    # Routes
+    app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
+    app.include_router(chat.router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
+    app.include_router(ws_router.router, tags=["websockets"])
+    if settings.METRICS_ENABLED:
+        app.include_router(metrics.router, tags=["metrics"])
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to Realtime Chat API"}
+
+    return app
+
+def __getattr__(name: str):
+    # `uvicorn app.main:app` keeps working, building the app on first access
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
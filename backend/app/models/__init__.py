@@ -1,2 +1,2 @@
 from .users import User, Profile, contact_table
-from .chats import Thread, ChatMessage
+from .chats import Thread, ThreadMember, ChatMessage
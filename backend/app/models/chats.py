@@ -1,32 +1,116 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import String, ForeignKey, Text, DateTime
+from typing import Optional
+from sqlalchemy import Boolean, String, ForeignKey, Text, DateTime, Index, Computed, event, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+from ..core.config import settings
 from ..database import Base
 
+# Text search configuration for message content. Baked into the generated
+# search_vector column, so changing it needs a migration.
+SEARCH_CONFIG = "english"
+
 class Thread(Base):
+    """
+    A conversation. 1:1 threads name their two participants in
+    first_person_id/second_person_id; group threads (is_group) leave both
+    empty and list their members in chat_threadmember (migrations/0006).
+    """
     __tablename__ = "chat_thread"
+    __table_args__ = (
+        # A user's inbox, newest first (migrations/0002)
+        Index("chat_thread_first_person_updated_idx", "first_person_id", "updated"),
+        Index("chat_thread_second_person_updated_idx", "second_person_id", "updated"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    first_person_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"))
-    second_person_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"))
+    first_person_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"), nullable=True)
+    second_person_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"), nullable=True)
     updated: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # With a server default, so raw inserts (bulk import, benches) can leave it out
+    is_group: Mapped[bool] = mapped_column(Boolean, default=False, server_default=text("false"))
+    name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+
+    # Denormalized summary of the newest message, written with every insert
+    last_message_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+    last_message_preview: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    last_message_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_message_user_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
 
     # Relationships
     first_person = relationship("User", foreign_keys=[first_person_id])
     second_person = relationship("User", foreign_keys=[second_person_id])
     messages: Mapped[list["ChatMessage"]] = relationship(back_populates="thread", cascade="all, delete-orphan", order_by="ChatMessage.timestamp.asc()")
 
+class ThreadMember(Base):
+    __tablename__ = "chat_threadmember"
+    __table_args__ = (
+        # The groups a user is in
+        Index("chat_threadmember_user_idx", "user_id", "thread_id"),
+    )
+
+    thread_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("chat_thread.id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"), primary_key=True)
+    # Admins add and remove members; the group's creator is the first
+    is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
+    joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 class ChatMessage(Base):
     __tablename__ = "chat_chatmessage"
+    __table_args__ = (
+        # Serves keyset pagination of a thread's history (migrations/0001)
+        Index("chat_chatmessage_thread_ts_id_idx", "thread_id", "timestamp", "id"),
+        # Full-text message search (migrations/0004)
+        Index("chat_chatmessage_search_idx", "search_vector", postgresql_using="gin"),
+        # One partition per month (migrations/0005, services/archive.py)
+        {"postgresql_partition_by": 'RANGE ("timestamp")'},
+    )
 
+    # The partition key has to be part of the primary key
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     thread_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("chat_thread.id", ondelete="CASCADE"))
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("core_user.id", ondelete="CASCADE"))
     message: Mapped[str] = mapped_column(Text)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow)
+    # Maintained by Postgres on every insert/update; never loaded with the row
+    search_vector = mapped_column(
+        TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', message)", persisted=True), deferred=True
+    )
 
     # Relationships
     thread: Mapped["Thread"] = relationship(back_populates="messages")
     user = relationship("User")
+
+# Monthly partitions of chat_chatmessage are named chat_chatmessage_pYYYY_MM
+PARTITION_PREFIX = "chat_chatmessage_p"
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+def partition_month(name: str) -> Optional[datetime]:
+    """The month a partition covers, or None if the name isn't one of ours."""
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], "%Y_%m") if name.startswith(PARTITION_PREFIX) else None
+    except ValueError:
+        return None
+
+def create_partition_sql(month: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF chat_chatmessage "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+@event.listens_for(ChatMessage.__table__, "after_create")
+def _create_partitions(target, connection, **kw):
+    # create_all only makes the parent; a partitioned table without partitions rejects every insert
+    current = month_start(datetime.utcnow())
+    for months in range(settings.PARTITION_MONTHS_AHEAD + 1):
+        connection.execute(text(create_partition_sql(add_months(current, months))))
@@ -1,7 +1,7 @@
 import uuid
 from typing import List, Optional
 from datetime import datetime
-from sqlalchemy import String, Boolean, DateTime, ForeignKey, Text, Table, Column
+from sqlalchemy import String, Boolean, DateTime, ForeignKey, Text, Table, Column, Index, func, literal_column
 from sqlalchemy.orm import Mapped, relationship, mapped_column
 from sqlalchemy.dialects.postgresql import UUID
 from ..database import Base
@@ -42,6 +42,22 @@ class User(Base):
         backref="added_by"
     )
 
+def phone_digits(column):
+    """A phone number with everything but its digits stripped, e.g. for prefix search."""
+    # Literal arguments rather than bound ones so the expression matches the index below
+    return func.regexp_replace(column, literal_column(r"'\D'"), literal_column("''"), literal_column("'g'"))
+
+def name_key(column):
+    """A lowercased name in code point order, for index-ordered prefix search."""
+    return func.lower(column).collate("C")
+
+# Phone number prefix search (migrations/0003, which also adds the trigram
+# indexes on username and display_name; those need pg_trgm so they aren't declared here)
+Index("core_user_phone_digits_idx", phone_digits(User.phone_number))
+# Name prefix search, read in index order (migrations/0007)
+Index("core_user_username_key_idx", name_key(User.username), User.id)
+Index("core_user_display_name_key_idx", name_key(User.display_name), User.id)
+
 class Profile(Base):
     __tablename__ = "core_profile"
 
@@ -1,2 +1,2 @@
 from .users import UserBase, UserCreate, UserLogin, UserOut, UserUpdate
-from .chats import MessageOut, MessageCreate, ThreadOut, ThreadCreate
+from .chats import MessageOut, MessageCreate, ThreadOut, ThreadCreate, GroupCreate, MembersAdd, ThreadMemberOut
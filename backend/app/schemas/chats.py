@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from uuid import UUID
 from datetime import datetime
 from typing import Optional, List
@@ -23,6 +23,19 @@ class ThreadBase(BaseModel):
 class ThreadCreate(BaseModel):
     user_id: UUID
 
+class GroupCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    # Besides the creator, who is always a member (and its admin)
+    member_ids: List[UUID] = []
+
+class MembersAdd(BaseModel):
+    user_ids: List[UUID] = Field(..., min_length=1)
+
+class ThreadMemberOut(BaseModel):
+    user: UserOut
+    is_admin: bool
+    joined_at: datetime
+
 class LastMessage(BaseModel):
     message: str
     timestamp: datetime
@@ -30,9 +43,40 @@ class LastMessage(BaseModel):
 
 class ThreadOut(BaseModel):
     id: UUID
-    first_person: UUID
-    second_person: UUID
+    # Both None for a group, whose members are listed separately
+    first_person: Optional[UUID] = None
+    second_person: Optional[UUID] = None
+    is_group: bool = False
+    name: Optional[str] = None
     updated: datetime
     last_message: Optional[LastMessage] = None
     model_config = ConfigDict(from_attributes=True)
+
+    @classmethod
+    def from_thread(cls, thread) -> "ThreadOut":
+        # Built from the denormalized summary columns, no message query needed
+        last_message = None
+        if thread.last_message_id is not None:
+            last_message = LastMessage(
+                message=thread.last_message_preview,
+                timestamp=thread.last_message_at,
+                user_id=thread.last_message_user_id,
+            )
+        return cls(
+            id=thread.id,
+            first_person=thread.first_person_id,
+            second_person=thread.second_person_id,
+            is_group=thread.is_group,
+            name=thread.name,
+            updated=thread.updated,
+            last_message=last_message,
+        )
 Template: ThreadOut
+
+class MessageSearchResult(BaseModel):
+    id: UUID
+    thread_id: UUID
+    user: UserOut
+    timestamp: datetime
+    # Excerpt of the message, HTML-escaped, with matches wrapped in <mark>
+    snippet: str
@@ -0,0 +1,105 @@
+"""
+Wire format for chat payloads on the hot paths, built as plain dicts and
+encoded with orjson instead of going through pydantic models.
+
+The shapes match UserOut, MessageOut and ThreadOut, so the OpenAPI schema
+those models describe stays accurate. REST responses and WebSocket events
+use the same builders, so a message looks identical on either path.
+"""
+from datetime import datetime
+from uuid import UUID
+
+import orjson
+from fastapi import Response
+
+def _default(obj):
+    # asyncpg hands back its own UUID subclass, which orjson doesn't pick up natively
+    if isinstance(obj, UUID):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(obj) -> bytes:
+    # UUIDs and datetimes come out in the same format pydantic uses
+    return orjson.dumps(obj, default=_default)
+
+def user_data(user) -> dict:
+    """UserOut fields from a User, Principal or row with the same attributes."""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "phone_number": user.phone_number,
+        "display_name": user.display_name,
+        "is_bot": user.is_bot,
+    }
+
+def message_data(id: UUID, thread_id: UUID, user: dict, message: str, timestamp: datetime) -> dict:
+    """A MessageOut; `user` is a user_data dict."""
+    return {
+        "id": id,
+        "thread_id": thread_id,
+        "user": user,
+        "message": message,
+        "timestamp": timestamp,
+    }
+
+def message_event(data: dict) -> dict:
+    """The new_message WebSocket event for a message_data dict."""
+    return {"type": "new_message", "data": data}
+
+def message_failed_event(message_id: UUID, thread_id: UUID) -> dict:
+    """
+    A message that was already delivered as new_message could not be saved
+    and is gone. Sent to everyone in the thread: remove it, or as its
+    sender, mark it unsent (or resend it).
+    """
+    return {"type": "message_failed", "data": {"id": message_id, "thread_id": thread_id}}
+
+def message_rejected_event(thread_id: UUID = None) -> dict:
+    """A chat_message frame without a valid thread_id and non-empty text; it was not sent."""
+    return {"type": "message_rejected", "data": {"thread_id": thread_id}}
+
+def catch_up_event(messages: list, complete: bool) -> dict:
+    """
+    What a reconnecting socket missed, sent before any live event. If
+    complete is false there was more than one batch's worth: reconnect
+    from the last message, or reload the threads.
+    """
+    return {"type": "catch_up", "data": {"messages": messages, "complete": complete}}
+
+def rate_limited_event(scope: str, retry_after: float, thread_id: UUID = None) -> dict:
+    """
+    A frame was refused or delayed. scope "messages": the chat_message for
+    thread_id was dropped, resend it after retry_after seconds. scope
+    "frames": the socket is sending too fast and is read more slowly.
+    """
+    return {"type": "rate_limited", "data": {"scope": scope, "retry_after": round(retry_after, 3), "thread_id": thread_id}}
+
+def thread_members_event(thread_id: UUID, added=(), removed=()) -> dict:
+    """
+    Users joined or left a group. Sent to its members and to whoever was
+    removed, who should drop the thread. A new group arrives as thread_created.
+    """
+    return {"type": "thread_members", "data": {"thread_id": thread_id, "added": list(added), "removed": list(removed)}}
+
+def thread_data(thread) -> dict:
+    """A ThreadOut, from the thread summary columns (Thread or row)."""
+    last_message = None
+    if thread.last_message_id is not None:
+        last_message = {
+            "message": thread.last_message_preview,
+            "timestamp": thread.last_message_at,
+            "user_id": thread.last_message_user_id,
+        }
+    return {
+        "id": thread.id,
+        "first_person": thread.first_person_id,
+        "second_person": thread.second_person_id,
+        "is_group": thread.is_group,
+        "name": thread.name,
+        "updated": thread.updated,
+        "last_message": last_message,
+    }
+
+def json_response(content, headers: dict = None) -> Response:
+    """Return already-shaped content without FastAPI's validate-then-encode pass."""
+    return Response(content=dumps(content), media_type="application/json", headers=headers)
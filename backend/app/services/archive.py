@@ -0,0 +1,336 @@
+import asyncio
+import gzip
+import os
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+import orjson
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..database import get_engine
+from ..models.chats import add_months, create_partition_sql, month_start, partition_month, partition_name
+from ..models.users import User
+from ..schemas.events import message_data
+from .recent_messages import sender_data
+
+MANIFEST = "manifest.json"
+
+# How often workers add missing future partitions
+PARTITION_CHECK_INTERVAL = 3600.0
+
+# How often readers look for partitions archived by another process
+MANIFEST_CHECK_INTERVAL = 5.0
+
+# pg_advisory_xact_lock key shared by everything that adds or removes partitions
+PARTITION_LOCK = 50_021
+
+# An archived thread-month: (data file, month start, month end, member offset, member length)
+Segment = Tuple[str, datetime, datetime, int, int]
+
+async def attached_partitions(conn) -> Optional[Dict[str, datetime]]:
+    """Monthly partitions currently attached, by name; None if chat_chatmessage isn't partitioned."""
+    kind = await conn.scalar(text("SELECT relkind::text FROM pg_class WHERE oid = 'chat_chatmessage'::regclass"))
+    if kind != "p":
+        return None
+    result = await conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_chatmessage'::regclass
+    """))
+    return {name: partition_month(name) for name in result.scalars() if partition_month(name) is not None}
+
+async def ensure_partitions() -> List[str]:
+    """Create this month's partition and the next PARTITION_MONTHS_AHEAD; returns the names created."""
+    current = month_start(datetime.utcnow())
+    return await create_partitions([add_months(current, n) for n in range(settings.PARTITION_MONTHS_AHEAD + 1)])
+
+async def create_partitions(months: Iterable[datetime]) -> List[str]:
+    """Create the partitions for these months (month starts) that don't exist yet."""
+    async with get_engine().begin() as conn:
+        attached = await attached_partitions(conn)
+        if attached is None:
+            return []
+        missing = [month for month in months if partition_name(month) not in attached]
+        if missing:
+            # Several workers run this; only one creates at a time
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK})
+            for month in missing:
+                await conn.execute(text(create_partition_sql(month)))
+    return [partition_name(month) for month in missing]
+
+def _write_member(out, index: dict, thread_id: UUID, lines: List[bytes]):
+    # One gzip member per thread: concatenated they're still a valid .gz file,
+    # and a thread's history can be read without decompressing anyone else's
+    member = gzip.compress(b"\n".join(lines) + b"\n")
+    index[str(thread_id)] = [out.tell(), len(member), len(lines)]
+    out.write(member)
+
+async def _export(name: str, path: str) -> Tuple[int, dict]:
+    index: Dict[str, list] = {}
+    rows = 0
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        async with get_engine().connect() as conn:
+            result = await conn.stream(
+                text(f'SELECT id, thread_id, user_id, message, "timestamp" FROM {name} ORDER BY thread_id, "timestamp", id')
+                .execution_options(yield_per=5000)
+            )
+            thread_id, lines = None, []
+            async for row in result:
+                if row.thread_id != thread_id:
+                    if lines:
+                        _write_member(out, index, thread_id, lines)
+                    thread_id, lines = row.thread_id, []
+                lines.append(orjson.dumps({
+                    "id": str(row.id), "thread_id": str(row.thread_id), "user_id": str(row.user_id),
+                    "message": row.message, "timestamp": row.timestamp.isoformat(),
+                }))
+                rows += 1
+            if lines:
+                _write_member(out, index, thread_id, lines)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+    return rows, index
+
+def _write_json(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(orjson.dumps(data))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST), "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {"partitions": []}
+
+async def archive_partition(name: str, month: datetime) -> int:
+    """
+    Write one partition to ARCHIVE_DIR, detach it, and (ARCHIVE_DROP_DETACHED)
+    drop it. Returns the number of messages archived.
+    """
+    directory = settings.ARCHIVE_DIR
+    os.makedirs(directory, exist_ok=True)
+    data_file, index_file = f"{name}.ndjson.gz", f"{name}.index.json"
+    rows, index = await _export(name, os.path.join(directory, data_file))
+
+    async with get_engine().connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # CONCURRENTLY keeps reads and writes on the rest of the table going.
+        # If it's interrupted, finish it with DETACH PARTITION ... FINALIZE.
+        await conn.execute(text(f"ALTER TABLE chat_chatmessage DETACH PARTITION {name} CONCURRENTLY"))
+        count = await conn.scalar(text(f"SELECT count(*) FROM {name}"))
+    if count != rows:
+        # Something wrote into the month after the export (an import); nothing can now
+        rows, index = await _export(name, os.path.join(directory, data_file))
+
+    _write_json(os.path.join(directory, index_file), index)
+    manifest = _read_manifest(directory)
+    partitions = [entry for entry in manifest["partitions"] if entry["name"] != name]
+    partitions.append({
+        "name": name,
+        "from": month.isoformat(),
+        "to": add_months(month, 1).isoformat(),
+        "rows": rows,
+        "data": data_file,
+        "index": index_file,
+        "archived_at": datetime.utcnow().isoformat(),
+    })
+    partitions.sort(key=lambda entry: entry["from"])
+    # Readers pick the partition up from here
+    _write_json(os.path.join(directory, MANIFEST), {"partitions": partitions})
+
+    if settings.ARCHIVE_DROP_DETACHED:
+        async with get_engine().begin() as conn:
+            await conn.execute(text(f"DROP TABLE {name}"))
+    return rows
+
+async def archive_old_partitions() -> Dict[str, int]:
+    """Archive every attached partition that ended more than ARCHIVE_AFTER_MONTHS ago."""
+    cutoff = add_months(month_start(datetime.utcnow()), -settings.ARCHIVE_AFTER_MONTHS)
+    async with get_engine().connect() as conn:
+        attached = await attached_partitions(conn) or {}
+    archived = {}
+    for name, month in sorted(attached.items(), key=lambda item: item[1]):
+        if add_months(month, 1) <= cutoff:
+            archived[name] = await archive_partition(name, month)
+    return archived
+
+def _parse(line: bytes):
+    record = orjson.loads(line)
+    return (
+        UUID(record["id"]), UUID(record["thread_id"]), UUID(record["user_id"]),
+        record["message"], datetime.fromisoformat(record["timestamp"]),
+    )
+
+def _key(record):
+    return record[4], record[0]
+
+class MessageArchive:
+    """
+    Messages from partitions that were archived to ARCHIVE_DIR, for history
+    reads that page past what is left in Postgres.
+
+    Archived months are always older than every attached one, so callers
+    read Postgres first and come here for the rest. The manifest and the
+    per-partition thread indexes are held in memory as one map of thread
+    id to archived segments. A read therefore decompresses only the
+    requested thread's data for the months it needs. Partitions archived by
+    another process are picked up within MANIFEST_CHECK_INTERVAL.
+
+    Also runs the loop that keeps future partitions created.
+    """
+
+    def __init__(self):
+        self._threads: Dict[UUID, List[Segment]] = {}
+        self._newest: Optional[datetime] = None
+        self._mtime = None
+        self._checked = 0.0
+        self._task = None
+        self.partitions = 0
+        self.reads = 0
+
+    def stats(self) -> dict:
+        return {"partitions": self.partitions, "threads": len(self._threads), "reads": self.reads}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                created = await ensure_partitions()
+                if created:
+                    print(f"Created message partitions: {', '.join(created)}")
+            except Exception as e:
+                print(f"Error creating message partitions: {e}")
+            await asyncio.sleep(PARTITION_CHECK_INTERVAL)
+
+    async def has_thread(self, thread_id: UUID) -> bool:
+        await self.refresh()
+        return thread_id in self._threads
+
+    def covers(self, timestamp: datetime) -> bool:
+        """Whether `timestamp` falls in (or before) the archived months."""
+        return self._newest is not None and timestamp < self._newest
+
+    async def messages(
+        self,
+        db: AsyncSession,
+        thread_id: UUID,
+        before: Optional[Tuple[datetime, UUID]] = None,
+        after: Optional[Tuple[datetime, UUID]] = None,
+        limit: int = 50,
+    ) -> List[dict]:
+        """
+        Up to `limit` archived messages of a thread as message_data dicts:
+        newest first before a cursor (or from the newest), oldest first
+        after one.
+        """
+        await self.refresh()
+        segments = self._threads.get(thread_id)
+        if not segments:
+            return []
+        self.reads += 1
+        records = await asyncio.to_thread(self._read, segments, before, after, limit)
+        if not records:
+            return []
+        result = await db.execute(
+            select(User.id.label("user_id"), User.username, User.phone_number, User.display_name, User.is_bot)
+            .where(User.id.in_({record[2] for record in records}))
+        )
+        senders = {row.user_id: sender_data(row) for row in result}
+        # A deleted user's messages are gone from Postgres too (ON DELETE CASCADE)
+        return [
+            message_data(id, thread_id, senders[user_id], message, timestamp)
+            for id, thread_id, user_id, message, timestamp in records
+            if user_id in senders
+        ]
+
+    async def records(self, thread_id: UUID) -> AsyncIterator[tuple]:
+        """
+        Every archived message of a thread, oldest first, as
+        (id, thread_id, user_id, message, timestamp). One month in memory at a time.
+        """
+        await self.refresh()
+        for segment in reversed(self._threads.get(thread_id, [])):
+            for record in await asyncio.to_thread(self._read_segment, segment):
+                yield record
+
+    def _read_segment(self, segment: Segment) -> list:
+        path, _, _, offset, length = segment
+        with open(path, "rb") as f:
+            f.seek(offset)
+            member = f.read(length)
+        return [_parse(line) for line in gzip.decompress(member).splitlines()]
+
+    def _read(self, segments: List[Segment], before, after, limit: int) -> list:
+        records = []
+        # Segments are newest month first
+        for segment in (segments if after is None else reversed(segments)):
+            _, start, end, _, _ = segment
+            if before is not None and start > before[0]:
+                continue
+            if after is not None and end <= after[0]:
+                continue
+            chunk = self._read_segment(segment)
+            if after is not None:
+                records.extend(record for record in chunk if _key(record) > after)
+            else:
+                records.extend(record for record in reversed(chunk) if before is None or _key(record) < before)
+            if len(records) >= limit:
+                break
+        return records[:limit]
+
+    async def refresh(self):
+        """Pick up partitions archived since the last check (at most every MANIFEST_CHECK_INTERVAL)."""
+        now = time.monotonic()
+        if now - self._checked < MANIFEST_CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(os.path.join(settings.ARCHIVE_DIR, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        try:
+            self._threads, self._newest, self.partitions = await asyncio.to_thread(self._load)
+            self._mtime = mtime
+        except Exception as e:
+            print(f"Error loading message archive: {e}")
+
+    def _load(self):
+        directory = settings.ARCHIVE_DIR
+        threads: Dict[UUID, List[Segment]] = {}
+        newest = None
+        partitions = _read_manifest(directory)["partitions"]
+        # Newest first, so each thread's segments end up newest first
+        for entry in reversed(partitions):
+            start, end = datetime.fromisoformat(entry["from"]), datetime.fromisoformat(entry["to"])
+            newest = max(newest or end, end)
+            path = os.path.join(directory, entry["data"])
+            with open(os.path.join(directory, entry["index"]), "rb") as f:
+                index = orjson.loads(f.read())
+            for thread_id, (offset, length, _) in index.items():
+                threads.setdefault(UUID(thread_id), []).append((path, start, end, offset, length))
+        return threads, newest, len(partitions)
+
+archive = MessageArchive()
@@ -0,0 +1,56 @@
+import threading
+from typing import Dict, Iterator, List
+
+from ..core.config import settings
+
+class BotModel:
+    """
+    What the bot worker needs from a language model. Both methods are
+    synchronous and run on the bot pool's executor threads.
+
+    Models that can't stream only need generate_response; the default
+    stream_response hands back the whole reply as a single chunk.
+    """
+
+    def generate_response(self, history: List[Dict[str, str]]) -> str:
+        raise NotImplementedError
+
+    def stream_response(self, history: List[Dict[str, str]]) -> Iterator[str]:
+        yield self.generate_response(history)
+
+class FakeBot(BotModel):
+    """
+    Deterministic local stand-in for the LLM, for tests and load runs
+    (BOT_BACKEND=fake). Replies instantly with a fixed transform of the
+    latest user message, streamed a word at a time.
+    """
+
+    def generate_response(self, history: List[Dict[str, str]]) -> str:
+        last = next((h["message"] for h in reversed(history) if h["role"] == "user"), "")
+        return f"You said: {last}"
+
+    def stream_response(self, history: List[Dict[str, str]]) -> Iterator[str]:
+        words = self.generate_response(history).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+
+_bot = None
+_bot_lock = threading.Lock()
+
+def get_bot() -> BotModel:
+    """
+    The shared model client, built on first use and reused for every call.
+    The SDK is only imported then, so workers that never see a bot don't pay
+    for it; the bot pool calls this on its executor threads.
+    """
+    global _bot
+    with _bot_lock:
+        if _bot is None:
+            if settings.BOT_BACKEND == "fake":
+                _bot = FakeBot()
+            elif settings.BOT_BACKEND == "gemini":
+                from .gemini import GeminiBot
+                _bot = GeminiBot()
+            else:
+                raise ValueError(f"Unknown BOT_BACKEND: {settings.BOT_BACKEND}")
+        return _bot
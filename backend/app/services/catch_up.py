@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, tuple_
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models.chats import ChatMessage
+from ..models.users import User
+from .recent_messages import MESSAGE_COLUMNS, message_row_data, recent_messages
+from .threads import get_thread_info, user_thread_ids
+
+def parse_since(since: Optional[str], since_id: Optional[str]) -> Optional[Tuple[datetime, UUID]]:
+    """
+    The client's cursor from the handshake query string: the timestamp and
+    id of the newest message it has seen, exactly as new_message carried
+    them. None when absent or malformed (the client then gets no catch-up).
+    """
+    if not since:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(since)
+        # Stored timestamps are naive UTC
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp, UUID(since_id) if since_id else UUID(int=0)
+    except ValueError:
+        return None
+
+async def messages_since(user_id: UUID, since: Tuple[datetime, UUID]) -> Tuple[List[dict], bool]:
+    """
+    Every message newer than `since` in any of the user's threads, oldest
+    first, as message_data dicts, and whether that's all of them (at most
+    CATCH_UP_LIMIT are returned).
+
+    One statement: the user's threads updated since the cursor (the inbox
+    and membership indexes), then each one's messages after it (the thread/timestamp
+    index). Reads the primary so a reconnect right after a send sees it,
+    and adds messages that were broadcast but aren't committed yet.
+    """
+    timestamp, _ = since
+    limit = settings.CATCH_UP_LIMIT
+    threads = user_thread_ids(user_id, updated_since=timestamp).subquery()
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(*MESSAGE_COLUMNS)
+            .join(User, User.id == ChatMessage.user_id)
+            .where(
+                ChatMessage.thread_id.in_(select(threads.c.id)),
+                tuple_(ChatMessage.timestamp, ChatMessage.id) > tuple_(*since),
+            )
+            .order_by(ChatMessage.timestamp, ChatMessage.id)
+            .limit(limit + 1)
+        )
+        messages = [message_row_data(row) for row in result.all()]
+
+        seen = {message["id"] for message in messages}
+        for data in recent_messages.broadcast_since(since):
+            if data["id"] in seen:
+                continue
+            # Participants are cached, so this rarely queries
+            thread = await get_thread_info(db, data["thread_id"])
+            if thread and user_id in thread.participant_ids:
+                messages.append(data)
+                seen.add(data["id"])
+
+    messages.sort(key=lambda message: (message["timestamp"], message["id"]))
+    return messages[:limit], len(messages) <= limit
@@ -1,7 +1,8 @@
 import google.generativeai as genai
 from ..core.config import settings
+from .bots import BotModel
 
-class GeminiBot:
+class GeminiBot(BotModel):
     def __init__(self):
         if settings.GEMINI_API_KEY:
             genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -9,16 +10,28 @@ class GeminiBot:
         else:
             self.model = None
 
+    def _prompt(self, history):
+        # For now, let's just use the latest message or simplified history
+        return "\n".join([f"{h['role']}: {h['message']}" for h in history])
+
     def generate_response(self, history):
         if not self.model:
             return "AI feature is currently disabled (API key missing)."
-        
-        try:
-            # Format history for Gemini
-            chat = self.model.start_chat(history=[]) # Could pass history here if formatted correctly
-            # For now, let's just use the latest message or simplified history
-            prompt = "\n".join([f"{h['role']}: {h['message']}" for h in history])
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            return f"Error generating response: {str(e)}"
+
+        # Bound the SDK call itself; the worker pool can only stop waiting for it.
+        # Failures propagate, so they are counted as errors and never saved as the reply.
+        response = self.model.generate_content(self._prompt(history), request_options={"timeout": settings.BOT_TIMEOUT})
+        return response.text
+
+    def stream_response(self, history):
+        if not self.model:
+            yield "AI feature is currently disabled (API key missing)."
+            return
+
+        # A failure part way raises out of the iteration, and the worker tells clients message_aborted
+        response = self.model.generate_content(
+            self._prompt(history), stream=True, request_options={"timeout": settings.BOT_TIMEOUT}
+        )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
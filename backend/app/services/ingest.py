@@ -0,0 +1,231 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import bindparam, insert, or_
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as SQLAlchemyTimeoutError
+
+from ..core.config import settings
+from ..core.metrics import messages_dropped
+from ..database import SessionLocal
+from ..models.chats import Thread, ChatMessage
+from ..schemas.events import message_failed_event
+from ..websockets.manager import manager
+from .recent_messages import recent_messages
+from .threads import SUMMARY_COLUMNS, get_thread_info, summary_values
+
+# A message is dropped (and its waiters failed) after this many flushes that couldn't reach the database
+MAX_FLUSH_ATTEMPTS = 5
+
+@dataclass
+class PendingMessage:
+    thread_id: UUID
+    user_id: UUID
+    message: str
+    # Assigned here rather than by the database so we can broadcast before the INSERT
+    id: UUID = field(default_factory=uuid.uuid4)
+    timestamp: datetime = field(default_factory=datetime.utcnow)
+    # Resolved once the batch containing this message has committed
+    persisted: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    attempts: int = 0
+
+class MessageIngestor:
+    """
+    Write-behind persistence for chat messages.
+
+    Messages are queued in memory and written in micro-batches: one multi-row
+    INSERT plus one thread summary UPDATE per thread in the batch, committed
+    together. A batch is flushed every MESSAGE_FLUSH_INTERVAL_MS or as soon as
+    MESSAGE_FLUSH_BATCH_SIZE messages are waiting. A row the database refuses
+    is dropped on its own; the rest of its batch is still written.
+    """
+
+    def __init__(self):
+        self._pending: List[PendingMessage] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending)}
+
+    @property
+    def sync(self) -> bool:
+        # "sync": callers wait for the commit before broadcasting; "async": they don't
+        return settings.MESSAGE_DURABILITY == "sync"
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let an in-flight flush finish rather than cancelling it mid-commit
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # Don't lose whatever is still queued on shutdown: keep retrying until the deadline
+        deadline = time.monotonic() + settings.MESSAGE_SHUTDOWN_TIMEOUT
+        delay = settings.MESSAGE_FLUSH_INTERVAL_MS / 1000
+        while self._pending:
+            try:
+                await self.flush()
+            except Exception as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    lost, self._pending = self._pending, []
+                    await self._drop(lost, e, "shutdown")
+                    break
+                print(f"Error flushing chat messages on shutdown, retrying: {e}")
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, 2.0)
+
+    def submit(self, thread_id: UUID, user_id: UUID, text: str) -> PendingMessage:
+        msg = PendingMessage(thread_id=thread_id, user_id=user_id, message=text)
+        self._pending.append(msg)
+        if len(self._pending) >= settings.MESSAGE_FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+        return msg
+
+    async def _run(self):
+        interval = settings.MESSAGE_FLUSH_INTERVAL_MS / 1000
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing chat messages: {e}")
+                # Back off before retrying the requeued batch
+                await asyncio.sleep(interval)
+
+    async def _drop(self, msgs: List[PendingMessage], error: Exception, reason: str):
+        """Give up on messages that were already broadcast: count them, fail their waiters, retract them."""
+        messages_dropped.inc(reason, amount=len(msgs))
+        print(f"Dropped {len(msgs)} chat messages that could not be saved ({reason}): {error}")
+        for msg in msgs:
+            # Already cached, here and on other workers
+            await recent_messages.retract(msg.thread_id, msg.id)
+            if not msg.persisted.done():
+                msg.persisted.set_exception(error)
+                # Nobody may be waiting; don't leave "exception never retrieved" behind
+                msg.persisted.exception()
+            event = message_failed_event(msg.id, msg.thread_id)
+            try:
+                # Everyone it was delivered to, not just the sender
+                async with SessionLocal() as db:
+                    thread = await get_thread_info(db, msg.thread_id)
+                if thread is not None:
+                    await manager.broadcast_to_thread(thread, event)
+                else:
+                    await manager.broadcast_to_user(msg.user_id, event)
+            except Exception as e:
+                print(f"Error sending message_failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch = self._pending[:settings.MESSAGE_FLUSH_BATCH_SIZE]
+            del self._pending[:len(batch)]
+            if not batch:
+                return
+
+            retry: List[PendingMessage] = []
+            error = await self._save(batch, retry)
+            if retry:
+                # Put them back in front so ordering is preserved on retry,
+                # giving up on messages that keep failing
+                failed = []
+                for msg in retry:
+                    msg.attempts += 1
+                    if msg.attempts >= MAX_FLUSH_ATTEMPTS:
+                        failed.append(msg)
+                self._pending[:0] = [msg for msg in retry if msg.attempts < MAX_FLUSH_ATTEMPTS]
+                if failed:
+                    await self._drop(failed, error, "flush_failed")
+                raise error
+
+    async def _save(self, batch: List[PendingMessage], retry: List[PendingMessage]) -> Optional[Exception]:
+        """
+        Write a batch, splitting it to find any row the database refuses so
+        only that one is dropped. Batches that couldn't reach the database go
+        on `retry`. Returns the last error.
+        """
+        try:
+            await self._write(batch)
+        except Exception as e:
+            if _unreachable(e):
+                retry.extend(batch)
+                return e
+            if len(batch) == 1:
+                await self._drop(batch, e, "rejected")
+                return e
+            middle = len(batch) // 2
+            first = await self._save(batch[:middle], retry)
+            return await self._save(batch[middle:], retry) or first
+        for msg in batch:
+            if not msg.persisted.done():
+                msg.persisted.set_result(None)
+        return None
+
+    async def _write(self, batch: List[PendingMessage]):
+        # Coalesce to one summary update per thread, pointing at its newest message
+        latest: Dict[UUID, PendingMessage] = {}
+        for msg in batch:
+            current = latest.get(msg.thread_id)
+            if current is None or msg.timestamp >= current.timestamp:
+                latest[msg.thread_id] = msg
+
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(ChatMessage).values([
+                    {
+                        "id": msg.id,
+                        "thread_id": msg.thread_id,
+                        "user_id": msg.user_id,
+                        "message": msg.message,
+                        "timestamp": msg.timestamp,
+                    }
+                    for msg in batch
+                ])
+            )
+            thread_table = Thread.__table__
+            await db.execute(
+                thread_table.update()
+                .where(
+                    thread_table.c.id == bindparam("b_thread_id"),
+                    or_(
+                        thread_table.c.last_message_at.is_(None),
+                        thread_table.c.last_message_at <= bindparam("b_updated"),
+                    ),
+                )
+                .values({key: bindparam(f"b_{key}") for key in SUMMARY_COLUMNS}),
+                [
+                    {
+                        "b_thread_id": msg.thread_id,
+                        **{f"b_{key}": value for key, value in summary_values(msg.id, msg.user_id, msg.message, msg.timestamp).items()},
+                    }
+                    for msg in latest.values()
+                ],
+            )
+            await db.commit()
+
+def _unreachable(e: Exception) -> bool:
+    # The database (or the pool) failed us, as opposed to refusing something in the batch
+    return (
+        isinstance(e, (OperationalError, InterfaceError, SQLAlchemyTimeoutError, OSError, asyncio.TimeoutError))
+        or getattr(e, "connection_invalidated", False)
+    )
+
+ingestor = MessageIngestor()
@@ -0,0 +1,290 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Set
+from uuid import UUID
+
+import orjson
+from sqlalchemy import bindparam, select, union_all
+from sqlalchemy.orm import aliased
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models.users import Profile, contact_table
+from ..models.chats import Thread, ThreadMember
+from ..websockets.manager import manager
+
+class _Change:
+    __slots__ = ("was_online", "is_online", "last_seen")
+
+    def __init__(self, was_online: bool, is_online: bool, last_seen: datetime):
+        self.was_online = was_online
+        self.is_online = is_online
+        self.last_seen = last_seen
+
+class PresenceTracker:
+    """
+    Online state kept in memory and written to core_profile in batches.
+
+    Each user has a reference count of their open sockets on this worker, so
+    closing one device doesn't mark them offline while another is still
+    connected. connect/disconnect/heartbeat only touch memory; every
+    PRESENCE_FLUSH_INTERVAL the accumulated changes go out as one batched
+    UPDATE, and contacts get a user_status event for each user that actually
+    went online or offline.
+
+    Workers tell each other (presence events) when a user comes online or
+    goes offline on them, so a user whose last socket here closes while
+    they are still connected to another worker isn't marked offline. That
+    offline is deferred until the other worker reports them gone too, or
+    stops re-asserting them (it died).
+    """
+
+    def __init__(self):
+        self._counts: Dict[UUID, int] = {}
+        self._changes: Dict[UUID, _Change] = {}
+        # user id -> {node id of another worker holding them: when it last said so (monotonic)}
+        self._remote: Dict[UUID, Dict[str, float]] = {}
+        # Users whose last socket here closed while another worker still held them
+        self._deferred: Set[UUID] = set()
+        self._publish_tasks = set()
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._last_refresh = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "online_users": len(self._counts),
+            "pending_changes": len(self._changes),
+            "online_elsewhere": len(self._remote),
+            "deferred_offline": len(self._deferred),
+        }
+
+    def is_online(self, user_id: UUID) -> bool:
+        return self._counts.get(user_id, 0) > 0
+
+    def connect(self, user_id: UUID):
+        count = self._counts.get(user_id, 0)
+        self._counts[user_id] = count + 1
+        if count == 0:
+            self._deferred.discard(user_id)
+            # Already online on another worker: refresh the row, announce nothing
+            self._record(user_id, bool(self._remote.get(user_id)), True)
+            self._spawn_publish(online=[user_id])
+
+    def disconnect(self, user_id: UUID):
+        count = self._counts.get(user_id, 0)
+        if count <= 1:
+            self._counts.pop(user_id, None)
+            if count == 1:
+                self._spawn_publish(offline=self._went_offline([user_id]))
+        else:
+            self._counts[user_id] = count - 1
+
+    def _went_offline(self, user_ids: Iterable[UUID]) -> Dict[UUID, bool]:
+        """
+        The last socket here closed for each of these users. Record them offline
+        unless another worker still holds them; returns which ones were recorded.
+        """
+        recorded = {}
+        for user_id in user_ids:
+            recorded[user_id] = not self._remote.get(user_id)
+            if recorded[user_id]:
+                self._record(user_id, True, False)
+            else:
+                self._deferred.add(user_id)
+        return recorded
+
+    @property
+    def _node_id(self) -> str:
+        return manager.backend.node_id
+
+    async def _publish(self, online: Iterable[UUID] = (), offline: Dict[UUID, bool] = None):
+        offline = offline or {}
+        try:
+            await manager.publish_to_workers({
+                "type": "presence",
+                "data": {
+                    "node": self._node_id,
+                    "online": list(online),
+                    "offline": list(offline),
+                    # Offline users the sender wrote as offline itself, rather than deferring
+                    "recorded": [user_id for user_id, recorded in offline.items() if recorded],
+                },
+            })
+        except Exception as e:
+            print(f"Error publishing presence: {e}")
+
+    def _spawn_publish(self, **kwargs):
+        task = asyncio.create_task(self._publish(**kwargs))
+        self._publish_tasks.add(task)
+        task.add_done_callback(self._publish_tasks.discard)
+
+    def on_remote_event(self, data: str):
+        # Events are encoded with "type" first, so everything else is skipped unparsed
+        if not data.startswith('{"type":"presence"'):
+            return
+        try:
+            event = orjson.loads(data)["data"]
+            node = event["node"]
+            now = time.monotonic()
+            for user_id_str in event["online"]:
+                user_id = UUID(user_id_str)
+                self._remote.setdefault(user_id, {})[node] = now
+                change = self._changes.get(user_id)
+                if change is not None and change.was_online and not change.is_online and user_id not in self._counts:
+                    # An unflushed offline from here, overtaken by them connecting elsewhere
+                    del self._changes[user_id]
+            recorded = set(event["recorded"])
+            for user_id_str in event["offline"]:
+                user_id = UUID(user_id_str)
+                nodes = self._remote.get(user_id)
+                if nodes is not None:
+                    nodes.pop(node, None)
+                    if not nodes:
+                        del self._remote[user_id]
+                if user_id not in self._deferred or user_id in self._remote:
+                    continue
+                # Nobody holds them any more. If the sender deferred too (each thought the
+                # other still had them), exactly one of the two records the offline.
+                self._deferred.discard(user_id)
+                if user_id_str not in recorded and self._node_id < node:
+                    self._record(user_id, True, False)
+        except Exception as e:
+            print(f"Ignoring malformed presence event: {e}")
+
+    def heartbeat(self, user_id: UUID):
+        if self.is_online(user_id):
+            self._record(user_id, True, True)
+
+    def _record(self, user_id: UUID, was_online: bool, is_online: bool):
+        change = self._changes.get(user_id)
+        if change is None:
+            self._changes[user_id] = _Change(was_online, is_online, datetime.utcnow())
+        else:
+            # Keep the state from before the first unflushed change so a quick
+            # reconnect doesn't announce offline+online
+            change.is_online = is_online
+            change.last_seen = datetime.utcnow()
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let an in-flight flush finish rather than cancelling it
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # This worker's sockets are going away with it
+        user_ids = list(self._counts)
+        self._counts.clear()
+        if user_ids:
+            await self._publish(offline=self._went_offline(user_ids))
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.PRESENCE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                if time.monotonic() - self._last_refresh >= settings.PRESENCE_REFRESH_INTERVAL:
+                    self._refresh()
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing presence: {e}")
+
+    def _refresh(self):
+        # Periodically re-assert everyone connected here, to the database and to the
+        # other workers. Keeps last_seen fresh and repairs an offline written by
+        # another worker for a user who is still connected to this one.
+        self._last_refresh = now = time.monotonic()
+        for user_id in self._counts:
+            self._record(user_id, True, True)
+        if self._counts:
+            self._spawn_publish(online=list(self._counts))
+
+        # A worker that stopped re-asserting its users has gone away without saying so
+        cutoff = now - 3 * settings.PRESENCE_REFRESH_INTERVAL
+        for user_id in list(self._remote):
+            nodes = self._remote[user_id]
+            for node in [n for n, seen in nodes.items() if seen < cutoff]:
+                del nodes[node]
+            if not nodes:
+                del self._remote[user_id]
+                if user_id in self._deferred:
+                    self._deferred.discard(user_id)
+                    self._record(user_id, True, False)
+
+    async def flush(self):
+        changes, self._changes = self._changes, {}
+        if not changes:
+            return
+
+        profile_table = Profile.__table__
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    profile_table.update()
+                    .where(profile_table.c.user_id == bindparam("b_user_id"))
+                    .values(is_online=bindparam("b_is_online"), last_seen=bindparam("b_last_seen")),
+                    [
+                        {"b_user_id": user_id, "b_is_online": change.is_online, "b_last_seen": change.last_seen}
+                        for user_id, change in changes.items()
+                    ],
+                )
+                await db.commit()
+
+                transitions = [user_id for user_id, change in changes.items() if change.is_online != change.was_online]
+                contacts = await self._contacts(db, transitions) if transitions else {}
+        except Exception:
+            # Retry on the next tick; anything recorded since is newer and wins
+            for user_id, change in changes.items():
+                self._changes.setdefault(user_id, change)
+            raise
+
+        for user_id in transitions:
+            if not contacts.get(user_id):
+                continue
+            change = changes[user_id]
+            await manager.broadcast_to_users(
+                contacts[user_id],
+                {
+                    "type": "user_status",
+                    "data": {
+                        "user_id": str(user_id),
+                        "is_online": change.is_online,
+                        "last_seen": change.last_seen.isoformat(),
+                    },
+                },
+            )
+
+    async def _contacts(self, db, user_ids: List[UUID]) -> Dict[UUID, Set[UUID]]:
+        """Everyone who shares a thread (1:1 or group) with, or has added, each of the given users."""
+        member, fellow = aliased(ThreadMember), aliased(ThreadMember)
+        pairs = union_all(
+            select(Thread.first_person_id.label("user_id"), Thread.second_person_id.label("contact_id"))
+            .where(Thread.first_person_id.in_(user_ids)),
+            select(Thread.second_person_id, Thread.first_person_id)
+            .where(Thread.second_person_id.in_(user_ids)),
+            select(contact_table.c.friend_id, contact_table.c.user_id)
+            .where(contact_table.c.friend_id.in_(user_ids)),
+            # Fellow members of their groups (PK on thread_id, user_id; index on user_id, thread_id)
+            select(member.user_id, fellow.user_id)
+            .join(fellow, fellow.thread_id == member.thread_id)
+            .where(member.user_id.in_(user_ids), fellow.user_id != member.user_id),
+        )
+        result = await db.execute(pairs)
+        contacts: Dict[UUID, Set[UUID]] = {}
+        for user_id, contact_id in result:
+            contacts.setdefault(user_id, set()).add(contact_id)
+        return contacts
+
+presence = PresenceTracker()
+manager.remote_listeners.append(presence.on_remote_event)
@@ -0,0 +1,255 @@
+import asyncio
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import orjson
+from sqlalchemy import select
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models.chats import ChatMessage
+from ..models.users import User
+from ..schemas.events import message_data
+from ..websockets.manager import manager
+
+# A message and its sender in one row, instead of ORM objects and a lazy user load
+MESSAGE_COLUMNS = (
+    ChatMessage.id, ChatMessage.thread_id, ChatMessage.message, ChatMessage.timestamp,
+    User.id.label("user_id"), User.username, User.phone_number, User.display_name, User.is_bot,
+)
+
+def sender_data(row) -> dict:
+    # user_data for rows where the sender's id comes through as user_id
+    return {
+        "id": row.user_id,
+        "username": row.username,
+        "phone_number": row.phone_number,
+        "display_name": row.display_name,
+        "is_bot": row.is_bot,
+    }
+
+def message_row_data(row) -> dict:
+    return message_data(row.id, row.thread_id, sender_data(row), row.message, row.timestamp)
+
+# Rough per-message overhead of the dicts, UUIDs and datetime on top of the text
+MESSAGE_OVERHEAD_BYTES = 600
+
+# Broadcast messages remembered for merging into fills: covers writes that
+# were broadcast but not yet committed (or replicated) when a fill read them
+BACKLOG_SECONDS = 10.0
+BACKLOG_SIZE = 10_000
+
+def _key(data: dict):
+    return data["timestamp"], data["id"]
+
+def _size(data: dict) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(data["message"])
+
+class _Ring:
+    __slots__ = ("messages", "whole", "size", "loaded_at")
+
+    def __init__(self, messages: List[dict], whole: bool):
+        # Oldest first, at most RECENT_MESSAGES_PER_THREAD
+        self.messages = messages
+        # True when the thread has no messages older than these
+        self.whole = whole
+        self.size = sum(_size(m) for m in messages)
+        self.loaded_at = time.monotonic()
+
+class RecentMessages:
+    """
+    The newest RECENT_MESSAGES_PER_THREAD messages of recently active
+    threads, as message_data dicts, so the first history page and bot
+    context don't have to go to Postgres.
+
+    A thread is loaded from the primary on first read. After that every
+    message broadcast in it is added, whether it was sent on this worker
+    (WebSocket, REST or a bot reply) or arrived from another worker through
+    the broadcast backend. The cache therefore sees exactly the stream
+    clients do. Threads are evicted least recently used once the total
+    passes RECENT_MESSAGES_MAX_BYTES. Each one is reloaded after
+    RECENT_MESSAGES_TTL, so anything this worker missed (a listener
+    reconnect) heals on its own. A message the ingestor gives up on is
+    retracted on every worker.
+    """
+
+    def __init__(self):
+        self._rings: "OrderedDict[UUID, _Ring]" = OrderedDict()
+        self._loading: Dict[UUID, asyncio.Future] = {}
+        self._backlog: Deque[Tuple[float, UUID, dict]] = deque(maxlen=BACKLOG_SIZE)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        if settings.RECENT_MESSAGES_PER_THREAD <= 0:
+            return False
+        # Each worker would only ever see its own messages and serve the rest stale
+        return settings.BROADCAST_BACKEND != "memory" or settings.WEB_CONCURRENCY <= 1
+
+    async def start(self):
+        if settings.RECENT_MESSAGES_PER_THREAD > 0 and not self.enabled:
+            print("Recent messages cache disabled: BROADCAST_BACKEND=memory with more than one worker")
+
+    async def stop(self):
+        pass
+
+    async def latest(self, thread_id: UUID, limit: int) -> Optional[Tuple[List[dict], bool]]:
+        """
+        The newest `limit` messages, oldest first, and whether older ones
+        exist. None if the cache is off or holds fewer than `limit` per thread.
+        """
+        if not self.enabled or limit > settings.RECENT_MESSAGES_PER_THREAD:
+            return None
+        ring = self._rings.get(thread_id)
+        if ring is not None and time.monotonic() - ring.loaded_at < settings.RECENT_MESSAGES_TTL:
+            self.hits += 1
+            self._rings.move_to_end(thread_id)
+        else:
+            self.misses += 1
+            ring = await self._load(thread_id)
+        return ring.messages[-limit:], not ring.whole or len(ring.messages) > limit
+
+    def add(self, data: dict):
+        """Record a message that was just broadcast."""
+        if not self.enabled:
+            return
+        thread_id = data["thread_id"]
+        now = time.monotonic()
+        self._backlog.append((now, thread_id, data))
+        while self._backlog and now - self._backlog[0][0] > BACKLOG_SECONDS:
+            self._backlog.popleft()
+
+        ring = self._rings.get(thread_id)
+        if ring is None:
+            return
+        before = ring.size
+        if self._insert(ring, data):
+            self.size += ring.size - before
+            self._rings.move_to_end(thread_id)
+            self._evict()
+
+    def broadcast_since(self, since: Tuple[datetime, UUID]) -> List[dict]:
+        """Messages broadcast in the last BACKLOG_SECONDS that sort after `since`."""
+        return [data for _, _, data in list(self._backlog) if _key(data) > since]
+
+    def discard(self, thread_id: UUID):
+        ring = self._rings.pop(thread_id, None)
+        if ring is not None:
+            self.size -= ring.size
+
+    async def retract(self, thread_id: UUID, message_id: UUID):
+        """Forget a message that was broadcast but will never be saved, on every worker."""
+        self._retract(thread_id, message_id)
+        try:
+            await manager.publish_to_workers(
+                {"type": "recent_messages_retract", "data": {"thread_id": thread_id, "id": message_id}}
+            )
+        except Exception as e:
+            print(f"Error publishing message retraction: {e}")
+
+    def _retract(self, thread_id: UUID, message_id: UUID):
+        # Out of the backlog too, or the thread's next fill would merge it back
+        if any(data["id"] == message_id for _, _, data in self._backlog):
+            self._backlog = deque((entry for entry in self._backlog if entry[2]["id"] != message_id), maxlen=BACKLOG_SIZE)
+        self.discard(thread_id)
+
+    def on_remote_event(self, data: str):
+        # Events are encoded with "type" first, so most non-messages are skipped unparsed
+        if data.startswith('{"type":"recent_messages_retract"'):
+            try:
+                retracted = orjson.loads(data)["data"]
+                self._retract(UUID(retracted["thread_id"]), UUID(retracted["id"]))
+            except Exception as e:
+                print(f"Ignoring malformed retraction: {e}")
+            return
+        if not data.startswith('{"type":"new_message"'):
+            return
+        try:
+            message = orjson.loads(data)["data"]
+            message["id"] = UUID(message["id"])
+            message["thread_id"] = UUID(message["thread_id"])
+            message["user"]["id"] = UUID(message["user"]["id"])
+            message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+        except Exception as e:
+            print(f"Ignoring malformed message event: {e}")
+            return
+        self.add(message)
+
+    def stats(self) -> dict:
+        return {"threads": len(self._rings), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+    def _insert(self, ring: _Ring, data: dict) -> bool:
+        messages = ring.messages
+        key = _key(data)
+        index = bisect_left(messages, key, key=_key)
+        if index < len(messages) and _key(messages[index]) == key:
+            return False
+        messages.insert(index, data)
+        ring.size += _size(data)
+        while len(messages) > settings.RECENT_MESSAGES_PER_THREAD:
+            ring.size -= _size(messages.pop(0))
+            ring.whole = False
+        return True
+
+    async def _load(self, thread_id: UUID) -> _Ring:
+        # One query per thread however many readers miss at once
+        pending = self._loading.get(thread_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[thread_id] = future
+        try:
+            ring = await self._fetch(thread_id)
+            future.set_result(ring)
+            return ring
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't leave "exception never retrieved" behind
+            future.exception()
+            raise
+        finally:
+            del self._loading[thread_id]
+
+    async def _fetch(self, thread_id: UUID) -> _Ring:
+        per_thread = settings.RECENT_MESSAGES_PER_THREAD
+        # Always the primary: a lagging replica would cache a hole until the TTL
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(*MESSAGE_COLUMNS)
+                .join(User, User.id == ChatMessage.user_id)
+                .where(ChatMessage.thread_id == thread_id)
+                .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                .limit(per_thread + 1)
+            )
+            rows = result.all()
+        whole = len(rows) <= per_thread
+        ring = _Ring([message_row_data(row) for row in reversed(rows[:per_thread])], whole)
+
+        self.discard(thread_id)
+        # Messages broadcast while we were reading (or not yet visible to the read)
+        for _, backlog_thread_id, data in list(self._backlog):
+            if backlog_thread_id == thread_id:
+                self._insert(ring, data)
+        self._rings[thread_id] = ring
+        self.size += ring.size
+        self._evict()
+        return ring
+
+    def _evict(self):
+        while self.size > settings.RECENT_MESSAGES_MAX_BYTES and len(self._rings) > 1:
+            _, ring = self._rings.popitem(last=False)
+            self.size -= ring.size
+
+recent_messages = RecentMessages()
+
+# Messages sent on other workers reach this one as broadcast events
+manager.remote_listeners.append(recent_messages.on_remote_event)
@@ -1,91 +1,268 @@
 import asyncio
-from sqlalchemy.ext.asyncio import AsyncSession
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import select
-from uuid import UUID
+from typing import Dict, List, Optional, Set
+from uuid import UUID, uuid4
+from datetime import datetime
 
-from ..database import SessionLocal
+from ..core.config import settings
+from ..core.metrics import bot_generation_duration, bot_generations, bot_ttft
+from ..database import SessionLocal, record_write
 from ..models.users import User
-from ..models.chats import Thread, ChatMessage
-from ..services.gemini import GeminiBot
+from ..models.chats import ChatMessage
+from ..schemas.events import message_data, message_event, user_data
+from ..services.bots import get_bot
+from ..services.recent_messages import recent_messages
+from ..services.threads import get_thread_info, record_last_message
 from ..websockets.manager import manager
 
-async def handle_bot_response(thread_id: UUID, user_message_text: str):
+# Messages of context sent to the model with each request
+BOT_HISTORY_LENGTH = 10
+
+# Bot users' user_data by id; bots are few and their profiles don't change
+_bot_authors: Dict[UUID, dict] = {}
+
+async def handle_bot_response(thread_id: UUID, executor: Optional[ThreadPoolExecutor] = None):
     """
-    Background task to generate and send AI response.
+    Generate and send the bot's reply to the latest messages in a thread.
+    Returns the time to first token in seconds, or None if nothing was sent.
+
+    Database sessions are only held while loading context and saving the
+    reply, never for the duration of the model call.
     """
     async with SessionLocal() as db:
-        try:
-            # Re-fetch thread
-            thread_res = await db.execute(
-                select(Thread).where(Thread.id == thread_id)
+        thread = await get_thread_info(db, thread_id)
+        if not thread or not thread.bot_user_id:
+            return None
+        bot_user_id = thread.bot_user_id
+
+        author = _bot_authors.get(bot_user_id)
+        if author is None:
+            bot_res = await db.execute(
+                select(User.id, User.username, User.phone_number, User.display_name, User.is_bot).where(User.id == bot_user_id)
             )
-            thread = thread_res.scalars().first()
-            if not thread:
-                return
-
-            # Determine bot user
-            # We need to load users manually as relationships might not be loaded
-            user1_res = await db.execute(select(User).where(User.id == thread.first_person_id))
-            user1 = user1_res.scalars().first()
-            user2_res = await db.execute(select(User).where(User.id == thread.second_person_id))
-            user2 = user2_res.scalars().first()
-
-            bot_user = user1 if user1.is_bot else user2
-            human_user = user2 if user1.is_bot else user1
-            
-            if not bot_user.is_bot:
-                return
-
-            # Fetch history
+            author = _bot_authors[bot_user_id] = user_data(bot_res.first())
+
+        # Fetch history; normally served from the recent-messages cache
+        cached = await recent_messages.latest(thread_id, BOT_HISTORY_LENGTH)
+        if cached is not None:
+            messages = [(m["user"]["id"], m["message"]) for m in cached[0]]
+        else:
             msgs_res = await db.execute(
-                select(ChatMessage)
+                select(ChatMessage.user_id, ChatMessage.message)
                 .where(ChatMessage.thread_id == thread_id)
-                .order_by(ChatMessage.timestamp.desc())
-                .limit(10)
+                .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                .limit(BOT_HISTORY_LENGTH)
             )
-            messages = msgs_res.scalars().all()
+            messages = msgs_res.all()
             messages.reverse() # asc order
 
-            history = []
-            for m in messages:
-                # We need to know if the message user is bot
-                # For simplicity, we assume we know who is who from above
-                role = 'model' if m.user_id == bot_user.id else 'user'
-                history.append({'role': role, 'message': m.message})
-
-            # Generate response
-            bot = GeminiBot()
-            response_text = await asyncio.to_thread(bot.generate_response, history)
-
-            # Save bot message
-            msg = ChatMessage(
-                thread_id=thread_id,
-                user_id=bot_user.id,
-                message=response_text
-            )
-            db.add(msg)
-            await db.commit()
-            await db.refresh(msg)
+    history = [
+        {'role': 'model' if user_id == bot_user_id else 'user', 'message': text}
+        for user_id, text in messages
+    ]
+    # Known up front so deltas and the final message share it
+    message_id = uuid4()
+
+    # Generate response. Only this step is bounded by BOT_TIMEOUT: once there is a
+    # reply, saving and sending it always runs to completion.
+    started = time.perf_counter()
+    response_text, ttft = await asyncio.wait_for(
+        generate_reply(history, executor, thread, message_id, author, started), settings.BOT_TIMEOUT
+    )
+
+    # Save bot message
+    async with SessionLocal() as db:
+        msg = ChatMessage(
+            id=message_id,
+            thread_id=thread_id,
+            user_id=bot_user_id,
+            message=response_text,
+            timestamp=datetime.utcnow(),
+        )
+        db.add(msg)
+        await record_last_message(db, thread_id, msg.id, bot_user_id, msg.message, msg.timestamp)
+        await db.commit()
+    record_write(*thread.participant_ids)
+
+    # Broadcast via WebSocket
+    data = message_data(msg.id, thread_id, author, msg.message, msg.timestamp)
+
+    # Bot included for multi-device
+    await manager.broadcast_to_thread(thread, message_event(data))
+    recent_messages.add(data)
+    return ttft
+
+async def generate_reply(history, executor, thread, message_id, author, started):
+    """The reply text and the time to its first chunk, streamed as deltas if BOT_STREAMING."""
+    loop = asyncio.get_running_loop()
+    # The first call imports the model's SDK, which mustn't stall the event loop
+    bot = await loop.run_in_executor(executor, get_bot)
+    if settings.BOT_STREAMING:
+        return await stream_bot_response(bot, history, executor, thread, message_id, thread.id, author, started)
+    # Abandoning this leaves the SDK call running on its executor thread until the
+    # SDK's own timeout (also BOT_TIMEOUT) ends it
+    response_text = await loop.run_in_executor(executor, bot.generate_response, history)
+    return response_text, time.perf_counter() - started
+
+async def stream_bot_response(bot, history, executor, thread, message_id, thread_id, author, started):
+    """
+    Relay the model's output to both participants as message_delta events
+    while it is generated. Returns the full text and the time to first chunk.
 
-            # Broadcast via WebSocket
-            serialized = {
-                "type": "new_message",
+    Clients append each delta to a pending bubble keyed by the message id;
+    the new_message sent once the reply is saved replaces it. If generation
+    fails part way, message_aborted tells them to drop the bubble.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = bot.stream_response(history)
+    parts: List[str] = []
+    ttft = None
+    try:
+        while True:
+            # One executor hop per chunk; None marks the end of the stream
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            await manager.broadcast_to_thread(thread, {
+                "type": "message_delta",
                 "data": {
-                    "id": str(msg.id),
-                    "thread_id": str(thread.id),
-                    "user": {
-                        "id": str(bot_user.id),
-                        "username": bot_user.username,
-                        "display_name": bot_user.display_name,
-                        "is_bot": True,
-                    },
-                    "message": msg.message,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-            }
-
-            await manager.broadcast_to_user(human_user.id, serialized)
-            await manager.broadcast_to_user(bot_user.id, serialized) # For multi-device
-            
-        except Exception as e:
-            print(f"Error in bot response task: {e}")
+                    "id": message_id,
+                    "thread_id": thread_id,
+                    "user": author,
+                    "seq": len(parts),
+                    "delta": chunk,
+                },
+            })
+            parts.append(chunk)
+    except BaseException:
+        # Includes BOT_TIMEOUT cancelling us
+        if parts:
+            await manager.broadcast_to_thread(thread, {
+                "type": "message_aborted",
+                "data": {"id": message_id, "thread_id": thread_id},
+            })
+        raise
+    return "".join(parts), ttft
+
+class BotWorkerPool:
+    """
+    Bounded queue of threads waiting for a bot reply.
+
+    BOT_CONCURRENCY workers take thread ids off the queue, each generation
+    runs on the pool's own executor threads (never the loop's default one)
+    and is abandoned after BOT_TIMEOUT. A thread is queued at most once: a
+    burst of messages collapses into a single generation that sees all of
+    them, and messages arriving while a reply is being generated schedule
+    exactly one follow-up.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queued: Set[UUID] = set()
+        self._running: Set[UUID] = set()
+        self._rerun: Set[UUID] = set()
+        self.generated = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.dropped = 0
+        # Time to first token, in seconds
+        self.ttft_last: Optional[float] = None
+        self.ttft_total = 0.0
+        self.ttft_count = 0
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(settings.BOT_QUEUE_SIZE)
+        self._executor = ThreadPoolExecutor(max_workers=settings.BOT_CONCURRENCY, thread_name_prefix="bot")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.BOT_CONCURRENCY)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queued.clear()
+        self._running.clear()
+        self._rerun.clear()
+        if self._executor is not None:
+            # Don't wait on a model call that is still stuck in the SDK
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, thread_id: UUID):
+        """Ask for a reply in this thread. Never blocks; drops the request if the queue is full."""
+        if self._queue is None:
+            print("Bot worker pool is not running; dropping bot reply")
+            self.dropped += 1
+            return
+        if thread_id in self._queued:
+            self.coalesced += 1
+            return
+        if thread_id in self._running:
+            # The reply in flight may not include this message; go again once it's done
+            if thread_id in self._rerun:
+                self.coalesced += 1
+            self._rerun.add(thread_id)
+            return
+        try:
+            self._queue.put_nowait(thread_id)
+        except asyncio.QueueFull:
+            print(f"Bot queue full, dropping reply for thread {thread_id}")
+            self.dropped += 1
+            return
+        self._queued.add(thread_id)
+
+    async def _worker(self):
+        while True:
+            thread_id = await self._queue.get()
+            self._queued.discard(thread_id)
+            self._running.add(thread_id)
+            started = time.perf_counter()
+            try:
+                # Times out only while generating (handle_bot_response applies BOT_TIMEOUT)
+                ttft = await handle_bot_response(thread_id, self._executor)
+                self.generated += 1
+                bot_generations.inc("ok")
+                bot_generation_duration.observe(time.perf_counter() - started)
+                if ttft is not None:
+                    self.ttft_last = ttft
+                    self.ttft_total += ttft
+                    self.ttft_count += 1
+                    bot_ttft.observe(ttft)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                bot_generations.inc("timeout")
+                print(f"Bot response timed out for thread {thread_id}")
+            except Exception as e:
+                self.errors += 1
+                bot_generations.inc("error")
+                print(f"Error in bot response task: {e}")
+            finally:
+                self._running.discard(thread_id)
+                self._queue.task_done()
+            if thread_id in self._rerun:
+                self._rerun.discard(thread_id)
+                self.submit(thread_id)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "generated": self.generated,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "ttft_last": self.ttft_last,
+            "ttft_avg": self.ttft_total / self.ttft_count if self.ttft_count else None,
+        }
+
+bot_pool = BotWorkerPool()
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+import orjson
+from sqlalchemy import select, update, or_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import SessionLocal
+from ..models.users import User
+from ..models.chats import Thread, ThreadMember
+from ..schemas.events import thread_members_event
+from ..websockets.manager import manager
+
+# Characters of the newest message kept on chat_thread for the inbox
+PREVIEW_LENGTH = 255
+
+# 1:1 participants never change, so those entries only leave on eviction.
+# Group members are invalidated on every change (on other workers through
+# the thread_members event) and reloaded after GROUP_MEMBERS_TTL regardless.
+THREAD_CACHE_SIZE = 10_000
+GROUP_MEMBERS_TTL = 60.0
+
+class ThreadInfo(NamedTuple):
+    id: UUID
+    participant_ids: FrozenSet[UUID]
+    # The bot in a 1:1 thread with one; groups never get bot replies
+    bot_user_id: Optional[UUID]
+    is_group: bool
+    # participant_ids as the strings sockets are registered under
+    member_keys: FrozenSet[str]
+
+    def other(self, user_id: UUID) -> UUID:
+        """The other participant of a 1:1 thread (the user themself in a self-thread)."""
+        return next((p for p in self.participant_ids if p != user_id), user_id)
+
+_cache: "OrderedDict[UUID, Tuple[ThreadInfo, float]]" = OrderedDict()
+_loading: Dict[UUID, asyncio.Future] = {}
+# Bumped by every invalidation; a load that raced one isn't cached
+_generation = 0
+
+def _cached(thread_id: UUID) -> Optional[ThreadInfo]:
+    entry = _cache.get(thread_id)
+    if entry is None:
+        return None
+    info, loaded_at = entry
+    if info.is_group and time.monotonic() - loaded_at > GROUP_MEMBERS_TTL:
+        return None
+    _cache.move_to_end(thread_id)
+    return info
+
+async def get_thread_info(db: AsyncSession, thread_id: UUID) -> Optional[ThreadInfo]:
+    """Participants of a thread (and which one is a bot), cached in-process."""
+    info = _cached(thread_id)
+    if info is not None:
+        return info
+    # One load per thread however many callers miss at once; they also get
+    # the result in the order they asked, which keeps remote deliveries in order
+    pending = _loading.get(thread_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = asyncio.get_running_loop().create_future()
+    _loading[thread_id] = future
+    try:
+        info = await _load(db, thread_id)
+        future.set_result(info)
+        return info
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't leave "exception never retrieved" behind
+            future.exception()
+        raise
+    finally:
+        del _loading[thread_id]
+
+async def _load(db: AsyncSession, thread_id: UUID) -> Optional[ThreadInfo]:
+    generation = _generation
+    thread_res = await db.execute(
+        select(Thread.id, Thread.first_person_id, Thread.second_person_id, Thread.is_group).where(Thread.id == thread_id)
+    )
+    thread = thread_res.first()
+    if not thread:
+        return None
+
+    if thread.is_group:
+        members = (await db.execute(
+            select(ThreadMember.user_id, User.is_bot).join(User, User.id == ThreadMember.user_id).where(ThreadMember.thread_id == thread_id)
+        )).all()
+        participant_ids = frozenset(member.user_id for member in members)
+        bot_user_id = None
+    else:
+        participant_ids = frozenset((thread.first_person_id, thread.second_person_id))
+        bot_res = await db.execute(select(User.id).where(User.id.in_(participant_ids), User.is_bot.is_(True)))
+        bot_user_id = bot_res.scalars().first()
+    info = ThreadInfo(
+        id=thread.id,
+        participant_ids=participant_ids,
+        bot_user_id=bot_user_id,
+        is_group=thread.is_group,
+        member_keys=frozenset(str(user_id) for user_id in participant_ids),
+    )
+    if generation == _generation:
+        _cache[thread_id] = (info, time.monotonic())
+        if len(_cache) > THREAD_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+def invalidate_thread(thread_id: UUID):
+    """Forget a thread's members on this worker; call after the change commits."""
+    global _generation
+    _generation += 1
+    _cache.pop(thread_id, None)
+
+async def broadcast_members_changed(thread: ThreadInfo, added=(), removed=()):
+    """
+    Tell the group (and whoever just left it) that its members changed. The
+    same event makes every other worker drop its cached members.
+    """
+    invalidate_thread(thread.id)
+    await manager.broadcast_to_users(
+        thread.participant_ids | frozenset(added) | frozenset(removed),
+        thread_members_event(thread.id, added, removed),
+    )
+
+def _on_remote_event(data: str):
+    # Events are encoded with "type" first, so everything else is skipped unparsed
+    if not data.startswith('{"type":"thread_members"'):
+        return
+    try:
+        invalidate_thread(UUID(orjson.loads(data)["data"]["thread_id"]))
+    except Exception as e:
+        print(f"Ignoring malformed thread_members event: {e}")
+
+async def _resolve_members(thread_id: UUID) -> Optional[ThreadInfo]:
+    info = _cached(thread_id)
+    if info is not None:
+        return info
+    async with SessionLocal() as db:
+        return await get_thread_info(db, thread_id)
+
+manager.remote_listeners.append(_on_remote_event)
+# Group events from other workers name the thread, not its members
+manager.thread_resolver = _resolve_members
+
+def user_thread_ids(user_id: UUID, updated_since: Optional[datetime] = None):
+    """
+    Every thread the user is in, as a selectable of ids: either side of a
+    1:1 thread (each on its inbox index) and their group memberships.
+    """
+    sides = [
+        select(Thread.id).where(Thread.first_person_id == user_id),
+        # Don't list a self-thread twice
+        select(Thread.id).where(Thread.second_person_id == user_id, Thread.first_person_id != user_id),
+        select(Thread.id).join(ThreadMember, ThreadMember.thread_id == Thread.id).where(ThreadMember.user_id == user_id),
+    ]
+    if updated_since is not None:
+        sides = [side.where(Thread.updated >= updated_since) for side in sides]
+    return union_all(*sides)
+
+SUMMARY_COLUMNS = ("updated", "last_message_id", "last_message_preview", "last_message_at", "last_message_user_id")
+
+def summary_values(message_id: UUID, user_id: UUID, text: str, timestamp: datetime) -> dict:
+    return {
+        "updated": timestamp,
+        "last_message_id": message_id,
+        "last_message_preview": text[:PREVIEW_LENGTH],
+        "last_message_at": timestamp,
+        "last_message_user_id": user_id,
+    }
+
+async def record_last_message(
+    db: AsyncSession, thread_id: UUID, message_id: UUID, user_id: UUID, text: str, timestamp: datetime
+):
+    """Point the thread summary at a new message; call in the same transaction as its INSERT."""
+    await db.execute(
+        update(Thread)
+        .where(
+            Thread.id == thread_id,
+            # Never let a late writer move the summary backwards
+            or_(Thread.last_message_at.is_(None), Thread.last_message_at <= timestamp),
+        )
+        .values(**summary_values(message_id, user_id, text, timestamp))
+    )
@@ -0,0 +1,310 @@
+import csv
+import io
+import secrets
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from uuid import UUID
+
+import orjson
+from sqlalchemy import select
+
+from ..core.security import get_password_hash
+from ..database import ReadSessionLocal, get_engine
+from ..models.chats import ChatMessage, Thread, ThreadMember, month_start
+from ..models.users import Profile, User
+from ..schemas.events import dumps
+from .archive import archive, create_partitions
+from .threads import PREVIEW_LENGTH, user_thread_ids
+
+# Rows fetched per round trip by the export's server-side cursors
+EXPORT_FETCH_SIZE = 1000
+
+# Records encoded into one chunk of the streamed response
+EXPORT_CHUNK_RECORDS = 500
+
+# Records loaded per COPY round (and per transaction) by the import
+IMPORT_BATCH_SIZE = 50_000
+
+USER_COLUMNS = ("id", "username", "phone_number", "display_name", "password", "is_bot", "date_joined")
+THREAD_COLUMNS = ("id", "first_person_id", "second_person_id", "is_group", "name")
+MEMBER_COLUMNS = ("thread_id", "user_id", "is_admin", "joined_at")
+MESSAGE_COLUMNS = ("id", "thread_id", "user_id", "message", "timestamp")
+
+def _record(type: str, data: dict) -> dict:
+    return {"type": type, "data": data}
+
+async def export_records(user_id: UUID, thread_id: Optional[UUID] = None, passwords: bool = False) -> AsyncIterator[dict]:
+    """
+    A user's conversations (or one of them) as typed records, the format
+    import_records loads:
+
+        {"type": "user", "data": {...}}      everyone taking part
+        {"type": "thread", "data": {...}}
+        {"type": "member", "data": {...}}    who is in each group thread
+        {"type": "message", "data": {...}}   per thread, oldest first, archived months included
+
+    Messages come through a server-side cursor per thread, so memory stays
+    flat however long the history is. Password hashes are only included
+    with `passwords` (moving users between deployments).
+    """
+    async with ReadSessionLocal() as db:
+        query = select(*(getattr(Thread, column) for column in THREAD_COLUMNS)).where(Thread.id.in_(user_thread_ids(user_id)))
+        if thread_id is not None:
+            query = query.where(Thread.id == thread_id)
+        threads = (await db.execute(query)).all()
+
+        group_ids = [thread.id for thread in threads if thread.is_group]
+        members = []
+        if group_ids:
+            members = (await db.execute(
+                select(*(getattr(ThreadMember, column) for column in MEMBER_COLUMNS)).where(ThreadMember.thread_id.in_(group_ids))
+            )).all()
+
+        participant_ids = {user_id}
+        for thread in threads:
+            if not thread.is_group:
+                participant_ids.update((thread.first_person_id, thread.second_person_id))
+        participant_ids.update(member.user_id for member in members)
+        columns = [getattr(User, column) for column in USER_COLUMNS if passwords or column != "password"]
+        for user in await db.execute(select(*columns).where(User.id.in_(participant_ids))):
+            yield _record("user", user._asdict())
+        for thread in threads:
+            yield _record("thread", thread._asdict())
+        for member in members:
+            yield _record("member", member._asdict())
+
+        for thread in threads:
+            # Archived months are older than anything still in Postgres
+            async for record in archive.records(thread.id):
+                yield _record("message", dict(zip(MESSAGE_COLUMNS, record)))
+            result = await db.stream(
+                select(*(getattr(ChatMessage, column) for column in MESSAGE_COLUMNS))
+                .where(ChatMessage.thread_id == thread.id)
+                .order_by(ChatMessage.timestamp, ChatMessage.id)
+                .execution_options(yield_per=EXPORT_FETCH_SIZE)
+            )
+            async for message in result:
+                yield _record("message", message._asdict())
+
+async def ndjson_chunks(records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    lines = []
+    async for record in records:
+        lines.append(dumps(record))
+        if len(lines) >= EXPORT_CHUNK_RECORDS:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+async def csv_chunks(records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Messages only, one row each, with the sender's username; for spreadsheets rather than re-import."""
+    usernames: Dict[UUID, str] = {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("id", "thread_id", "user_id", "username", "timestamp", "message"))
+    rows = 0
+    async for record in records:
+        data = record["data"]
+        if record["type"] == "user":
+            # Users come first
+            usernames[data["id"]] = data["username"]
+        elif record["type"] == "message":
+            writer.writerow((
+                data["id"], data["thread_id"], data["user_id"], usernames.get(data["user_id"], ""),
+                data["timestamp"].isoformat(), data["message"],
+            ))
+            rows += 1
+            if rows % EXPORT_CHUNK_RECORDS == 0:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode()
+
+def _parse_user(data: dict, unusable_password: str) -> tuple:
+    return (
+        UUID(data["id"]), data["username"], data["phone_number"], data.get("display_name", ""),
+        data.get("password") or unusable_password, bool(data.get("is_bot", False)),
+        datetime.fromisoformat(data["date_joined"]) if data.get("date_joined") else datetime.utcnow(),
+    )
+
+def _uuid_or_none(value: Optional[str]) -> Optional[UUID]:
+    return UUID(value) if value else None
+
+def _parse_thread(data: dict) -> tuple:
+    # Exports from before group threads have neither is_group nor name
+    return (
+        UUID(data["id"]), _uuid_or_none(data.get("first_person_id")), _uuid_or_none(data.get("second_person_id")),
+        bool(data.get("is_group", False)), data.get("name"),
+    )
+
+def _parse_member(data: dict) -> tuple:
+    return (
+        UUID(data["thread_id"]), UUID(data["user_id"]), bool(data.get("is_admin", False)),
+        datetime.fromisoformat(data["joined_at"]) if data.get("joined_at") else datetime.utcnow(),
+    )
+
+def _parse_message(data: dict) -> tuple:
+    return UUID(data["id"]), UUID(data["thread_id"]), UUID(data["user_id"]), data["message"], datetime.fromisoformat(data["timestamp"])
+
+class _Batch:
+    def __init__(self):
+        self.users: List[tuple] = []
+        self.threads: List[tuple] = []
+        self.members: List[tuple] = []
+        self.messages: List[tuple] = []
+
+    def __len__(self):
+        return len(self.users) + len(self.threads) + len(self.members) + len(self.messages)
+
+async def import_records(lines: Iterable[bytes]) -> Dict[str, int]:
+    """
+    Load NDJSON records in the export_records format through COPY,
+    IMPORT_BATCH_SIZE at a time, each batch in its own transaction.
+
+    Anything already there is skipped (same id, or a username or phone
+    number that's taken), so an interrupted import can simply be re-run.
+    Group members are skipped if the group or the user didn't make it in.
+    Messages are skipped if their sender or thread didn't make it in, or if
+    they fall in a month that has been archived. Partitions for older months
+    are created as needed, and thread summaries are moved to the newest
+    imported message. Users without a password hash get one nobody knows
+    (they can't log in until it's reset). Returns counts per kind.
+    """
+    # Hashed once: bcrypt per user would take longer than the COPY itself
+    unusable_password = get_password_hash(secrets.token_urlsafe(32))
+    await archive.refresh()
+    counts = {"users": 0, "threads": 0, "members": 0, "messages": 0, "skipped": 0}
+    batch = _Batch()
+    for line in lines:
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        data = record["data"]
+        if record["type"] == "user":
+            batch.users.append(_parse_user(data, unusable_password))
+        elif record["type"] == "thread":
+            batch.threads.append(_parse_thread(data))
+        elif record["type"] == "member":
+            batch.members.append(_parse_member(data))
+        elif record["type"] == "message":
+            message = _parse_message(data)
+            if archive.covers(message[4]):
+                counts["skipped"] += 1
+            else:
+                batch.messages.append(message)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _load(batch, counts)
+            batch = _Batch()
+    if len(batch):
+        await _load(batch, counts)
+    return counts
+
+def _inserted(status: str) -> int:
+    # "INSERT 0 <rows>"
+    return int(status.split()[-1])
+
+async def _load(batch: _Batch, counts: Dict[str, int]):
+    if batch.messages:
+        await create_partitions({month_start(message[4]) for message in batch.messages})
+
+    profile = Profile.__table__.c
+    async with get_engine().connect() as conn:
+        # COPY is only on the driver's connection
+        pg = (await conn.get_raw_connection()).driver_connection
+        async with pg.transaction():
+            if batch.users:
+                await pg.execute("""
+                    CREATE TEMP TABLE import_user (
+                        id uuid, username text, phone_number text, display_name text,
+                        password text, is_bot boolean, date_joined timestamp
+                    ) ON COMMIT DROP
+                """)
+                await pg.copy_records_to_table("import_user", records=batch.users, columns=USER_COLUMNS)
+                # Every user has a profile; only the ones actually inserted get one here
+                status = await pg.execute(
+                    """
+                    WITH inserted AS (
+                        INSERT INTO core_user
+                            (id, username, phone_number, display_name, password, is_bot, is_active, is_staff, is_superuser, date_joined)
+                        SELECT id, username, phone_number, display_name, password, is_bot, true, false, false, date_joined
+                        FROM import_user
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    )
+                    INSERT INTO core_profile (user_id, avatar, bio, is_online, last_seen, is_private)
+                    SELECT id, $1, $2, false, now() AT TIME ZONE 'utc', false FROM inserted
+                    """,
+                    profile.avatar.default.arg, profile.bio.default.arg,
+                )
+                counts["users"] += _inserted(status)
+
+            if batch.threads:
+                await pg.execute("""
+                    CREATE TEMP TABLE import_thread (
+                        id uuid, first_person_id uuid, second_person_id uuid, is_group boolean, name text
+                    ) ON COMMIT DROP
+                """)
+                await pg.copy_records_to_table("import_thread", records=batch.threads, columns=THREAD_COLUMNS)
+                status = await pg.execute("""
+                    INSERT INTO chat_thread (id, first_person_id, second_person_id, is_group, name, updated)
+                    SELECT i.id, i.first_person_id, i.second_person_id, i.is_group, i.name, now() AT TIME ZONE 'utc'
+                    FROM import_thread i
+                    WHERE i.is_group
+                       OR (EXISTS (SELECT 1 FROM core_user u WHERE u.id = i.first_person_id)
+                           AND EXISTS (SELECT 1 FROM core_user u WHERE u.id = i.second_person_id))
+                    ON CONFLICT DO NOTHING
+                """)
+                counts["threads"] += _inserted(status)
+
+            if batch.members:
+                await pg.execute("""
+                    CREATE TEMP TABLE import_member (thread_id uuid, user_id uuid, is_admin boolean, joined_at timestamp) ON COMMIT DROP
+                """)
+                await pg.copy_records_to_table("import_member", records=batch.members, columns=MEMBER_COLUMNS)
+                status = await pg.execute("""
+                    INSERT INTO chat_threadmember (thread_id, user_id, is_admin, joined_at)
+                    SELECT m.thread_id, m.user_id, m.is_admin, m.joined_at
+                    FROM import_member m
+                    JOIN chat_thread t ON t.id = m.thread_id AND t.is_group
+                    JOIN core_user u ON u.id = m.user_id
+                    ON CONFLICT DO NOTHING
+                """)
+                counts["members"] += _inserted(status)
+
+            if batch.messages:
+                await pg.execute("""
+                    CREATE TEMP TABLE import_message (
+                        id uuid, thread_id uuid, user_id uuid, message text, "timestamp" timestamp
+                    ) ON COMMIT DROP
+                """)
+                await pg.copy_records_to_table("import_message", records=batch.messages, columns=MESSAGE_COLUMNS)
+                status = await pg.execute("""
+                    INSERT INTO chat_chatmessage (id, thread_id, user_id, message, "timestamp")
+                    SELECT m.id, m.thread_id, m.user_id, m.message, m."timestamp"
+                    FROM import_message m
+                    JOIN chat_thread t ON t.id = m.thread_id
+                    JOIN core_user u ON u.id = m.user_id
+                    ON CONFLICT DO NOTHING
+                """)
+                inserted = _inserted(status)
+                counts["messages"] += inserted
+                counts["skipped"] += len(batch.messages) - inserted
+                # The same rule as every other write: never move a summary backwards
+                await pg.execute(
+                    """
+                    UPDATE chat_thread t
+                    SET updated = m."timestamp",
+                        last_message_id = m.id,
+                        last_message_preview = left(m.message, $1),
+                        last_message_at = m."timestamp",
+                        last_message_user_id = m.user_id
+                    FROM (
+                        SELECT DISTINCT ON (thread_id) thread_id, id, message, "timestamp", user_id
+                        FROM import_message
+                        WHERE EXISTS (SELECT 1 FROM core_user u WHERE u.id = import_message.user_id)
+                        ORDER BY thread_id, "timestamp" DESC, id DESC
+                    ) m
+                    WHERE t.id = m.thread_id AND (t.last_message_at IS NULL OR t.last_message_at <= m."timestamp")
+                    """,
+                    PREVIEW_LENGTH,
+                )
@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import re
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import event, literal, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..database import SessionLocal
+from ..models.users import User, name_key, phone_digits
+
+# Queries that look like a phone number are also matched against phone digits
+PHONE_QUERY = re.compile(r"^\+?[\d\s\-().]+$")
+
+def _digits(text: str) -> str:
+    return re.sub(r"\D", "", text)
+
+def _digits_upper_bound(prefix: str) -> Optional[str]:
+    """Smallest digit string greater than every string starting with prefix, or None."""
+    digits = prefix.rstrip("9")
+    if not digits:
+        return None
+    return digits[:-1] + str(int(digits[-1]) + 1)
+
+def _upper_bound(prefix: str) -> Optional[str]:
+    """Smallest string greater than every string starting with prefix in code point order, or None."""
+    for i in range(len(prefix) - 1, -1, -1):
+        code = ord(prefix[i]) + 1
+        if code == 0xD800:
+            code = 0xE000  # Skip the surrogates, which can't be encoded
+        if code <= 0x10FFFF:
+            return prefix[:i] + chr(code)
+    return None
+
+# A result's place in the ordering: (tier, name, id). Tier 0 is a username
+# prefix match (an exact match sorts first within it), tier 1 a display name
+# prefix match, tier 2 anything else, ordered by username.
+SearchKey = Tuple[int, str, UUID]
+
+def _key(ql: str, username: str, display_name: str, id: UUID) -> SearchKey:
+    if username.startswith(ql):
+        return (0, username, id)
+    if display_name.startswith(ql):
+        return (1, display_name, id)
+    return (2, username, id)
+
+def search_key(q: str, user: User) -> SearchKey:
+    """Where user sorts among the results for q, e.g. for a page cursor."""
+    return _key(q.strip().lower(), user.username.lower(), (user.display_name or "").lower(), user.id)
+
+def _in_range(column, low: str, high: Optional[str]):
+    return (column >= low) & (column < high) if high else column >= low
+
+async def search_users(db: AsyncSession, q: str, limit: int, after: Optional[SearchKey] = None) -> List[User]:
+    """
+    Users matching q, best matches first, starting after the `after` key.
+
+    Names match anywhere, case-insensitively; a phone-like query also matches
+    phone numbers by digit prefix. Queries shorter than USER_SEARCH_MIN_LENGTH
+    return nothing rather than scanning everyone.
+    """
+    q = q.strip()
+    if len(q) < settings.USER_SEARCH_MIN_LENGTH:
+        return []
+    digits = _digits(q) if PHONE_QUERY.match(q) else ""
+    if len(digits) < settings.USER_SEARCH_MIN_LENGTH:
+        digits = ""
+
+    if settings.USER_SEARCH_BACKEND == "memory":
+        ids = user_index.search(q, digits, limit, after)
+        if not ids:
+            return []
+        result = await db.execute(select(User).where(User.id.in_(ids)))
+        users = {user.id: user for user in result.scalars()}
+        return [users[id] for id in ids if id in users]
+
+    ql = q.lower()
+    upper = _upper_bound(ql)
+    username, display_name = name_key(User.username), name_key(User.display_name)
+    username_prefix = _in_range(username, ql, upper)
+    display_name_prefix = _in_range(display_name, ql, upper)
+
+    # Prefix tiers are range scans of the migrations/0007 indexes, read in index
+    # order and stopped at the limit. Only what they leave of the page falls
+    # through to the substring and phone tier, served by migrations/0003.
+    substring = [User.username.icontains(q, autoescape=True), User.display_name.icontains(q, autoescape=True)]
+    if digits:
+        phone = phone_digits(User.phone_number)
+        substring.append(_in_range(phone, digits, _digits_upper_bound(digits)))
+    tiers = [
+        (username, username_prefix),
+        (display_name, display_name_prefix & ~username_prefix),
+        (username, or_(*substring) & ~username_prefix & ~display_name_prefix),
+    ]
+
+    users: List[User] = []
+    for tier, (name, condition) in enumerate(tiers):
+        if after and tier < after[0]:
+            continue
+        query = select(User).where(condition)
+        if after and tier == after[0]:
+            query = query.where(tuple_(name, User.id) > tuple_(literal(after[1]), literal(after[2])))
+        result = await db.execute(query.order_by(name, User.id).limit(limit - len(users)))
+        users += result.scalars().all()
+        if len(users) == limit:
+            break
+    return users
+
+class UserSearchIndex:
+    """
+    In-process trigram index over usernames and display names, plus a sorted
+    list of phone digits for prefix lookups (USER_SEARCH_BACKEND=memory).
+
+    For deployments without pg_trgm. Every worker holds the full index: it is
+    loaded at startup, kept current by ORM writes made in this process, and
+    rebuilt every USER_SEARCH_REFRESH_INTERVAL to pick up other workers' changes.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._users: Dict[UUID, Tuple[str, str, str]] = {}
+        self._grams: Dict[str, Set[UUID]] = {}
+        self._phones: List[Tuple[str, UUID]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if settings.USER_SEARCH_BACKEND != "memory" or self._task is not None:
+            return
+        await self.load()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.USER_SEARCH_REFRESH_INTERVAL)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Error refreshing user search index: {e}")
+
+    async def load(self):
+        async with SessionLocal() as db:
+            result = await db.stream(
+                select(User.id, User.username, User.display_name, User.phone_number)
+                .execution_options(yield_per=10_000)
+            )
+            rows = [tuple(row) async for row in result]
+        # Build the replacement off the event loop, then swap it in
+        fresh = await asyncio.to_thread(self._build, rows)
+        self._users, self._grams, self._phones = fresh._users, fresh._grams, fresh._phones
+        self.loaded = True
+
+    @classmethod
+    def _build(cls, rows) -> "UserSearchIndex":
+        index = cls()
+        for id, username, display_name, phone_number in rows:
+            index._insert(id, username, display_name, phone_number, sort=False)
+        index._phones.sort()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, id: UUID, username: str, display_name: str, phone_number: str):
+        self.remove(id)
+        self._insert(id, username, display_name, phone_number)
+
+    def _insert(self, id, username, display_name, phone_number, sort=True):
+        entry = (username.lower(), (display_name or "").lower(), _digits(phone_number or ""))
+        self._users[id] = entry
+        for gram in self._trigrams(entry[0]) | self._trigrams(entry[1]):
+            self._grams.setdefault(gram, set()).add(id)
+        if sort:
+            insort(self._phones, (entry[2], id))
+        else:
+            self._phones.append((entry[2], id))
+
+    def remove(self, id: UUID):
+        entry = self._users.pop(id, None)
+        if entry is None:
+            return
+        for gram in self._trigrams(entry[0]) | self._trigrams(entry[1]):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self._grams[gram]
+        i = bisect_left(self._phones, (entry[2], id))
+        if i < len(self._phones) and self._phones[i] == (entry[2], id):
+            del self._phones[i]
+
+    def search(self, q: str, digits: str, limit: int, after: Optional[SearchKey] = None) -> List[UUID]:
+        ql = q.lower()
+        matches: Set[UUID] = set()
+
+        grams = self._trigrams(ql)
+        if grams:
+            # Intersect the smallest posting lists first, then confirm the substring
+            postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for ids in postings[1:]:
+                if not candidates:
+                    break
+                candidates &= ids
+            matches.update(id for id in candidates if ql in self._users[id][0] or ql in self._users[id][1])
+
+        if digits:
+            i = bisect_left(self._phones, (digits,))
+            while i < len(self._phones) and self._phones[i][0].startswith(digits):
+                matches.add(self._phones[i][1])
+                i += 1
+
+        # Same order as the postgres backend; only the requested page needs ordering
+        keys = (_key(ql, *self._users[id][:2], id) for id in matches)
+        if after:
+            keys = (key for key in keys if key > after)
+        return [key[2] for key in heapq.nsmallest(limit, keys)]
+
+user_index = UserSearchIndex()
+
+def _index_user(mapper, connection, target):
+    if user_index.loaded:
+        user_index.add(target.id, target.username, target.display_name, target.phone_number)
+
+def _unindex_user(mapper, connection, target):
+    if user_index.loaded:
+        user_index.remove(target.id)
+
+event.listen(User, "after_insert", _index_user)
+event.listen(User, "after_update", _index_user)
+event.listen(User, "after_delete", _unindex_user)
@@ -1,38 +1,316 @@
 from fastapi import WebSocket
-from typing import Dict, Set, List
-import json
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+import asyncio
+import time
 from uuid import UUID
 
+from ..core.config import settings
+from ..core.metrics import broadcast_publish_failures, ws_batch_events, ws_broadcast_duration, ws_broadcast_recipients, ws_frames_dropped
+from . import protocol as wire
+from .pubsub import BroadcastBackend, InProcessBackend, create_backend
+
+# Recipient of events published for a whole group: "thread:<id>"
+THREAD_RECIPIENT = "thread:"
+
+class Connection:
+    """
+    One registered socket. Outgoing frames go through a bounded queue that a
+    dedicated writer task drains, so a slow client only ever delays itself.
+
+    v2 sockets (see protocol.py) get everything queued within
+    WS_BATCH_WINDOW_MS as one frame, and each sender's profile only once.
+    """
+
+    def __init__(self, manager: "ConnectionManager", user_id_str: str, websocket: WebSocket, protocol: Optional[str] = None):
+        self.manager = manager
+        self.user_id_str = user_id_str
+        self.websocket = websocket
+        self.protocol = protocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        # Senders whose profile this client already has (v2)
+        self.known_users: Set[str] = set()
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def stop(self):
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    def _items(self, event: wire.Outgoing) -> list:
+        if self.protocol is None:
+            return [event.text()]
+        items = [event.compact(self.protocol)]
+        sender = event.sender
+        if sender is not None and str(sender["id"]) not in self.known_users:
+            items.insert(0, event.profile(self.protocol))
+        return items
+
+    def _introduced(self, event: wire.Outgoing):
+        if len(self.known_users) >= wire.KNOWN_USERS_LIMIT:
+            self.known_users.clear()
+        self.known_users.add(str(event.sender["id"]))
+
+    def enqueue(self, event: wire.Outgoing) -> bool:
+        items = self._items(event)
+        if self.queue.maxsize - self.queue.qsize() < len(items):
+            ws_frames_dropped.inc()
+            return False
+        for item in items:
+            self.queue.put_nowait(item)
+        if len(items) > 1:
+            self._introduced(event)
+        return True
+
+    async def send_now(self, event: wire.Outgoing):
+        """Send ahead of anything queued; only valid before start()."""
+        items = self._items(event)
+        if len(items) > 1:
+            self._introduced(event)
+        data = items[0] if self.protocol is None else wire.frame(self.protocol, items)
+        if isinstance(data, bytes):
+            await asyncio.wait_for(self.websocket.send_bytes(data), settings.WS_SEND_TIMEOUT)
+        else:
+            await asyncio.wait_for(self.websocket.send_text(data), settings.WS_SEND_TIMEOUT)
+
+    async def _write_loop(self):
+        window = settings.WS_BATCH_WINDOW_MS / 1000
+        while True:
+            item = await self.queue.get()
+            if self.protocol is not None:
+                # Let a burst accumulate, then send all of it as one frame
+                if window > 0:
+                    await asyncio.sleep(window)
+                items = [item]
+                while len(items) < settings.WS_BATCH_MAX_EVENTS and not self.queue.empty():
+                    items.append(self.queue.get_nowait())
+                ws_batch_events.observe(len(items))
+                item = wire.frame(self.protocol, items)
+            try:
+                if isinstance(item, bytes):
+                    await asyncio.wait_for(self.websocket.send_bytes(item), settings.WS_SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(item), settings.WS_SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Timed out or the socket is gone
+                ws_frames_dropped.inc()
+                self.manager.evict(self)
+                return
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backend: Optional[BroadcastBackend] = None):
         # Maps user_id strings to their active WebSocket connections
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        # Forwards events to sockets held by other workers/nodes
+        self.backend = backend or InProcessBackend()
+        # Connections dropped for overflowing their queue or stalling a send
+        self.dropped_connections = 0
+        self._close_tasks = set()
+        # Called with every encoded event that arrives from another worker
+        self.remote_listeners: List[Callable[[str], None]] = []
+        # Looks up a thread's members for group events from other workers (set by services.threads)
+        self.thread_resolver: Optional[Callable[[UUID], Awaitable[Any]]] = None
+        self._delivery_tasks = set()
+        # Events for the other workers, published in order by one task so a slow
+        # or failing backend never holds up (or breaks) a sender
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.BROADCAST_QUEUE_SIZE)
+        self._publisher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.backend.start(self._deliver_remote)
+        self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def stop(self):
+        if self._publisher is not None:
+            # What was broadcast before shutdown should still reach the other workers
+            try:
+                await asyncio.wait_for(self._outbox.join(), settings.BROADCAST_PUBLISH_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"Dropping {self._outbox.qsize()} unpublished broadcast events on shutdown")
+            self._publisher.cancel()
+            await asyncio.gather(self._publisher, return_exceptions=True)
+            self._publisher = None
+        await self.backend.stop()
+        for task in list(self._delivery_tasks):
+            task.cancel()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections.values()):
+                connection.stop()
+        self.active_connections.clear()
 
-    async def connect(self, user_id: UUID, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, user_id: UUID, websocket: WebSocket, start: bool = True) -> Connection:
+        """
+        Accept and register a socket. With start=False, events for it queue
+        up but nothing is sent until the caller starts the connection, so it
+        can send something ahead of them first (a catch-up).
+        """
+        protocol = wire.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=protocol)
         user_id_str = str(user_id)
+        connection = Connection(self, user_id_str, websocket, protocol)
         if user_id_str not in self.active_connections:
-            self.active_connections[user_id_str] = set()
-        self.active_connections[user_id_str].add(websocket)
+            self.active_connections[user_id_str] = {}
+        self.active_connections[user_id_str][websocket] = connection
+        if start:
+            connection.start()
+        return connection
 
     def disconnect(self, user_id: UUID, websocket: WebSocket):
         user_id_str = str(user_id)
-        if user_id_str in self.active_connections:
-            self.active_connections[user_id_str].remove(websocket)
-            if not self.active_connections[user_id_str]:
-                del self.active_connections[user_id_str]
+        connections = self.active_connections.get(user_id_str)
+        if connections is None:
+            return
+        connection = connections.pop(websocket, None)
+        if connection is not None:
+            connection.stop()
+        if not connections:
+            del self.active_connections[user_id_str]
+
+    def evict(self, connection: Connection):
+        """Drop a connection that can't keep up; its receive loop will see the close."""
+        connections = self.active_connections.get(connection.user_id_str)
+        if connections is None or connections.get(connection.websocket) is not connection:
+            return
+        self.dropped_connections += 1
+        # Whatever was still queued for it goes nowhere
+        ws_frames_dropped.inc(amount=connection.queue.qsize())
+        self.disconnect(connection.user_id_str, connection.websocket)
+        task = asyncio.create_task(self._close(connection.websocket))
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            # 1013: try again later
+            await asyncio.wait_for(websocket.close(code=1013), settings.WS_SEND_TIMEOUT)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        for connections in self.active_connections.values():
+            connection = connections.get(websocket)
+            if connection is not None:
+                if not connection.enqueue(wire.Outgoing(message)):
+                    self.evict(connection)
+                return
 
     async def broadcast_to_user(self, user_id: UUID, message: dict):
-        user_id_str = str(user_id)
-        if user_id_str in self.active_connections:
-            for connection in self.active_connections[user_id_str]:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    # Connection might be stale
-                    pass
-
-manager = ConnectionManager()
+        await self.broadcast_to_users([user_id], message)
+
+    async def broadcast_to_users(self, user_ids: Iterable[UUID], message: dict):
+        started = time.perf_counter()
+        # Encoded once per wire format and shared between every recipient
+        event = wire.Outgoing(message)
+        user_id_strs = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        self._deliver_local(user_id_strs, event)
+        # The users may also be connected to another worker; workers exchange the v1 form
+        await self._publish(user_id_strs, event.text())
+        ws_broadcast_duration.observe(time.perf_counter() - started)
+
+    async def publish_to_workers(self, message: dict):
+        """An event for the other workers' remote_listeners, delivered to no socket."""
+        await self._publish([], wire.Outgoing(message).text())
+
+    async def _publish(self, user_id_strs: List[str], data: str):
+        if self._publisher is None:
+            # Not started (benchmarks): publish inline
+            try:
+                await self.backend.publish(user_id_strs, data)
+            except Exception as e:
+                broadcast_publish_failures.inc("error")
+                print(f"Error publishing broadcast event: {e}")
+            return
+        try:
+            self._outbox.put_nowait((user_id_strs, data))
+        except asyncio.QueueFull:
+            broadcast_publish_failures.inc("queue_full")
+
+    async def _publish_loop(self):
+        while True:
+            user_id_strs, data = await self._outbox.get()
+            try:
+                await asyncio.wait_for(self.backend.publish(user_id_strs, data), settings.BROADCAST_PUBLISH_TIMEOUT)
+            except asyncio.TimeoutError:
+                broadcast_publish_failures.inc("timeout")
+                print(f"Broadcast publish timed out after {settings.BROADCAST_PUBLISH_TIMEOUT}s")
+            except Exception as e:
+                broadcast_publish_failures.inc("error")
+                print(f"Error publishing broadcast event: {e}")
+            finally:
+                self._outbox.task_done()
+
+    async def broadcast_to_thread(self, thread, message: dict):
+        """
+        Send an event to every member of a thread (a ThreadInfo): encoded once,
+        queued on each member's sockets on this worker. Other workers are sent
+        a group's id rather than its member list and look the members up in
+        their own cache, so a 500-member group costs one small publish.
+        """
+        if not thread.is_group:
+            await self.broadcast_to_users(thread.participant_ids, message)
+            return
+        started = time.perf_counter()
+        event = wire.Outgoing(message)
+        self._deliver_members(thread.member_keys, event)
+        await self._publish([THREAD_RECIPIENT + str(thread.id)], event.text())
+        ws_broadcast_duration.observe(time.perf_counter() - started)
+
+    def _deliver_members(self, member_keys: FrozenSet[str], event: wire.Outgoing):
+        # Walk whichever is smaller: the group, or the users connected here
+        if len(member_keys) > len(self.active_connections):
+            self._deliver_local([key for key in self.active_connections if key in member_keys], event)
+        else:
+            self._deliver_local(member_keys, event)
+
+    def _deliver_remote(self, user_id_strs: List[str], data: str):
+        if not user_id_strs:
+            pass
+        elif user_id_strs[0].startswith(THREAD_RECIPIENT):
+            # Nobody here to deliver to, or nothing to look the members up with
+            if self.active_connections and self.thread_resolver is not None:
+                thread_id = UUID(user_id_strs[0][len(THREAD_RECIPIENT):])
+                task = asyncio.create_task(self._deliver_remote_thread(thread_id, wire.Outgoing(text=data)))
+                self._delivery_tasks.add(task)
+                task.add_done_callback(self._delivery_tasks.discard)
+        else:
+            self._deliver_local(user_id_strs, wire.Outgoing(text=data))
+        for listener in self.remote_listeners:
+            listener(data)
+
+    async def _deliver_remote_thread(self, thread_id: UUID, event: wire.Outgoing):
+        try:
+            thread = await self.thread_resolver(thread_id)
+        except Exception as e:
+            print(f"Dropping group event, members unavailable: {e}")
+            return
+        if thread is not None:
+            self._deliver_members(thread.member_keys, event)
+
+    def _deliver_local(self, user_id_strs: Iterable[str], event: wire.Outgoing):
+        delivered = 0
+        for user_id_str in user_id_strs:
+            connections = self.active_connections.get(user_id_str)
+            if not connections:
+                continue
+            for connection in list(connections.values()):
+                if connection.enqueue(event):
+                    delivered += 1
+                else:
+                    self.evict(connection)
+        ws_broadcast_recipients.observe(delivered)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.active_connections),
+            "connections": sum(len(c) for c in self.active_connections.values()),
+            "dropped_connections": self.dropped_connections,
+            "unpublished_events": self._outbox.qsize(),
+            "queued_frames": sum(
+                connection.queue.qsize() for connections in self.active_connections.values() for connection in connections.values()
+            ),
+        }
+
+manager = ConnectionManager(create_backend())
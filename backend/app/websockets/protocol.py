@@ -0,0 +1,126 @@
+"""
+Wire formats for /ws/chat/, picked by Sec-WebSocket-Protocol.
+
+- No subprotocol (v1): one JSON text frame per event, senders inlined as
+  full user objects. What existing clients speak.
+- chat.v2.json / chat.v2.msgpack: every frame is an array of events (text
+  JSON or binary MessagePack), batched per connection. An event's "user"
+  object is replaced by "user_id". The full profile arrives once per
+  connection, as a {"type": "user", "data": {...}} event ahead of the first
+  event that references it, and clients keep them in a map.
+
+permessage-deflate is separate from these formats. uvicorn negotiates it
+for every protocol (ws_per_message_deflate, on by default), and batching
+makes it more effective.
+"""
+from datetime import datetime
+from typing import List, Optional, Union
+from uuid import UUID
+
+import orjson
+
+from ..schemas.events import dumps
+
+try:
+    import msgpack
+except ImportError:  # optional: chat.v2.msgpack is only offered when installed
+    msgpack = None
+
+V2_JSON = "chat.v2.json"
+V2_MSGPACK = "chat.v2.msgpack"
+
+# Profiles a connection is assumed to remember; past this it is sent them again
+KNOWN_USERS_LIMIT = 1000
+
+def negotiate(offered: List[str]) -> Optional[str]:
+    """The first subprotocol the client offered that we speak, or None for v1."""
+    for protocol in offered:
+        if protocol == V2_JSON or (protocol == V2_MSGPACK and msgpack is not None):
+            return protocol
+    return None
+
+def _msgpack_default(obj):
+    # Same representations as the JSON encoding
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type is not MessagePack serializable: {type(obj).__name__}")
+
+def encode(protocol: str, obj) -> Union[str, bytes]:
+    if protocol == V2_MSGPACK:
+        return msgpack.packb(obj, default=_msgpack_default)
+    return dumps(obj).decode()
+
+def frame(protocol: str, items: List[Union[str, bytes]]) -> Union[str, bytes]:
+    """Join already-encoded events into one array frame without re-encoding them."""
+    if protocol == V2_MSGPACK:
+        return msgpack.Packer().pack_array_header(len(items)) + b"".join(items)
+    return "[" + ",".join(items) + "]"
+
+def decode(protocol: Optional[str], message: dict) -> dict:
+    """A client frame; msgpack clients may send binary frames, everyone may send JSON text."""
+    if message.get("bytes") is not None:
+        if protocol != V2_MSGPACK:
+            raise ValueError("Binary frames need the chat.v2.msgpack subprotocol")
+        return msgpack.unpackb(message["bytes"])
+    return orjson.loads(message["text"])
+
+class Outgoing:
+    """
+    One event on its way to any number of sockets. Each wire form is encoded
+    at most once, however many recipients share it.
+    """
+
+    __slots__ = ("_event", "_text", "_compact", "_encoded", "_profiles", "sender")
+
+    def __init__(self, event: Optional[dict] = None, text: Optional[str] = None):
+        # Built locally (event) or forwarded from another worker (text, v1 JSON)
+        self._event = event
+        self._text = text
+        self._compact = None
+        self._encoded = {}
+        self._profiles = {}
+        self.sender = None
+        if event is not None:
+            self._find_sender()
+
+    @property
+    def event(self) -> dict:
+        if self._event is None:
+            self._event = orjson.loads(self._text)
+            self._find_sender()
+        return self._event
+
+    def _find_sender(self):
+        data = self._event.get("data")
+        user = data.get("user") if isinstance(data, dict) else None
+        if isinstance(user, dict):
+            self.sender = user
+
+    def text(self) -> str:
+        """The v1 form."""
+        if self._text is None:
+            self._text = dumps(self._event).decode()
+        return self._text
+
+    def compact(self, protocol: str) -> Union[str, bytes]:
+        """The v2 form: the sender's profile replaced by its id."""
+        encoded = self._encoded.get(protocol)
+        if encoded is None:
+            if self._compact is None:
+                event = self.event
+                self._compact = event
+                if self.sender is not None:
+                    data = {key: value for key, value in event["data"].items() if key != "user"}
+                    data["user_id"] = self.sender["id"]
+                    self._compact = {**event, "data": data}
+            encoded = self._encoded[protocol] = encode(protocol, self._compact)
+        return encoded
+
+    def profile(self, protocol: str) -> Union[str, bytes]:
+        """The user event that introduces this event's sender."""
+        encoded = self._profiles.get(protocol)
+        if encoded is None:
+            encoded = self._profiles[protocol] = encode(protocol, {"type": "user", "data": self.sender})
+        return encoded
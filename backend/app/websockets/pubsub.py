@@ -0,0 +1,283 @@
+import asyncio
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ..core.config import settings
+
+# Called with (user_ids, encoded event) for every event that arrives from another worker
+DeliverCallback = Callable[[List[str], str], None]
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Worst case UTF-8 is 4 bytes per character, so chunks of this size always fit
+NOTIFY_CHUNK_CHARS = 1900
+# Seconds to wait for the rest of a chunked event; one lost NOTIFY would otherwise keep the others forever
+CHUNK_TIMEOUT = 30.0
+
+
+class BroadcastBackend(ABC):
+    """
+    Transport that carries events between workers.
+
+    ConnectionManager always delivers to its own sockets first, so a backend
+    only has to reach the *other* workers/nodes and must not echo events
+    back to the process that published them.
+    """
+
+    def __init__(self):
+        # Identifies this process so we can drop our own events
+        self.node_id = uuid.uuid4().hex
+        self._deliver: Optional[DeliverCallback] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+
+    @abstractmethod
+    async def publish(self, user_ids: List[str], data: str):
+        """Send an encoded event for these users to every other worker."""
+
+    def _encode(self, user_ids: List[str], data: str) -> str:
+        # "<node_id>|<user_id>,<user_id>|<event>" - the event is forwarded as-is, never re-serialized
+        return f"{self.node_id}|{','.join(user_ids)}|{data}"
+
+    def _dispatch(self, payload: str):
+        node_id, user_ids, data = payload.split("|", 2)
+        if node_id == self.node_id or self._deliver is None:
+            return
+        # No recipients: an event for the other workers themselves (publish_to_workers)
+        self._deliver(user_ids.split(",") if user_ids else [], data)
+
+
+class InProcessBackend(BroadcastBackend):
+    """Single worker: every socket lives in this process, nothing to forward."""
+
+    async def publish(self, user_ids: List[str], data: str):
+        return None
+
+
+class PostgresBackend(BroadcastBackend):
+    """
+    Fan-out over Postgres LISTEN/NOTIFY, so every worker and node pointed at
+    the same database receives every event.
+    """
+
+    def __init__(self, dsn: str, channel: str):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self._listen_conn = None
+        self._publish_conn = None
+        self._publish_lock = asyncio.Lock()
+        # chunk id -> (first seen, monotonic; parts received so far)
+        self._chunks: Dict[str, Tuple[float, List[Optional[str]]]] = {}
+        self._closing = False
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        self._closing = False
+        await self._listen()
+        self._publish_conn = await self._connect()
+
+    async def stop(self):
+        self._closing = True
+        await super().stop()
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        self._listen_conn = None
+        self._publish_conn = None
+
+    async def _connect(self):
+        import asyncpg
+        return await asyncpg.connect(self.dsn)
+
+    async def _listen(self):
+        self._listen_conn = await self._connect()
+        self._listen_conn.add_termination_listener(self._on_listener_lost)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+
+    def _on_listener_lost(self, conn):
+        if self._closing:
+            return
+        task = asyncio.create_task(self._reconnect_listener())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reconnect_listener(self):
+        delay = 0.5
+        while not self._closing:
+            try:
+                await self._listen()
+                return
+            except Exception as e:
+                print(f"Broadcast listener reconnect failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    async def publish(self, user_ids: List[str], data: str):
+        payload = self._encode(user_ids, data)
+        if len(payload.encode()) <= NOTIFY_PAYLOAD_LIMIT:
+            parts = [payload]
+        else:
+            # Oversized events travel as numbered chunks: "#<id>:<index>:<total>|<data>"
+            chunk_id = uuid.uuid4().hex
+            pieces = [payload[i:i + NOTIFY_CHUNK_CHARS] for i in range(0, len(payload), NOTIFY_CHUNK_CHARS)]
+            parts = [f"#{chunk_id}:{i}:{len(pieces)}|{piece}" for i, piece in enumerate(pieces)]
+
+        async with self._publish_lock:
+            if self._publish_conn is None or self._publish_conn.is_closed():
+                self._publish_conn = await self._connect()
+            try:
+                for part in parts:
+                    await self._publish_conn.execute("SELECT pg_notify($1, $2)", self.channel, part)
+            except BaseException:
+                # A failed or timed-out NOTIFY may leave the connection mid-query; start the next one afresh
+                self._publish_conn.terminate()
+                self._publish_conn = None
+                raise
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        try:
+            if payload.startswith("#"):
+                header, data = payload[1:].split("|", 1)
+                chunk_id, index, total = header.split(":")
+                entry = self._chunks.get(chunk_id)
+                if entry is None:
+                    self._sweep_chunks()
+                    entry = self._chunks[chunk_id] = (time.monotonic(), [None] * int(total))
+                parts = entry[1]
+                parts[int(index)] = data
+                if any(part is None for part in parts):
+                    return
+                del self._chunks[chunk_id]
+                payload = "".join(parts)
+            self._dispatch(payload)
+        except Exception as e:
+            print(f"Dropping malformed broadcast payload: {e}")
+
+    def _sweep_chunks(self):
+        # Runs whenever a new chunked event starts, so incomplete ones can't pile up
+        cutoff = time.monotonic() - CHUNK_TIMEOUT
+        for chunk_id in [c for c, (first_seen, _) in self._chunks.items() if first_seen < cutoff]:
+            del self._chunks[chunk_id]
+            print(f"Dropping incomplete broadcast event {chunk_id}: chunks missing after {CHUNK_TIMEOUT}s")
+
+
+class LocalSocketHub:
+    """
+    Tiny relay on a unix socket: every line a peer writes is copied to all
+    other peers. Used by LocalSocketBackend as a stand-in for a real broker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                for peer in list(self._peers):
+                    if peer is writer:
+                        continue
+                    try:
+                        peer.write(line)
+                    except Exception:
+                        self._peers.discard(peer)
+        except (ConnectionError, asyncio.CancelledError):
+            # Peer went away or the hub is shutting down
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+class LocalSocketBackend(BroadcastBackend):
+    """
+    Fan-out between processes on one machine over a unix socket. The first
+    worker to start hosts the hub; the rest connect to it. Meant for tests and
+    local multi-worker runs, not for production.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.hub: Optional[LocalSocketHub] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        try:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Nobody is hosting the hub yet (or a stale socket file was left behind)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.hub = LocalSocketHub(self.path)
+            await self.hub.start()
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+
+        task = asyncio.create_task(self._read_loop())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        await super().stop()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.hub is not None:
+            await self.hub.stop()
+            self.hub = None
+
+    async def publish(self, user_ids: List[str], data: str):
+        if self._writer is None:
+            return
+        # Encoded events never contain a raw newline, so lines frame them safely
+        self._writer.write(self._encode(user_ids, data).encode() + b"\n")
+        await self._writer.drain()
+
+    async def _read_loop(self):
+        while line := await self._reader.readline():
+            try:
+                self._dispatch(line.decode().rstrip("\n"))
+            except Exception as e:
+                print(f"Dropping malformed broadcast payload: {e}")
+
+
+def create_backend() -> BroadcastBackend:
+    kind = settings.BROADCAST_BACKEND
+    if kind == "postgres":
+        # asyncpg wants a plain postgresql:// DSN, not the SQLAlchemy driver URL
+        dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://").replace("postgres://", "postgresql://")
+        return PostgresBackend(dsn, settings.BROADCAST_CHANNEL)
+    if kind == "socket":
+        return LocalSocketBackend(settings.BROADCAST_SOCKET_PATH)
+    if kind == "memory":
+        return InProcessBackend()
+    raise ValueError(f"Unknown BROADCAST_BACKEND: {kind}")
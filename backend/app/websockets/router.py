@@ -1,26 +1,40 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select
 from jose import jwt
-import json
+import asyncio
 from uuid import UUID
-from datetime import datetime
+from typing import Optional, Tuple
 
-from ..database import get_db
+from ..database import SessionLocal, record_write
 from ..core.config import settings
 from ..core.security import ALGORITHM
-from ..models.users import User, Profile
-from ..models.chats import Thread, ChatMessage
-from .manager import manager
+from ..core.metrics import ws_catch_up_messages, ws_frames_oversized, ws_messages
+from ..core.rate_limit import frame_limits, message_limits
+from ..core.principal import Principal, principal_cache
+from ..schemas import events
+from ..models.users import User
+from ..services.catch_up import messages_since, parse_since
+from ..services.ingest import ingestor
+from ..services.presence import presence
+from ..services.recent_messages import recent_messages
+from ..services.tasks import bot_pool
+from ..services.threads import get_thread_info
+from . import protocol as wire
+from .manager import Connection, manager
 
 router = APIRouter()
 
-async def get_user_from_ws(websocket: WebSocket, db: AsyncSession):
+async def get_user_from_ws(websocket: WebSocket, db: AsyncSession) -> Optional[Principal]:
     # For WebSockets, middleware might not have processed cookies the same way
     # Or we look at headers/cookies manually
     token = websocket.cookies.get("sessionid")
     if not token:
         return None
+
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
@@ -28,95 +42,149 @@ async def get_user_from_ws(websocket: WebSocket, db: AsyncSession):
         if not user_id:
             return None
         
-        result = await db.execute(select(User).where(User.id == user_id))
-        return result.scalars().first()
+        generation = principal_cache.generation
+        result = await db.execute(select(User).where(User.id == UUID(user_id)))
+        user = result.scalars().first()
+        if not user:
+            return None
+        principal = Principal.from_user(user)
+        principal_cache.put(token, principal, payload.get("exp"), generation)
+        return principal
     except Exception:
         return None
 
 @router.websocket("/ws/chat/")
-async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
-    user = await get_user_from_ws(websocket, db)
+async def websocket_endpoint(websocket: WebSocket):
+    # Sessions are opened per unit of work instead of per socket, so idle
+    # connections don't pin a pooled database connection.
+    async with SessionLocal() as db:
+        user = await get_user_from_ws(websocket, db)
+
     if not user:
         await websocket.close(code=4001)
         return
 
-    await manager.connect(user.id, websocket)
-    
-    # Set online status
-    await db.execute(
-        update(Profile).where(Profile.user_id == user.id).values(is_online=True)
-    )
-    # This was moved to inside the message handling loop to ensure it's updated on activity
-    # await db.execute(
-    #     update(Profile).where(Profile.user_id == user.id).values(is_online=True)
-    # )
-    # await db.commit()
+    # A reconnecting client passes the newest message it has: ?since=<timestamp>&since_id=<id>
+    since = parse_since(websocket.query_params.get("since"), websocket.query_params.get("since_id"))
+    connection = await manager.connect(user.id, websocket, start=since is None)
+    # Online status is tracked in memory and flushed in batches
+    presence.connect(user.id)
 
     try:
+        if since is not None:
+            await send_catch_up(connection, user, since)
         while True:
             # Receive messages from client (if any)
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            payload = message.get("text") if message.get("text") is not None else message.get("bytes")
+            if payload is not None and frame_bytes(payload) > settings.WS_MAX_FRAME_BYTES:
+                ws_frames_oversized.inc()
+                # 1009: message too big
+                await websocket.close(code=1009)
+                break
+            # Over the frame rate, stop reading for a while: the client's sends back up behind TCP
+            delay = frame_limits.take(connection)
+            if delay:
+                notify_rate_limited(connection, "frames", delay)
+                await asyncio.sleep(delay)
+
+            message_data = wire.decode(connection.protocol, message)
+            message_type = message_data.get("type")
+            # Unknown types share one label so clients can't grow the series
+            ws_messages.inc(message_type if message_type in ("chat_message", "heartbeat") else "other")
             
             if message_data.get("type") == "chat_message":
-                thread_id = UUID(message_data.get("thread_id"))
-                text = message_data.get("message")
-                
-                # Save message
-                msg = ChatMessage(thread_id=thread_id, user_id=user.id, message=text)
-                db.add(msg)
-                
-                # Update thread
-                await db.execute(
-                    update(Thread).where(Thread.id == thread_id).values(updated=datetime.utcnow())
-                )
-                # Set online status on message activity
-                await db.execute(
-                    update(Profile).where(Profile.user_id == user.id).values(is_online=True)
-                )
-                await db.commit()
-                await db.refresh(msg)
-                
-                # Get other user
-                thread_res = await db.execute(select(Thread).where(Thread.id == thread_id))
-                thread = thread_res.scalars().first()
-                other_user_id = thread.second_person_id if thread.first_person_id == user.id else thread.first_person_id
-                
-                # Broadast
-                serialized = {
-                    "type": "new_message",
-                    "data": {
-                        "id": str(msg.id),
-                        "thread_id": str(thread.id),
-                        "user": {
-                            "id": str(user.id),
-                            "username": user.username,
-                            "display_name": user.display_name,
-                            "is_bot": user.is_bot,
-                        },
-                        "message": msg.message,
-                        "timestamp": msg.timestamp.isoformat(),
-                    }
-                }
-                
-                await manager.broadcast_to_user(user.id, serialized)
-                await manager.broadcast_to_user(other_user_id, serialized)
-
-                # Check for AI bot
-                other_user_res = await db.execute(select(User).where(User.id == other_user_id))
-                other_user = other_user_res.scalars().first()
-                if other_user and other_user.is_bot:
-                    # We can't use BackgroundTasks here easily as it's a websocket, 
-                    # but we can just use asyncio.create_task
-                    asyncio.create_task(handle_bot_response(thread.id, text))
+                # Refused here, before it can be broadcast or reach a batch insert
+                chat = parse_chat_message(message_data)
+                if chat is None:
+                    thread_id = message_data.get("thread_id")
+                    notify_rejected(connection, thread_id if isinstance(thread_id, str) else None)
+                    continue
+                # Every message costs database writes and maybe a bot reply, so over the limit it's refused
+                retry_after = message_limits.take(user.id)
+                if retry_after:
+                    notify_rate_limited(connection, "messages", retry_after, chat[0])
+                    continue
+                async with SessionLocal() as db:
+                    await handle_chat_message(db, user, *chat)
+            elif message_data.get("type") == "heartbeat":
+                presence.heartbeat(user.id)
                 
     except WebSocketDisconnect:
-        manager.disconnect(user.id, websocket)
-        # Set offline status
-        await db.execute(
-            update(Profile).where(Profile.user_id == user.id).values(is_online=False, last_seen=datetime.utcnow())
-        )
-        await db.commit()
+        pass
     except Exception as e:
         print(f"WS Error: {e}")
+    finally:
+        frame_limits.release(connection)
         manager.disconnect(user.id, websocket)
+        # Offline only once the user's last socket on this worker closes
+        presence.disconnect(user.id)
+
+def frame_bytes(payload) -> int:
+    """A frame's size on the wire: UTF-8 bytes for text, not characters."""
+    # A character is at most 4 bytes, so text this short is under the cap without encoding it
+    if isinstance(payload, str) and len(payload) * 4 > settings.WS_MAX_FRAME_BYTES:
+        return len(payload.encode())
+    return len(payload)
+
+def notify_rate_limited(connection: Connection, scope: str, retry_after: float, thread_id: Optional[str] = None):
+    if not connection.enqueue(wire.Outgoing(events.rate_limited_event(scope, retry_after, thread_id))):
+        manager.evict(connection)
+
+async def send_catch_up(connection: Connection, user: Principal, since):
+    # The socket is already registered, so live events queue up meanwhile and follow the catch-up
+    try:
+        messages, complete = await messages_since(user.id, since)
+    except Exception as e:
+        print(f"Catch-up failed: {e}")
+        messages, complete = [], False
+    ws_catch_up_messages.observe(len(messages))
+    await connection.send_now(wire.Outgoing(events.catch_up_event(messages, complete)))
+    connection.start()
+
+def parse_chat_message(message_data: dict) -> Optional[Tuple[UUID, str]]:
+    """(thread_id, text) of a chat_message frame, or None if it isn't a valid one."""
+    thread_id, text = message_data.get("thread_id"), message_data.get("message")
+    # Postgres text can't hold NUL characters
+    if not isinstance(thread_id, str) or not isinstance(text, str) or not text.strip() or "\x00" in text:
+        return None
+    try:
+        return UUID(thread_id), text
+    except ValueError:
+        return None
+
+def notify_rejected(connection: Connection, thread_id: Optional[str]):
+    if not connection.enqueue(wire.Outgoing(events.message_rejected_event(thread_id))):
+        manager.evict(connection)
+
+async def handle_chat_message(db: AsyncSession, user: Principal, thread_id: UUID, text: str):
+    # Participants are cached, so this normally doesn't touch the database
+    thread = await get_thread_info(db, thread_id)
+    if not thread or user.id not in thread.participant_ids:
+        return
+    
+    # Queue for the next batched write; id and timestamp are assigned up front
+    msg = ingestor.submit(thread_id, user.id, text)
+    record_write(*thread.participant_ids)
+    if ingestor.sync:
+        try:
+            await msg.persisted
+        except Exception:
+            # The ingestor has already sent the sender message_failed
+            return
+    
+    # Broadast
+    data = events.message_data(msg.id, thread.id, events.user_data(user), msg.message, msg.timestamp)
+    await manager.broadcast_to_thread(thread, events.message_event(data))
+    recent_messages.add(data)
+
+    # Check for AI bot
+    if thread.bot_user_id and thread.bot_user_id != user.id:
+        # The bot reads history from the database, so queue it once our batch has landed
+        msg.persisted.add_done_callback(lambda persisted: bot_reply_when_persisted(msg.thread_id, persisted))
+
+def bot_reply_when_persisted(thread_id: UUID, persisted: asyncio.Future):
+    if not persisted.cancelled() and persisted.exception() is None:
+        bot_pool.submit(thread_id)
@@ -0,0 +1,129 @@
+"""
+History pages from Postgres partitions against pages from the cold archive,
+on the configured DATABASE_URL.
+
+    python -m bench.archive --threads 50 --months 6 --per-month 200 --runs 500
+
+Seeds throwaway users and `--threads` threads with `--per-month` messages
+in each of `--months` months of 2001 (far from any real data), creating
+their partitions. The older half of those months is archived to a temporary
+ARCHIVE_DIR with the same code the archive job uses. The bench then times
+get_messages with a `before` cursor landing in a month still in Postgres
+and in an archived one, for random threads. Reports p50/p99 in microseconds
+and the archive's size against the rows it holds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.api.chat import get_messages
+from app.api.pagination import encode_cursor
+from app.core.config import settings
+from app.core.principal import Principal
+from app.database import ReadSessionLocal, SessionLocal, dispose_engines
+from app.models.chats import add_months, create_partition_sql, partition_name
+from app.services.archive import archive_partition
+
+FIRST_MONTH = datetime(2001, 1, 1)
+
+async def seed(prefix, args):
+    async with SessionLocal() as db:
+        for n in range(args.months):
+            await db.execute(text(create_partition_sql(add_months(FIRST_MONTH, n))))
+        await db.execute(
+            text("""
+                INSERT INTO core_user
+                    (id, username, phone_number, display_name, password, is_bot, is_active, is_staff, is_superuser, date_joined)
+                SELECT gen_random_uuid(), CAST(:prefix AS text) || g, '+6' || (5000000000 + g)::text,
+                       'Bench ' || g, '!', false, true, false, false, now()
+                FROM generate_series(1, 2) g
+            """),
+            {"prefix": prefix},
+        )
+        users = (await db.execute(
+            text("SELECT id, username FROM core_user WHERE username LIKE CAST(:p AS text) || '%' ORDER BY username"), {"p": prefix}
+        )).all()
+        await db.execute(
+            text("""
+                INSERT INTO chat_thread (id, first_person_id, second_person_id, updated)
+                SELECT gen_random_uuid(), :a, :b, now() FROM generate_series(1, CAST(:threads AS integer))
+            """),
+            {"a": users[0].id, "b": users[1].id, "threads": args.threads},
+        )
+        # Evenly spread over each month
+        await db.execute(
+            text("""
+                INSERT INTO chat_chatmessage (id, thread_id, user_id, message, "timestamp")
+                SELECT gen_random_uuid(), t.id, CASE WHEN g % 2 = 0 THEN t.first_person_id ELSE t.second_person_id END,
+                       'message ' || g || ' with some ordinary chat text',
+                       CAST(:start AS timestamp) + make_interval(months => m) + make_interval(secs => g * 2400000 / CAST(:per_month AS integer))
+                FROM chat_thread t, generate_series(0, CAST(:months AS integer) - 1) m, generate_series(1, CAST(:per_month AS integer)) g
+                WHERE t.first_person_id = :a
+            """),
+            {"a": users[0].id, "start": FIRST_MONTH, "months": args.months, "per_month": args.per_month},
+        )
+        await db.commit()
+        thread_ids = (await db.execute(text("SELECT id FROM chat_thread WHERE first_person_id = :a"), {"a": users[0].id})).scalars().all()
+    user = users[0]
+    return Principal(id=user.id, username=user.username, phone_number="", display_name="", is_bot=False, is_active=True), thread_ids
+
+async def measure(principal, thread_ids, month, args):
+    timings = []
+    for _ in range(args.runs):
+        # Somewhere in the middle of the month, so the page doesn't cross into another
+        cursor = encode_cursor(month.replace(day=15), uuid.uuid4())
+        thread_id = random.choice(thread_ids)
+        async with ReadSessionLocal() as db:
+            started = time.perf_counter()
+            response = await get_messages(thread_id=thread_id, before=cursor, after=None, limit=50, db=db, current_user=principal)
+            timings.append((time.perf_counter() - started) * 1e6)
+        assert len(json.loads(response.body)) == 50
+    timings.sort()
+    return {"p50_us": round(timings[len(timings) // 2]), "p99_us": round(timings[int(len(timings) * 0.99)])}
+
+async def main(args):
+    prefix = f"arb_{uuid.uuid4().hex[:6]}_"
+    directory = tempfile.mkdtemp(prefix="chat-archive-")
+    settings.ARCHIVE_DIR = directory
+    archived = args.months // 2
+    try:
+        principal, thread_ids = await seed(prefix, args)
+        rows = 0
+        for n in range(archived):
+            month = add_months(FIRST_MONTH, n)
+            rows += await archive_partition(partition_name(month), month)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        results = {
+            "threads": args.threads,
+            "messages_per_thread_month": args.per_month,
+            "archived_rows": rows,
+            "archive_bytes_per_row": round(size / rows, 1),
+            "postgres": await measure(principal, thread_ids, add_months(FIRST_MONTH, args.months - 1), args),
+            "archive": await measure(principal, thread_ids, add_months(FIRST_MONTH, archived - 1), args),
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(text("DELETE FROM core_user WHERE username LIKE CAST(:p AS text) || '%'"), {"p": prefix})
+            for n in range(args.months):
+                await db.execute(text(f"DROP TABLE IF EXISTS {partition_name(add_months(FIRST_MONTH, n))}"))
+            await db.commit()
+        shutil.rmtree(directory)
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--per-month", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
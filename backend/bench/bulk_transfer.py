@@ -0,0 +1,131 @@
+"""
+Bulk import through COPY against ORM db.add loops, and streaming export of
+the result, on the configured DATABASE_URL.
+
+    python -m bench.bulk_transfer --users 200 --threads 1000 --messages 100000
+
+Generates an NDJSON export in memory: throwaway users, threads between
+random pairs of them, and `--messages` messages spread over those threads.
+It is loaded once through import_records. The same shape with fresh ids is
+loaded again with Users, Profiles, Threads and ChatMessages added through a
+session, committing every `--orm-batch` rows. Then the busiest user's
+conversations are exported through export_records/ndjson_chunks. Reports
+rows/sec for each, and the peak traced memory of the export next to its
+size. Rows are deleted afterwards.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.database import SessionLocal, dispose_engines
+from app.models.chats import ChatMessage, Thread
+from app.models.users import Profile, User
+from app.schemas.events import dumps
+from app.services.transfer import export_records, import_records, ndjson_chunks
+
+def generate(prefix, args):
+    users = [
+        {"id": uuid.uuid4(), "username": f"{prefix}{n}", "phone_number": f"+7{random.randrange(10**10):010d}",
+         "display_name": f"Bench {n}", "is_bot": False, "date_joined": datetime.utcnow()}
+        for n in range(args.users)
+    ]
+    threads = []
+    for _ in range(args.threads):
+        first, second = random.sample(users, 2)
+        threads.append({"id": uuid.uuid4(), "first_person_id": first["id"], "second_person_id": second["id"]})
+    start = datetime.utcnow() - timedelta(days=30)
+    messages = []
+    for n in range(args.messages):
+        thread = random.choice(threads)
+        messages.append({
+            "id": uuid.uuid4(), "thread_id": thread["id"],
+            "user_id": random.choice((thread["first_person_id"], thread["second_person_id"])),
+            "message": f"message {n} with some ordinary chat text", "timestamp": start + timedelta(seconds=n),
+        })
+    return users, threads, messages
+
+def ndjson(users, threads, messages):
+    records = (
+        [{"type": "user", "data": u} for u in users]
+        + [{"type": "thread", "data": t} for t in threads]
+        + [{"type": "message", "data": m} for m in messages]
+    )
+    return [dumps(record) for record in records]
+
+async def orm_load(users, threads, messages, batch):
+    async with SessionLocal() as db:
+        for user in users:
+            db.add(User(password="!", **user))
+        await db.flush()
+        for user in users:
+            db.add(Profile(user_id=user["id"]))
+        for thread in threads:
+            db.add(Thread(updated=datetime.utcnow(), **thread))
+        await db.commit()
+        for n, message in enumerate(messages, 1):
+            db.add(ChatMessage(**message))
+            if n % batch == 0:
+                await db.commit()
+        await db.commit()
+
+async def export(user_id):
+    size = 0
+    tracemalloc.start()
+    async for chunk in ndjson_chunks(export_records(user_id)):
+        size += len(chunk)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak
+
+async def main(args):
+    prefix = f"bt_{uuid.uuid4().hex[:6]}_"
+    rows = args.users + args.threads + args.messages
+    try:
+        users, threads, messages = generate(prefix + "c", args)
+        lines = ndjson(users, threads, messages)
+        started = time.perf_counter()
+        counts = await import_records(lines)
+        copy_seconds = time.perf_counter() - started
+        assert counts["messages"] == args.messages, counts
+
+        orm_data = generate(prefix + "o", args)
+        started = time.perf_counter()
+        await orm_load(*orm_data, args.orm_batch)
+        orm_seconds = time.perf_counter() - started
+
+        busiest = Counter(m["user_id"] for m in messages).most_common(1)[0][0]
+        exported = sum(1 for t in threads if busiest in (t["first_person_id"], t["second_person_id"]))
+        started = time.perf_counter()
+        size, peak = await export(busiest)
+        export_seconds = time.perf_counter() - started
+
+        print(json.dumps({
+            "rows": rows,
+            "copy_rows_per_sec": round(rows / copy_seconds),
+            "orm_rows_per_sec": round(rows / orm_seconds),
+            "export_threads": exported,
+            "export_bytes": size,
+            "export_mb_per_sec": round(size / export_seconds / 1e6, 1),
+            "export_peak_traced_kb": round(peak / 1024),
+        }, indent=2))
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(text("DELETE FROM core_user WHERE username LIKE CAST(:p AS text) || '%'"), {"p": prefix})
+            await db.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--orm-batch", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""
+Fan-out of one group message: broadcast_to_thread against listing every
+member in broadcast_to_users.
+
+    python -m bench.group_fanout --members 500 --online 100 --others 2000 --messages 2000
+
+A real ConnectionManager holds sockets for `--online` of the group's
+`--members` plus `--others` users outside it; the sockets only count what
+they are sent. Each message goes out both ways. Reports microseconds per
+broadcast on this worker, and the bytes each one puts on the broadcast
+backend for the other workers (the member list against the group id).
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from app.websockets import manager as manager_module
+from app.websockets.pubsub import InProcessBackend
+from app.services.threads import ThreadInfo
+
+class _Socket:
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, data):
+        self.frames += 1
+
+    async def send_bytes(self, data):
+        self.frames += 1
+
+class _CountingBackend(InProcessBackend):
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+
+    async def publish(self, user_ids, data):
+        # The same node|recipients|data framing the postgres and socket backends send
+        self.bytes += len(",".join(user_ids)) + len(data) + 34
+
+def connect(manager, user_id, sockets):
+    socket = _Socket()
+    connection = manager_module.Connection(manager, str(user_id), socket)
+    manager.active_connections[connection.user_id_str] = {socket: connection}
+    connection.start()
+    sockets.append(socket)
+
+async def drain(manager):
+    # Untimed: let the writers empty their queues so none overflows and gets evicted
+    connections = [c for cs in manager.active_connections.values() for c in cs.values()]
+    while any(not connection.queue.empty() for connection in connections):
+        await asyncio.sleep(0)
+    # The last item of each may still be mid-send
+    await asyncio.sleep(0.01)
+
+async def timed(manager, backend, broadcast, args):
+    backend.bytes = 0
+    sender = {"id": uuid.uuid4(), "username": "alice", "phone_number": "+15550000000", "display_name": "Alice", "is_bot": False}
+    elapsed = 0.0
+    for n in range(args.messages):
+        event = {"type": "new_message", "data": {
+            "id": uuid.uuid4(), "thread_id": args.thread_id, "user": sender,
+            "message": f"message {n}", "timestamp": datetime.now(timezone.utc),
+        }}
+        started = time.perf_counter()
+        await broadcast(event)
+        elapsed += time.perf_counter() - started
+        if n % 100 == 99:
+            await drain(manager)
+    await drain(manager)
+    return {
+        "us_per_broadcast": round(elapsed / args.messages * 1e6, 1),
+        "publish_bytes_per_broadcast": round(backend.bytes / args.messages),
+    }
+
+async def run(args):
+    backend = _CountingBackend()
+    manager = manager_module.ConnectionManager(backend)
+    members = [uuid.uuid4() for _ in range(args.members)]
+    thread = ThreadInfo(
+        id=uuid.uuid4(), participant_ids=frozenset(members), bot_user_id=None, is_group=True,
+        member_keys=frozenset(str(member) for member in members),
+    )
+    args.thread_id = thread.id
+    sockets = []
+    for member in members[:args.online]:
+        connect(manager, member, sockets)
+    for _ in range(args.others):
+        connect(manager, uuid.uuid4(), [])
+
+    results = {
+        "members": args.members, "online": args.online, "others": args.others, "messages": args.messages,
+        "broadcast_to_users": await timed(manager, backend, lambda event: manager.broadcast_to_users(thread.participant_ids, event), args),
+        "broadcast_to_thread": await timed(manager, backend, lambda event: manager.broadcast_to_thread(thread, event), args),
+    }
+    # Both ways delivered everything: two frames per message
+    results["frames_per_online_member"] = round(sum(socket.frames for socket in sockets) / max(len(sockets), 1))
+    for connections in manager.active_connections.values():
+        for connection in connections.values():
+            connection.stop()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--online", type=int, default=100)
+    parser.add_argument("--others", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=2000)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
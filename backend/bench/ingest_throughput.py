@@ -0,0 +1,111 @@
+"""
+Chat message ingestion throughput: the old per-message write path against
+the batched MessageIngestor, on the configured DATABASE_URL.
+
+    python -m bench.ingest_throughput --messages 5000 --senders 50
+
+Creates two throwaway users and a thread, pushes the same number of
+messages through each path from `--senders` concurrent coroutines, and
+reports messages/sec. Rows are deleted afterwards.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+
+from app.core.config import settings
+from app.database import SessionLocal, dispose_engines
+from app.models.users import User, Profile
+from app.models.chats import Thread, ChatMessage
+from app.services.ingest import MessageIngestor
+
+async def legacy_message(thread_id, user_id, text):
+    # What the WebSocket handler used to do for every chat_message frame
+    async with SessionLocal() as db:
+        msg = ChatMessage(thread_id=thread_id, user_id=user_id, message=text)
+        db.add(msg)
+        await db.execute(update(Thread).where(Thread.id == thread_id).values(updated=datetime.utcnow()))
+        await db.execute(update(Profile).where(Profile.user_id == user_id).values(is_online=True))
+        await db.commit()
+        await db.refresh(msg)
+        thread = (await db.execute(select(Thread).where(Thread.id == thread_id))).scalars().first()
+        other_id = thread.second_person_id if thread.first_person_id == user_id else thread.first_person_id
+        await db.execute(select(User).where(User.id == other_id))
+
+async def run_senders(senders, total, send):
+    per_sender = total // senders
+
+    async def sender(n):
+        for i in range(per_sender):
+            await send(f"sender {n} message {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(senders)))
+    return per_sender * senders, started
+
+async def bench_legacy(thread_id, user_id, args):
+    count, started = await run_senders(args.senders, args.messages, lambda text: legacy_message(thread_id, user_id, text))
+    return count / (time.perf_counter() - started)
+
+async def bench_pipeline(thread_id, user_id, args, durability):
+    settings.MESSAGE_DURABILITY = durability
+    ingestor = MessageIngestor()
+    await ingestor.start()
+    pending = []
+
+    async def send(text):
+        msg = ingestor.submit(thread_id, user_id, text)
+        pending.append(msg)
+        if ingestor.sync:
+            await msg.persisted
+        else:
+            # Yield like a real receive loop would between frames
+            await asyncio.sleep(0)
+
+    count, started = await run_senders(args.senders, args.messages, send)
+    # Throughput counts until everything is durable, even in async mode
+    await asyncio.gather(*(msg.persisted for msg in pending))
+    elapsed = time.perf_counter() - started
+    await ingestor.stop()
+    return count / elapsed
+
+async def main(args):
+    suffix = uuid.uuid4().hex[:8]
+    async with SessionLocal() as db:
+        users = [
+            User(username=f"bench_{suffix}_{i}", phone_number=f"+9{suffix[:6]}{i}", display_name="bench", password="!")
+            for i in range(2)
+        ]
+        db.add_all(users)
+        await db.flush()
+        db.add_all([Profile(user_id=u.id) for u in users])
+        thread = Thread(first_person_id=users[0].id, second_person_id=users[1].id)
+        db.add(thread)
+        await db.commit()
+
+    try:
+        results = {
+            "messages": args.messages,
+            "senders": args.senders,
+            "legacy_msgs_per_sec": round(await bench_legacy(thread.id, users[0].id, args)),
+            "pipeline_async_msgs_per_sec": round(await bench_pipeline(thread.id, users[0].id, args, "async")),
+            "pipeline_sync_msgs_per_sec": round(await bench_pipeline(thread.id, users[0].id, args, "sync")),
+        }
+        results["speedup_async"] = round(results["pipeline_async_msgs_per_sec"] / results["legacy_msgs_per_sec"], 1)
+        results["speedup_sync"] = round(results["pipeline_sync_msgs_per_sec"] / results["legacy_msgs_per_sec"], 1)
+        print(json.dumps(results, indent=2))
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(delete(User).where(User.id.in_([u.id for u in users])))
+            await db.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
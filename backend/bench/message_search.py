@@ -0,0 +1,149 @@
+"""
+Full-text message search latency at scale (GET /api/chat/search/).
+
+    python -m bench.message_search --messages 10000000 --runs 20
+
+Seeds throwaway users, threads and `--messages` messages of random words
+with a skewed (roughly Zipfian) vocabulary, in batches with generate_series.
+Then it times the search endpoint for one user across all their threads and
+within a single thread, for common, rare and phrase queries, and reports
+p50/p95 in ms. Needs migrations/0004 (or a create_all'd schema). Seeding
+10M rows takes a while; pass --keep to reuse them on the next run with
+--reuse <prefix>.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import statistics
+import time
+import uuid
+
+from fastapi import Response
+from sqlalchemy import text
+
+from app.api.chat import search_messages
+from app.core.principal import Principal
+from app.database import SessionLocal, dispose_engines
+
+VOCABULARY = 50_000
+BATCH = 500_000
+
+def word(n: int) -> str:
+    # Same construction as the seeding SQL: first 6 hex chars of md5(n), prefixed
+    return "w" + hashlib.md5(str(n).encode()).hexdigest()[:6]
+
+async def seed(prefix, args):
+    async with SessionLocal() as db:
+        await db.execute(
+            text("""
+                INSERT INTO core_user
+                    (id, username, phone_number, display_name, password, is_bot, is_active, is_staff, is_superuser, date_joined)
+                SELECT gen_random_uuid(), CAST(:prefix AS text) || g, '+7' || (4000000000 + g)::text,
+                       'Bench ' || g, '!', false, true, false, false, now()
+                FROM generate_series(1, CAST(:users AS integer)) g
+            """),
+            {"prefix": prefix, "users": args.users},
+        )
+        # Each thread pairs two users; user 1 ends up in about 2 * threads / users of them
+        await db.execute(
+            text("""
+                WITH u AS (
+                    SELECT array_agg(id ORDER BY username) AS ids FROM core_user WHERE username LIKE CAST(:prefix AS text) || '%'
+                )
+                INSERT INTO chat_thread (id, first_person_id, second_person_id, updated)
+                SELECT gen_random_uuid(), u.ids[1 + g % CAST(:users AS integer)], u.ids[1 + (g + 1 + g / CAST(:users AS integer)) % CAST(:users AS integer)], now()
+                FROM u, generate_series(0, CAST(:threads AS integer) - 1) g
+            """),
+            {"prefix": prefix, "users": args.users, "threads": args.threads},
+        )
+        await db.commit()
+
+    for start in range(0, args.messages, BATCH):
+        stop = min(start + BATCH, args.messages)
+        started = time.perf_counter()
+        async with SessionLocal() as db:
+            await db.execute(
+                text("""
+                    WITH t AS (
+                        SELECT array_agg(t.id) AS ids, array_agg(t.first_person_id) AS senders, count(*) AS n
+                        FROM chat_thread t JOIN core_user u ON u.id = t.first_person_id
+                        WHERE u.username LIKE CAST(:prefix AS text) || '%'
+                    )
+                    INSERT INTO chat_chatmessage (id, thread_id, user_id, message, "timestamp")
+                    SELECT gen_random_uuid(), t.ids[1 + g % t.n], t.senders[1 + g % t.n],
+                           (SELECT string_agg('w' || left(md5(floor(CAST(:vocab AS integer) * random() ^ 3)::int::text), 6), ' ')
+                            FROM generate_series(1, 4 + g % 12)),
+                           now() - make_interval(secs => CAST(:total AS integer) - g)
+                    FROM t, generate_series(CAST(:start AS integer), CAST(:stop AS integer) - 1) g
+                """),
+                {"prefix": prefix, "vocab": VOCABULARY, "total": args.messages, "start": start, "stop": stop},
+            )
+            await db.commit()
+        print(f"seeded {stop}/{args.messages} messages ({BATCH / (time.perf_counter() - started):.0f}/s)", flush=True)
+
+    async with SessionLocal() as db:
+        await db.execute(text("ANALYZE chat_chatmessage"))
+        await db.commit()
+
+async def time_queries(prefix, args):
+    async with SessionLocal() as db:
+        user = (await db.execute(
+            text("SELECT id, username FROM core_user WHERE username = CAST(:u AS text)"), {"u": prefix + "1"}
+        )).first()
+        thread_id = (await db.execute(
+            text("SELECT id FROM chat_thread WHERE first_person_id = :u LIMIT 1"), {"u": user.id}
+        )).scalar()
+    principal = Principal(id=user.id, username=user.username, phone_number="", display_name="", is_bot=False, is_active=True)
+
+    # floor(V * r^3) favours small n: word(0) is the most common, word(V - 1) the rarest
+    queries = {
+        "common": word(0),
+        "mid": word(VOCABULARY // 100),
+        "rare": word(VOCABULARY - 1),
+        "two_words": f"{word(1)} {word(2)}",
+        "phrase": f'"{word(0)} {word(1)}"',
+    }
+    results = {}
+    for scope, scoped_thread in (("all_threads", None), ("one_thread", thread_id)):
+        for name, q in queries.items():
+            timings = []
+            for _ in range(args.runs):
+                async with SessionLocal() as db:
+                    started = time.perf_counter()
+                    await search_messages(
+                        response=Response(), q=q, thread_id=scoped_thread, cursor=None, limit=20, db=db, current_user=principal
+                    )
+                    timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[f"{scope}.{name}"] = {
+                "p50_ms": round(statistics.median(timings), 2),
+                "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 2),
+            }
+    return results
+
+async def main(args):
+    prefix = args.reuse or f"msb_{uuid.uuid4().hex[:6]}_"
+    try:
+        if not args.reuse:
+            await seed(prefix, args)
+        results = {"messages": args.messages, "users": args.users, "threads": args.threads, "prefix": prefix}
+        results.update(await time_queries(prefix, args))
+        print(json.dumps(results, indent=2))
+    finally:
+        if not args.keep:
+            async with SessionLocal() as db:
+                # Threads and messages go with their users (ON DELETE CASCADE)
+                await db.execute(text("DELETE FROM core_user WHERE username LIKE CAST(:p AS text) || '%'"), {"p": prefix})
+                await db.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--threads", type=int, default=20_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="leave the seeded rows in place")
+    parser.add_argument("--reuse", metavar="PREFIX", help="skip seeding and search rows kept by an earlier --keep run")
+    asyncio.run(main(parser.parse_args()))
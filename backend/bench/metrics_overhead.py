@@ -0,0 +1,117 @@
+"""
+Cost of the /metrics instrumentation on the request path.
+
+    python -m bench.metrics_overhead --requests 20000
+
+Drives two copies of a trivial FastAPI app straight through ASGI (no
+sockets, so the relative cost is the worst case any real endpoint will
+see): one bare, one wrapped in MetricsMiddleware. Also times a WebSocket
+broadcast to a handful of local sockets with and without its histograms.
+Reports microseconds per call and the overhead in percent.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI
+
+from app.core.metrics import MetricsMiddleware
+from app.websockets import manager as manager_module
+
+def make_app(instrumented: bool):
+    app = FastAPI()
+
+    @app.get("/api/items/{item_id}/")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+async def drive(app, n):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/api/items/7/", "raw_path": b"/api/items/7/", "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    started = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / n * 1e6
+
+class _Socket:
+    async def send_text(self, data):
+        pass
+
+async def broadcast(n, sockets):
+    manager = manager_module.ConnectionManager(manager_module.InProcessBackend())
+    user_ids = []
+    for i in range(sockets):
+        connection = manager_module.Connection(manager, f"user{i}", _Socket())
+        manager.active_connections.setdefault(connection.user_id_str, {})[connection.websocket] = connection
+        user_ids.append(connection.user_id_str)
+    event = {"type": "new_message", "data": {"message": "hello", "seq": 1}}
+    queues = [connection.queue for connections in manager.active_connections.values() for connection in connections.values()]
+    elapsed = 0.0
+    for i in range(n + 200):
+        started = time.perf_counter()
+        await manager.broadcast_to_users(user_ids, event)
+        if i >= 200:
+            elapsed += time.perf_counter() - started
+        # Stand in for the writer tasks so the queues never fill up
+        for queue in queues:
+            while not queue.empty():
+                queue.get_nowait()
+    return elapsed / n * 1e6
+
+class _Noop:
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+async def main(args):
+    results = {"requests": args.requests}
+    # Interleave the runs so drift (thermal, GC) hits both sides equally
+    bare, instrumented = [], []
+    for _ in range(args.rounds):
+        bare.append(await drive(make_app(False), args.requests))
+        instrumented.append(await drive(make_app(True), args.requests))
+    b, i = min(bare), min(instrumented)
+    results["http"] = {"bare_us": round(b, 2), "instrumented_us": round(i, 2), "overhead_pct": round((i - b) / b * 100, 2)}
+
+    saved = {name: getattr(manager_module, name) for name in ("ws_broadcast_duration", "ws_broadcast_recipients")}
+    bare, instrumented = [], []
+    for _ in range(args.rounds):
+        instrumented.append(await broadcast(args.requests, args.sockets))
+        for name in saved:
+            setattr(manager_module, name, _Noop())
+        try:
+            bare.append(await broadcast(args.requests, args.sockets))
+        finally:
+            for name, metric in saved.items():
+                setattr(manager_module, name, metric)
+    b, i = min(bare), min(instrumented)
+    results["broadcast"] = {
+        "sockets": args.sockets, "bare_us": round(b, 2), "instrumented_us": round(i, 2), "overhead_pct": round((i - b) / b * 100, 2),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--sockets", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
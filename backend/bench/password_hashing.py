@@ -0,0 +1,65 @@
+"""
+Event-loop stall during a login storm: bcrypt inline in the handler against
+the bounded PasswordHasher.
+
+    python -m bench.password_hashing --logins 20 --rounds 12
+
+Fires `--logins` concurrent verifies while a ticker task measures how late
+the loop wakes it every 10ms; the worst lateness is what every WebSocket on
+the worker would see. No database needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from app.core.config import settings
+from app.core.security import PasswordHasher, pwd_context, verify_password
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        expected = time.perf_counter() + 0.01
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - expected)
+
+async def storm(verify, n):
+    stop = asyncio.Event()
+    lags = []
+    tick = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(verify() for _ in range(n)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    return {"seconds": round(elapsed, 2), "max_loop_lag_ms": round(max(lags) * 1000, 1)}
+
+async def main(args):
+    pwd_context.update(bcrypt__rounds=args.rounds, bcrypt__min_rounds=args.rounds)
+    # Spawned hashing processes build their own context from the environment
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    hashed = pwd_context.hash("benchmark")
+
+    async def inline():
+        # What login used to do
+        verify_password("benchmark", hashed)
+
+    results = {"logins": args.logins, "rounds": args.rounds, "inline": await storm(inline, args.logins)}
+    for executor in ("thread", "process"):
+        settings.PASSWORD_HASH_EXECUTOR = executor
+        settings.PASSWORD_HASH_WORKERS = args.workers
+        settings.PASSWORD_HASH_MAX_PENDING = args.logins
+        hasher = PasswordHasher()
+        # Start the workers (and, for processes, import the app) before timing
+        await asyncio.gather(*(hasher.hash("warmup") for _ in range(args.workers)))
+        results[f"{executor}_pool"] = await storm(lambda: hasher.verify_and_update("benchmark", hashed), args.logins)
+        hasher.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""
+Cost of the per-user token buckets at scale: memory per key and time per
+take, in process.
+
+    python -m bench.rate_limit --users 100000 --takes 1000000
+
+Fills a TokenBuckets with `--users` random user ids and measures the
+traced memory that adds (the ids themselves excluded). It then times
+`--takes` takes spread over those users, and lets every bucket go idle
+and counts how many takes the sweep needs to hand all of their slots back.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import uuid
+
+from app.core.rate_limit import TokenBuckets
+
+def main(args):
+    keys = [uuid.uuid4() for _ in range(args.users)]
+    buckets = TokenBuckets(rate=5.0, burst=20.0)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for key in keys:
+        buckets.take(key)
+    per_key = (tracemalloc.get_traced_memory()[0] - before) / args.users
+    tracemalloc.stop()
+
+    picks = [random.choice(keys) for _ in range(args.takes)]
+    started = time.perf_counter()
+    for key in picks:
+        buckets.take(key)
+    per_take = (time.perf_counter() - started) / args.takes
+
+    # Pretend a full refill has passed for every bucket
+    for slot in range(len(buckets._updated)):
+        buckets._updated[slot] -= buckets.burst / buckets.rate
+    fresh, takes = uuid.uuid4(), 0
+    while buckets.stats()["buckets"] > 1:
+        buckets.take(fresh)
+        takes += 1
+
+    print(json.dumps({
+        "users": args.users,
+        "bytes_per_key": round(per_key, 1),
+        "ns_per_take": round(per_take * 1e9),
+        "takes_to_reclaim_idle": takes,
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--takes", type=int, default=1_000_000)
+    main(parser.parse_args())
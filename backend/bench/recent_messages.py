@@ -0,0 +1,125 @@
+"""
+First history page and bot context: Postgres against the recent-messages
+cache, on the configured DATABASE_URL.
+
+    python -m bench.recent_messages --threads 200 --messages 500 --runs 2000
+
+Seeds throwaway users and `--threads` threads of `--messages` messages each,
+then times get_messages (newest page, limit 50) and the bot's last-10 read
+for random threads, once with RECENT_MESSAGES_PER_THREAD=0 and once with
+the cache warm. Reports p50/p99 in microseconds and queries per call.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app.api.chat import get_messages
+from app.core.config import settings
+from app.core.metrics import db_query_duration
+from app.core.principal import Principal
+from app.database import ReadSessionLocal, SessionLocal, dispose_engines
+from app.services.recent_messages import recent_messages
+from app.services.tasks import BOT_HISTORY_LENGTH
+
+def query_count() -> int:
+    return sum(sum(counts) for counts, _ in db_query_duration._values.values())
+
+async def seed(prefix, args):
+    async with SessionLocal() as db:
+        await db.execute(
+            text("""
+                INSERT INTO core_user
+                    (id, username, phone_number, display_name, password, is_bot, is_active, is_staff, is_superuser, date_joined)
+                SELECT gen_random_uuid(), CAST(:prefix AS text) || g, '+6' || (4000000000 + g)::text,
+                       'Bench ' || g, '!', false, true, false, false, now()
+                FROM generate_series(1, 2) g
+            """),
+            {"prefix": prefix},
+        )
+        users = (await db.execute(
+            text("SELECT id, username FROM core_user WHERE username LIKE CAST(:p AS text) || '%' ORDER BY username"), {"p": prefix}
+        )).all()
+        await db.execute(
+            text("""
+                INSERT INTO chat_thread (id, first_person_id, second_person_id, updated)
+                SELECT gen_random_uuid(), :a, :b, now() FROM generate_series(1, CAST(:threads AS integer))
+            """),
+            {"a": users[0].id, "b": users[1].id, "threads": args.threads},
+        )
+        await db.execute(
+            text("""
+                INSERT INTO chat_chatmessage (id, thread_id, user_id, message, "timestamp")
+                SELECT gen_random_uuid(), t.id, CASE WHEN g % 2 = 0 THEN t.first_person_id ELSE t.second_person_id END,
+                       'message ' || g || ' with some ordinary chat text', now() - make_interval(secs => g)
+                FROM chat_thread t, generate_series(1, CAST(:messages AS integer)) g
+                WHERE t.first_person_id = :a
+            """),
+            {"a": users[0].id, "messages": args.messages},
+        )
+        await db.commit()
+        thread_ids = (await db.execute(text("SELECT id FROM chat_thread WHERE first_person_id = :a"), {"a": users[0].id})).scalars().all()
+    user = users[0]
+    return Principal(id=user.id, username=user.username, phone_number="", display_name="", is_bot=False, is_active=True), thread_ids
+
+async def bot_context(db, thread_id):
+    # The two branches handle_bot_response chooses between
+    if settings.RECENT_MESSAGES_PER_THREAD:
+        return await recent_messages.latest(thread_id, BOT_HISTORY_LENGTH)
+    return await db.execute(
+        text("SELECT user_id, message FROM chat_chatmessage WHERE thread_id = :t ORDER BY timestamp DESC, id DESC LIMIT :n"),
+        {"t": thread_id, "n": BOT_HISTORY_LENGTH},
+    )
+
+async def measure(principal, thread_ids, args):
+    async def first_page(db, thread_id):
+        return await get_messages(thread_id=thread_id, before=None, after=None, limit=50, db=db, current_user=principal)
+
+    results = {}
+    for name, call in (("first_page", first_page), ("bot_context", bot_context)):
+        timings = []
+        queries = query_count()
+        for _ in range(args.runs):
+            thread_id = random.choice(thread_ids)
+            async with ReadSessionLocal() as db:
+                started = time.perf_counter()
+                await call(db, thread_id)
+                timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        results[name] = {
+            "p50_us": round(timings[len(timings) // 2]),
+            "p99_us": round(timings[int(len(timings) * 0.99)]),
+            "queries_per_call": round((query_count() - queries) / args.runs, 2),
+        }
+    return results
+
+async def main(args):
+    prefix = f"rmb_{uuid.uuid4().hex[:6]}_"
+    per_thread = settings.RECENT_MESSAGES_PER_THREAD
+    try:
+        principal, thread_ids = await seed(prefix, args)
+        results = {"threads": args.threads, "messages_per_thread": args.messages}
+        settings.RECENT_MESSAGES_PER_THREAD = 0
+        results["postgres"] = await measure(principal, thread_ids, args)
+        settings.RECENT_MESSAGES_PER_THREAD = per_thread
+        for thread_id in thread_ids:
+            await recent_messages.latest(thread_id, 1)
+        results["cache"] = await measure(principal, thread_ids, args)
+        results["cache_bytes"] = recent_messages.stats()["bytes"]
+        print(json.dumps(results, indent=2))
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(text("DELETE FROM core_user WHERE username LIKE CAST(:p AS text) || '%'"), {"p": prefix})
+            await db.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
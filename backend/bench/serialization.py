@@ -0,0 +1,108 @@
+"""
+Serialization cost per 1k messages: the old pydantic response path against
+the projected rows + orjson path, for REST pages and WebSocket events.
+
+    python -m bench.serialization --messages 1000 --repeat 200
+
+No database needed. "before" validates ORM-style objects into MessageOut
+with from_attributes and renders them the way FastAPI's JSONResponse does;
+"after" turns the flat rows get_messages now selects into dicts and encodes
+them with orjson. Reports microseconds per 1k messages.
+"""
+import argparse
+import json
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app.api.chat import message_row_data
+from app.schemas.chats import MessageOut
+from app.schemas.events import dumps, message_data, message_event, user_data
+
+Row = namedtuple("Row", "id thread_id message timestamp user_id username phone_number display_name is_bot")
+
+def make_messages(n):
+    thread_id = uuid.uuid4()
+    users = [
+        SimpleNamespace(id=uuid.uuid4(), username=f"user{i}", phone_number=f"+1555000000{i}", display_name=f"User {i}", is_bot=False)
+        for i in range(2)
+    ]
+    started = datetime.utcnow()
+    objects, rows = [], []
+    for i in range(n):
+        user = users[i % 2]
+        msg = SimpleNamespace(
+            id=uuid.uuid4(), thread_id=thread_id, user=user, user_id=user.id,
+            message=f"message number {i} with a bit of typical chat text in it",
+            timestamp=started + timedelta(milliseconds=i),
+        )
+        objects.append(msg)
+        rows.append(Row(msg.id, thread_id, msg.message, msg.timestamp, *(getattr(user, f) for f in ("id", "username", "phone_number", "display_name", "is_bot"))))
+    return objects, rows
+
+def per_1k(fn, n, repeat):
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - started) / repeat / n * 1000 * 1e6)
+
+def main(args):
+    objects, rows = make_messages(args.messages)
+    adapter = TypeAdapter(List[MessageOut])
+
+    def rest_before():
+        # FastAPI: validate into the response_model, dump to JSON-able Python, json.dumps
+        validated = adapter.validate_python(objects, from_attributes=True)
+        content = adapter.dump_python(validated, mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def rest_after():
+        return dumps([message_row_data(row) for row in rows])
+
+    def ws_before():
+        # The hand-built event dicts each write path used to broadcast
+        return [
+            json.dumps({
+                "type": "new_message",
+                "data": {
+                    "id": str(m.id),
+                    "thread_id": str(m.thread_id),
+                    "user": {
+                        "id": str(m.user.id),
+                        "username": m.user.username,
+                        "display_name": m.user.display_name,
+                        "is_bot": m.user.is_bot,
+                    },
+                    "message": m.message,
+                    "timestamp": m.timestamp.isoformat(),
+                },
+            })
+            for m in objects
+        ]
+
+    def ws_after():
+        return [
+            dumps(message_event(message_data(m.id, m.thread_id, user_data(m.user), m.message, m.timestamp))).decode()
+            for m in objects
+        ]
+
+    assert json.loads(rest_before()) == json.loads(rest_after())
+
+    results = {"messages": args.messages}
+    for name, before, after in (("rest_page", rest_before, rest_after), ("ws_events", ws_before, ws_after)):
+        b = per_1k(before, args.messages, args.repeat)
+        a = per_1k(after, args.messages, args.repeat)
+        results[name] = {"before_us_per_1k": b, "after_us_per_1k": a, "speedup": round(b / a, 1)}
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""
+Cold import and startup cost of the app, each run in a fresh interpreter,
+on the configured DATABASE_URL.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --runs 5 --max-import-ms 1200   # exits 1 past the budget
+
+For each run, a child process times `import app.main`, then create_app(),
+then the lifespan startup (pool warmup and background workers), then the
+first query a request would make. That last step is done with
+DB_POOL_WARMUP as configured and again with it set to 0. Reports medians in
+milliseconds, whether the LLM SDK or the database driver were loaded by the
+import, and the slowest packages in `-X importtime`, for comparing against
+earlier runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+loaded = {"llm_sdk": "google.generativeai" in sys.modules, "db_driver": "asyncpg" in sys.modules}
+application = app.main.create_app()
+created = time.perf_counter()
+
+async def run():
+    from sqlalchemy import text
+    from app.database import SessionLocal
+    async with application.router.lifespan_context(application):
+        ready = time.perf_counter()
+        async with SessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+        queried = time.perf_counter()
+    return ready, queried
+
+ready, queried = asyncio.run(run())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "startup_ms": (ready - created) * 1000,
+    "first_query_ms": (queried - ready) * 1000,
+    **loaded,
+}))
+"""
+
+def child(env_overrides: dict) -> dict:
+    env = {**os.environ, **env_overrides}
+    out = subprocess.run([sys.executable, "-c", CHILD], capture_output=True, text=True, env=env, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def median(runs, key):
+    return round(statistics.median(run[key] for run in runs), 1)
+
+def slowest_imports(count: int) -> list:
+    # Packages (not submodules) by cumulative time, at whatever depth app.main first pulled them in
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], capture_output=True, text=True, check=True)
+    packages = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if "." not in name and name not in ("app", "site") and cumulative.strip().isdigit():
+            packages.append((int(cumulative), name))
+    packages.sort(reverse=True)
+    return [{"package": name, "ms": round(us / 1000, 1)} for us, name in packages[:count]]
+
+def main(args):
+    warm = [child({}) for _ in range(args.runs)]
+    cold = [child({"DB_POOL_WARMUP": "0"}) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import_ms": median(warm + cold, "import_ms"),
+        "create_app_ms": median(warm + cold, "create_app_ms"),
+        "startup_ms": median(warm, "startup_ms"),
+        "startup_without_warmup_ms": median(cold, "startup_ms"),
+        "first_query_ms": median(warm, "first_query_ms"),
+        "first_query_without_warmup_ms": median(cold, "first_query_ms"),
+        "import_loads_llm_sdk": any(run["llm_sdk"] for run in warm + cold),
+        "import_loads_db_driver": any(run["db_driver"] for run in warm + cold),
+        "slowest_imports": slowest_imports(args.top),
+    }
+    print(json.dumps(results, indent=2))
+    if args.max_import_ms and results["import_ms"] > args.max_import_ms:
+        print(f"import_ms {results['import_ms']} is over the {args.max_import_ms} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--max-import-ms", type=float, default=0)
+    main(parser.parse_args())
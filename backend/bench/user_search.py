@@ -0,0 +1,90 @@
+"""
+User search latency as core_user grows, for each search backend.
+
+    python -m bench.user_search --sizes 10000 100000 1000000 --runs 50
+
+Bulk-inserts throwaway users up to each size (with generate_series, so a
+million rows takes seconds), then times a fixed set of name and phone
+queries through app.services.user_search and reports p50/p95 in ms. The
+postgres backend needs migrations/0003 applied to be index-served. Rows
+are deleted afterwards.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.database import SessionLocal, dispose_engines
+from app.services.user_search import search_users, user_index
+
+# "ben" matches every seeded username ("bench_..."), the worst case for ranking
+QUERIES = ["ben", "user 4242", "xq7", "+1 300 12", "3004"]
+
+async def grow_to(prefix, start, size):
+    async with SessionLocal() as db:
+        await db.execute(
+            text("""
+                INSERT INTO core_user
+                    (id, username, phone_number, display_name, password, is_bot, is_active, is_staff, is_superuser, date_joined)
+                SELECT gen_random_uuid(), CAST(:prefix AS text) || g, '+1' || (3000000000 + g)::text,
+                       'User ' || g || ' ' || md5(g::text), '!', false, true, false, false, now()
+                FROM generate_series(CAST(:start AS integer), CAST(:stop AS integer)) g
+            """),
+            {"prefix": prefix, "start": start + 1, "stop": size},
+        )
+        await db.execute(text("ANALYZE core_user"))
+        await db.commit()
+
+async def time_backend(backend, runs):
+    settings.USER_SEARCH_BACKEND = backend
+    if backend == "memory":
+        started = time.perf_counter()
+        await user_index.load()
+        load_secs = time.perf_counter() - started
+    timings = []
+    async with SessionLocal() as db:
+        for _ in range(runs):
+            for q in QUERIES:
+                started = time.perf_counter()
+                await search_users(db, q, 10)
+                timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    result = {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+    }
+    if backend == "memory":
+        result["index_load_secs"] = round(load_secs, 2)
+    return result
+
+async def main(args):
+    prefix = f"bench_{uuid.uuid4().hex[:6]}_"
+    results = []
+    try:
+        current = 0
+        for size in sorted(args.sizes):
+            await grow_to(prefix, current, size)
+            current = size
+            results.append({
+                "users": size,
+                **{backend: await time_backend(backend, args.runs) for backend in args.backends},
+            })
+            print(json.dumps(results[-1]))
+        print(json.dumps(results, indent=2))
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(text("DELETE FROM core_user WHERE username LIKE :p"), {"p": prefix + "%"})
+            await db.commit()
+        await dispose_engines()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", default=["postgres", "memory"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,84 @@
+"""
+Idle WebSocket load test: opens N sockets for one user against a running
+server, holds them open, and reports how many Postgres backends the app
+is using before and after.
+
+    python -m bench.ws_idle_connections --url http://localhost:8000 \
+        --identifier alice --password secret --connections 10000
+
+The database connection count should stay at the pool's idle size no
+matter how many sockets are open. Raise `ulimit -n` for large N.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.request
+
+import asyncpg
+import websockets
+
+from app.core.config import settings
+
+async def count_backends(dsn: str) -> int:
+    conn = await asyncpg.connect(dsn)
+    try:
+        return await conn.fetchval(
+            "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        )
+    finally:
+        await conn.close()
+
+def login(url: str, identifier: str, password: str) -> str:
+    request = urllib.request.Request(
+        f"{url}/api/auth/login/",
+        data=json.dumps({"identifier": identifier, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:
+        cookie = response.headers.get("set-cookie", "")
+    return cookie.split("sessionid=", 1)[1].split(";", 1)[0]
+
+async def main(args):
+    dsn = args.dsn or settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://").replace("postgres://", "postgresql://")
+    token = login(args.url, args.identifier, args.password)
+    ws_url = args.url.replace("http", "ws", 1) + "/ws/chat/"
+
+    before = await count_backends(dsn)
+    started = time.perf_counter()
+    sockets = []
+    for start in range(0, args.connections, args.batch):
+        batch = min(args.batch, args.connections - start)
+        sockets += await asyncio.gather(*(
+            websockets.connect(ws_url, additional_headers={"Cookie": f"sessionid={token}"}, open_timeout=60)
+            for _ in range(batch)
+        ))
+    opened = time.perf_counter() - started
+
+    # Let connect-time units of work finish before sampling
+    await asyncio.sleep(args.hold)
+    during = await count_backends(dsn)
+
+    await asyncio.gather(*(ws.close() for ws in sockets))
+    await asyncio.sleep(1)
+    after = await count_backends(dsn)
+
+    print(json.dumps({
+        "connections": len(sockets),
+        "open_seconds": round(opened, 2),
+        "db_backends_before": before,
+        "db_backends_while_idle": during,
+        "db_backends_after": after,
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--identifier", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--hold", type=float, default=5.0)
+    parser.add_argument("--dsn", help="Postgres DSN to sample pg_stat_activity (defaults to DATABASE_URL)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,258 @@
+"""
+WebSocket load test: how many concurrent chatters one worker can carry.
+
+    python -m bench.ws_load --users 1000 --rate 500 --duration 30 --output run.json
+
+Starts the app in-process under uvicorn on a free local port, against the
+configured DATABASE_URL (point it at a scratch local Postgres). It then:
+
+1. registers `--users` throwaway users through /api/auth/register/ and logs
+   them in;
+2. pairs them into threads through /api/chat/threads/;
+3. opens one socket per user to /ws/chat/.
+
+Messages go out open-loop at `--rate` per second for `--duration` seconds,
+round-robin over the senders. `--rest-share` of them go through
+POST .../messages/ (send_message) and the rest as chat_message frames.
+Each message is timed from just before it is sent until its new_message
+event reaches the other participant's socket.
+
+The report has delivered messages/sec, p50/p99/max delivery latency and
+resident memory per open socket. The client sockets live in the same
+process, so that figure covers both ends of each connection. The JSON goes
+to stdout and, with --output, to a file for comparing runs. Every seeded
+row is deleted afterwards.
+
+Password hashing is turned down to --bcrypt-rounds for the in-process
+server so that seeding large N doesn't take minutes. Raise `ulimit -n` for
+large N.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import uvicorn
+import websockets
+from sqlalchemy import delete
+
+from app.core.security import pwd_context
+from app.database import Base, SessionLocal, dispose_engines, get_engine
+from app.main import app
+from app.models.users import User
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def percentile(values, pct):
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+def post(url: str, body: dict, token: str = None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Cookie"] = f"sessionid={token}"
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.headers, json.loads(response.read())
+
+async def start_server():
+    # Each REST send opens its own connection, so leave room in the accept queue
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", access_log=False, backlog=8192)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+async def seed(url, prefix, args):
+    """Register, log in and pair up the users; returns [(user_id, token, thread_id)]."""
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(i):
+        body = {
+            "username": f"{prefix}{i}", "phone_number": f"+8{abs(hash(prefix)) % 10**5:05d}{i:07d}",
+            "display_name": f"Load {i}", "password": "bench", "password2": "bench",
+        }
+        async with semaphore:
+            await asyncio.to_thread(post, f"{url}/api/auth/register/", body)
+            headers, data = await asyncio.to_thread(post, f"{url}/api/auth/login/", {"identifier": body["username"], "password": "bench"})
+        token = headers.get("set-cookie", "").split("sessionid=", 1)[1].split(";", 1)[0]
+        return data["user"]["id"], token
+
+    users = await asyncio.gather(*(register(i) for i in range(args.users)))
+
+    async def pair(a, b):
+        async with semaphore:
+            _, thread = await asyncio.to_thread(post, f"{url}/api/chat/threads/", {"user_id": users[b][0]}, users[a][1])
+        return thread["id"]
+
+    threads = await asyncio.gather(*(pair(i, i + 1) for i in range(0, args.users - 1, 2)))
+    return [(user_id, token, threads[i // 2]) for i, (user_id, token) in enumerate(users[: len(threads) * 2])]
+
+async def run(url, users, args):
+    ws_url = url.replace("http", "ws", 1) + "/ws/chat/"
+    sent_at = {}
+    latencies = []
+    errors = {"rest": 0, "ws": 0}
+
+    gc.collect()
+    rss_before = rss_bytes()
+    sockets = []
+    for start in range(0, len(users), args.batch):
+        sockets += await asyncio.gather(*(
+            websockets.connect(ws_url, additional_headers={"Cookie": f"sessionid={token}"}, open_timeout=60, max_queue=None)
+            for _, token, _ in users[start:start + args.batch]
+        ))
+    await asyncio.sleep(1)
+    gc.collect()
+    rss_after = rss_bytes()
+
+    async def receive(ws, user_id):
+        try:
+            async for frame in ws:
+                event = orjson.loads(frame)
+                if event.get("type") != "new_message" or event["data"]["user"]["id"] == user_id:
+                    continue
+                started = sent_at.pop(event["data"]["message"], None)
+                if started is not None:
+                    latencies.append(time.perf_counter() - started)
+        except websockets.ConnectionClosed:
+            pass
+
+    receivers = [asyncio.create_task(receive(ws, user_id)) for ws, (user_id, _, _) in zip(sockets, users)]
+
+    rest_executor = ThreadPoolExecutor(args.rest_workers, thread_name_prefix="rest-client")
+    loop = asyncio.get_running_loop()
+
+    async def send_rest(token, thread_id, text):
+        try:
+            await loop.run_in_executor(
+                rest_executor, post, f"{url}/api/chat/threads/{thread_id}/messages/", {"message": text}, token
+            )
+        except (urllib.error.URLError, OSError):
+            errors["rest"] += 1
+            sent_at.pop(text, None)
+
+    async def send_ws(ws, thread_id, text):
+        try:
+            await ws.send(orjson.dumps({"type": "chat_message", "thread_id": thread_id, "message": text}).decode())
+        except websockets.ConnectionClosed:
+            errors["ws"] += 1
+            sent_at.pop(text, None)
+
+    total = int(args.rate * args.duration)
+    rest_every = round(1 / args.rest_share) if args.rest_share > 0 else 0
+    pending = {}
+    started = time.perf_counter()
+    for i in range(total):
+        # Open loop: each message has a fixed send time, however the server is doing
+        delay = started + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        n = i % len(users)
+        _, token, thread_id = users[n]
+        text = f"load {i}"
+        sent_at[text] = time.perf_counter()
+        if rest_every and i % rest_every == 0:
+            task = asyncio.create_task(send_rest(token, thread_id, text))
+        else:
+            task = asyncio.create_task(send_ws(sockets[n], thread_id, text))
+        pending[task] = text
+        task.add_done_callback(lambda task: pending.pop(task, None))
+    send_seconds = time.perf_counter() - started
+
+    # Give stragglers a chance to arrive before counting them as lost
+    deadline = time.perf_counter() + args.drain
+    while (sent_at or pending) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    # Sends still queued for a client thread (or in flight) when time ran out
+    unsent = sum(1 for text in pending.values() if text in sent_at)
+    rest_executor.shutdown(wait=False, cancel_futures=True)
+    for task in list(pending):
+        task.cancel()
+
+    await asyncio.gather(*(ws.close() for ws in sockets))
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "connections": len(sockets),
+        "messages_sent": total,
+        "messages_delivered": len(latencies),
+        "messages_lost": len(sent_at) - unsent,
+        "messages_unsent": unsent,
+        "send_errors": errors,
+        "offered_msgs_per_sec": args.rate,
+        "achieved_send_msgs_per_sec": round(total / send_seconds, 1),
+        "delivered_msgs_per_sec": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(statistics.median(ms), 2),
+            "p99": round(percentile(ms, 99), 2),
+            "max": round(ms[-1], 2),
+        } if ms else None,
+        "rss_per_connection_kb": round((rss_after - rss_before) / max(len(sockets), 1) / 1024, 1),
+    }
+
+async def main(args):
+    prefix = f"ld_{uuid.uuid4().hex[:6]}_"
+    pwd_context.update(bcrypt__rounds=args.bcrypt_rounds, bcrypt__min_rounds=args.bcrypt_rounds)
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    server, server_task, url = await start_server()
+    try:
+        started = time.perf_counter()
+        users = await seed(url, prefix, args)
+        seed_seconds = time.perf_counter() - started
+        results = {
+            "users": len(users),
+            "rate": args.rate,
+            "duration": args.duration,
+            "rest_share": args.rest_share,
+            "seed_seconds": round(seed_seconds, 1),
+        }
+        results.update(await run(url, users, args))
+    finally:
+        server.should_exit = True
+        await server_task
+        async with SessionLocal() as db:
+            # Threads, messages and profiles go with their users (ON DELETE CASCADE)
+            await db.execute(delete(User).where(User.username.startswith(prefix)))
+            await db.commit()
+        await dispose_engines()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="connected users, paired into threads (rounded down to even)")
+    parser.add_argument("--rate", type=float, default=200.0, help="messages per second across all senders")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rest-share", type=float, default=0.1, help="fraction sent through send_message instead of the socket")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to wait for in-flight messages after sending stops")
+    parser.add_argument("--rest-workers", type=int, default=32, help="client threads for send_message requests")
+    parser.add_argument("--batch", type=int, default=200, help="sockets opened at once")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel registrations and thread creations")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--output", help="also write the JSON report here")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""
+Bytes and frames on the wire for each /ws/chat/ protocol.
+
+    python -m bench.ws_protocol --replies 20 --chunks 40 --chunk-interval-ms 2
+
+Streams `--replies` bot replies (`--chunks` message_delta events each,
+`--chunk-interval-ms` apart, then the new_message) through a real
+ConnectionManager to one socket per protocol: v1, chat.v2.json and
+chat.v2.msgpack. The sockets only record what they are sent. Each frame is
+also run through a per-connection raw deflate stream the way
+permessage-deflate compresses it, so "deflated_bytes" is what actually
+crosses the network. Reports frames, bytes, and the mean delay the batch
+window adds per event.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from app.core.config import settings
+from app.websockets import manager as manager_module
+from app.websockets.protocol import V2_JSON, V2_MSGPACK
+
+class _Socket:
+    def __init__(self):
+        self.frames = 0
+        self.raw = 0
+        self.deflated = 0
+        self.events = 0
+        self.delay = 0.0
+        self.pending = []
+        # Context takeover, as uvicorn/websockets negotiate it by default
+        self.compressor = zlib.compressobj(wbits=-15)
+
+    def _record(self, data: bytes):
+        self.frames += 1
+        self.raw += len(data)
+        # permessage-deflate strips the trailing empty block
+        self.deflated += len(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+        now = time.perf_counter()
+        while self.pending and self.pending[0] <= now:
+            self.delay += now - self.pending.pop(0)
+            self.events += 1
+
+    async def send_text(self, data):
+        self._record(data.encode())
+
+    async def send_bytes(self, data):
+        self._record(data)
+
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have from or one had by word but "
+    "not what all were we when your can said there use an each which she do how their if will up other about out many"
+).split()
+
+def chunk():
+    return " ".join(random.choice(WORDS) for _ in range(random.randint(3, 8))) + " "
+
+async def run(args):
+    random.seed(7)
+    manager = manager_module.ConnectionManager(manager_module.InProcessBackend())
+    sockets = {}
+    for protocol in (None, V2_JSON, V2_MSGPACK):
+        socket = _Socket()
+        connection = manager_module.Connection(manager, f"user-{protocol}", socket, protocol)
+        manager.active_connections[connection.user_id_str] = {socket: connection}
+        connection.start()
+        sockets[protocol or "v1"] = socket
+    recipients = list(manager.active_connections)
+
+    bot = {"id": uuid.uuid4(), "username": "assistant", "phone_number": "+15550000000", "display_name": "Assistant", "is_bot": True}
+    thread_id = uuid.uuid4()
+    for _ in range(args.replies):
+        message_id = uuid.uuid4()
+        chunks = [chunk() for _ in range(args.chunks)]
+        events = [
+            {"type": "message_delta", "data": {"id": message_id, "thread_id": thread_id, "user": bot, "seq": seq, "delta": delta}}
+            for seq, delta in enumerate(chunks)
+        ]
+        events.append({"type": "new_message", "data": {
+            "id": message_id, "thread_id": thread_id, "user": bot,
+            "message": "".join(chunks), "timestamp": datetime.now(timezone.utc),
+        }})
+        for event in events:
+            sent = time.perf_counter()
+            for socket in sockets.values():
+                socket.pending.append(sent)
+            await manager.broadcast_to_users(recipients, event)
+            await asyncio.sleep(args.chunk_interval_ms / 1000)
+    # Let the last batch go out
+    await asyncio.sleep(settings.WS_BATCH_WINDOW_MS / 1000 + 0.05)
+    for connections in manager.active_connections.values():
+        for connection in connections.values():
+            connection.stop()
+
+    events = args.replies * (args.chunks + 1)
+    results = {"events": events, "batch_window_ms": settings.WS_BATCH_WINDOW_MS}
+    for name, socket in sockets.items():
+        results[name] = {
+            "frames": socket.frames,
+            "bytes": socket.raw,
+            "deflated_bytes": socket.deflated,
+            "bytes_per_event": round(socket.deflated / events, 1),
+            "mean_delay_ms": round(socket.delay / max(socket.events, 1) * 1000, 2),
+        }
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replies", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-interval-ms", type=float, default=2.0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
@@ -0,0 +1,5 @@
+-- Keyset pagination of a thread's history:
+--   WHERE thread_id = $1 AND ("timestamp", id) < ($2, $3) ORDER BY "timestamp" DESC, id DESC LIMIT n
+-- CONCURRENTLY so it can be applied without blocking writes; run outside a transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_chatmessage_thread_ts_id_idx
+    ON chat_chatmessage (thread_id, "timestamp", id);
@@ -0,0 +1,25 @@
+-- Denormalized summary of each thread's newest message, so the inbox is one
+-- indexed query instead of a lookup per thread in chat_chatmessage.
+ALTER TABLE chat_thread
+    ADD COLUMN IF NOT EXISTS last_message_id UUID,
+    ADD COLUMN IF NOT EXISTS last_message_preview VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS last_message_user_id UUID;
+
+-- Backfill from existing history (uses chat_chatmessage_thread_ts_id_idx from 0001)
+UPDATE chat_thread t
+SET last_message_id = m.id,
+    last_message_preview = left(m.message, 255),
+    last_message_at = m."timestamp",
+    last_message_user_id = m.user_id
+FROM (
+    SELECT DISTINCT ON (thread_id) thread_id, id, message, "timestamp", user_id
+    FROM chat_chatmessage
+    ORDER BY thread_id, "timestamp" DESC, id DESC
+) m
+WHERE m.thread_id = t.id AND t.last_message_id IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_thread_first_person_updated_idx
+    ON chat_thread (first_person_id, updated);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_thread_second_person_updated_idx
+    ON chat_thread (second_person_id, updated);
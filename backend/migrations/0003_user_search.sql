@@ -0,0 +1,17 @@
+-- User search (app/services/user_search.py, USER_SEARCH_BACKEND=postgres).
+--
+-- Name matches are ILIKE '%q%', which a trigram GIN index can serve; without
+-- these indexes every search is a sequential scan of core_user. Requires the
+-- pg_trgm contrib extension; deployments that can't install it should use
+-- USER_SEARCH_BACKEND=memory instead.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS core_user_username_trgm_idx
+    ON core_user USING gin (username gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS core_user_display_name_trgm_idx
+    ON core_user USING gin (display_name gin_trgm_ops);
+
+-- Phone numbers are matched by prefix on their digits only, so "+1 (555) 40"
+-- finds +15554038690. Queried as a range, which any btree can serve.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS core_user_phone_digits_idx
+    ON core_user ((regexp_replace(phone_number, '\D', '', 'g')));
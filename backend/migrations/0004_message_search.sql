@@ -0,0 +1,12 @@
+-- Full-text search over message content (GET /api/chat/search/).
+--
+-- A stored generated column, so every insert path (ORM, the batched ingestor,
+-- bulk COPY) keeps it current without application code. Adding it rewrites
+-- chat_chatmessage under an exclusive lock: on a large table, run this in a
+-- maintenance window. The config must match SEARCH_CONFIG in app/models/chats.py.
+ALTER TABLE chat_chatmessage
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', message)) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_chatmessage_search_idx
+    ON chat_chatmessage USING gin (search_vector);
@@ -0,0 +1,63 @@
+-- Monthly range partitioning of chat_chatmessage on "timestamp"
+-- (app/services/archive.py).
+--
+-- Rebuilds the table: every row is copied into a new partitioned
+-- chat_chatmessage inside one transaction, holding an exclusive lock on the
+-- old one throughout. Run it in a maintenance window with the app stopped.
+-- The primary key becomes (id, "timestamp") because a partitioned table's key
+-- has to include the partition key. Partitions are named
+-- chat_chatmessage_pYYYY_MM. This creates one for every month that has
+-- messages, plus the next three; from then on the app keeps
+-- PARTITION_MONTHS_AHEAD months created.
+DO $$
+DECLARE
+    month date;
+    last_month date;
+    pkey text;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'chat_chatmessage'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    -- Free up the names the new table's indexes need
+    ALTER TABLE chat_chatmessage RENAME TO chat_chatmessage_unpartitioned;
+    SELECT conname INTO pkey FROM pg_constraint
+    WHERE conrelid = 'chat_chatmessage_unpartitioned'::regclass AND contype = 'p';
+    EXECUTE format('ALTER TABLE chat_chatmessage_unpartitioned RENAME CONSTRAINT %I TO chat_chatmessage_unpartitioned_pkey', pkey);
+    ALTER INDEX IF EXISTS chat_chatmessage_thread_ts_id_idx RENAME TO chat_chatmessage_unpartitioned_thread_ts_id_idx;
+    ALTER INDEX IF EXISTS chat_chatmessage_search_idx RENAME TO chat_chatmessage_unpartitioned_search_idx;
+
+    CREATE TABLE chat_chatmessage (
+        id UUID NOT NULL,
+        thread_id UUID NOT NULL CONSTRAINT chat_chatmessage_thread_id_fkey REFERENCES chat_thread (id) ON DELETE CASCADE,
+        user_id UUID NOT NULL CONSTRAINT chat_chatmessage_user_id_fkey REFERENCES core_user (id) ON DELETE CASCADE,
+        message TEXT NOT NULL,
+        "timestamp" TIMESTAMP NOT NULL,
+        search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED,
+        PRIMARY KEY (id, "timestamp")
+    ) PARTITION BY RANGE ("timestamp");
+
+    SELECT date_trunc('month', coalesce(min("timestamp"), now()))::date,
+           greatest(date_trunc('month', max("timestamp")), date_trunc('month', now()) + interval '3 months')::date
+    INTO month, last_month
+    FROM chat_chatmessage_unpartitioned;
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF chat_chatmessage FOR VALUES FROM (%L) TO (%L)',
+            'chat_chatmessage_p' || to_char(month, 'YYYY_MM'), month, (month + interval '1 month')::date
+        );
+        month := (month + interval '1 month')::date;
+    END LOOP;
+
+    INSERT INTO chat_chatmessage (id, thread_id, user_id, message, "timestamp")
+    SELECT id, thread_id, user_id, message, "timestamp" FROM chat_chatmessage_unpartitioned;
+
+    -- Built after the copy, which is faster than maintaining them row by row.
+    -- Indexes on the parent are created on every partition, present and future.
+    CREATE INDEX chat_chatmessage_thread_ts_id_idx ON chat_chatmessage (thread_id, "timestamp", id);
+    CREATE INDEX chat_chatmessage_search_idx ON chat_chatmessage USING gin (search_vector);
+
+    DROP TABLE chat_chatmessage_unpartitioned;
+END $$;
+
+ANALYZE chat_chatmessage;
@@ -0,0 +1,21 @@
+-- Group threads (POST /api/chat/groups/).
+--
+-- 1:1 threads are unchanged. A group has is_group set, no first/second
+-- person, and one chat_threadmember row per member. Adding the columns with
+-- a constant default doesn't rewrite chat_thread.
+ALTER TABLE chat_thread
+    ADD COLUMN IF NOT EXISTS is_group BOOLEAN NOT NULL DEFAULT false,
+    ADD COLUMN IF NOT EXISTS name VARCHAR(100),
+    ALTER COLUMN first_person_id DROP NOT NULL,
+    ALTER COLUMN second_person_id DROP NOT NULL;
+
+CREATE TABLE IF NOT EXISTS chat_threadmember (
+    thread_id UUID NOT NULL REFERENCES chat_thread (id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES core_user (id) ON DELETE CASCADE,
+    is_admin BOOLEAN NOT NULL DEFAULT false,
+    joined_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (thread_id, user_id)
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_threadmember_user_idx
+    ON chat_threadmember (user_id, thread_id);
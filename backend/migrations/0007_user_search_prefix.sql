@@ -0,0 +1,10 @@
+-- Name prefix search (app/services/user_search.py, USER_SEARCH_BACKEND=postgres).
+--
+-- Username and display name prefix matches are read straight off these
+-- indexes in (name, id) order, so a page costs LIMIT rows however many users
+-- share the prefix. COLLATE "C" makes the range bounds and the order plain
+-- code point order; the expressions must match name_key() in app/models/users.py.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS core_user_username_key_idx
+    ON core_user ((lower(username) COLLATE "C"), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS core_user_display_name_key_idx
+    ON core_user ((lower(display_name) COLLATE "C"), id);
@@ -0,0 +1,89 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, text
+
+from app.database import SessionLocal, dispose_engines
+from app.models.chats import Thread, ThreadMember
+from app.models.users import User
+
+
+class Rows:
+    """
+    Users and threads created in the real database for one test, deleted
+    afterwards. Run the test's coroutine with run(), which also closes the
+    engine's connections before its event loop goes away.
+    """
+
+    def __init__(self):
+        self.user_ids = []
+        self.thread_ids = []
+
+    def run(self, coro):
+        async def wrapped():
+            try:
+                return await coro
+            finally:
+                await dispose_engines()
+        return asyncio.run(wrapped())
+
+    async def user(self, name: str, is_bot: bool = False) -> User:
+        suffix = uuid.uuid4().hex[:8]
+        user = User(
+            username=f"test_{name}_{suffix}", phone_number=f"+9{uuid.uuid4().int % 10**12:012d}",
+            display_name=name.title(), password="!", is_bot=is_bot,
+        )
+        async with SessionLocal() as db:
+            db.add(user)
+            await db.commit()
+        self.user_ids.append(user.id)
+        return user
+
+    async def thread(self, first: User, second: User) -> Thread:
+        thread = Thread(first_person_id=first.id, second_person_id=second.id)
+        async with SessionLocal() as db:
+            db.add(thread)
+            await db.commit()
+        self.thread_ids.append(thread.id)
+        return thread
+
+    async def group(self, admin: User, *members: User) -> Thread:
+        thread = Thread(id=uuid.uuid4(), is_group=True, name="Test group")
+        async with SessionLocal() as db:
+            db.add(thread)
+            await db.flush()
+            # Joined in the order given, a second apart, so seniority is unambiguous
+            joined = datetime.utcnow()
+            db.add(ThreadMember(thread_id=thread.id, user_id=admin.id, is_admin=True, joined_at=joined))
+            for n, member in enumerate(members, 1):
+                db.add(ThreadMember(thread_id=thread.id, user_id=member.id, joined_at=joined + timedelta(seconds=n)))
+            await db.commit()
+        self.thread_ids.append(thread.id)
+        return thread
+
+    async def cleanup(self):
+        async with SessionLocal() as db:
+            if self.thread_ids:
+                await db.execute(delete(Thread).where(Thread.id.in_(self.thread_ids)))
+            if self.user_ids:
+                await db.execute(delete(User).where(User.id.in_(self.user_ids)))
+            await db.commit()
+
+
+@pytest.fixture
+def rows():
+    """A Rows for tests that need Postgres (DATABASE_URL); skipped when it isn't reachable."""
+    rows = Rows()
+
+    async def probe():
+        async with SessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+
+    try:
+        rows.run(asyncio.wait_for(probe(), 5))
+    except Exception as e:
+        pytest.skip(f"database unavailable: {e}")
+    yield rows
+    rows.run(rows.cleanup())
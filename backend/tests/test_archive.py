@@ -0,0 +1,122 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+
+from app.core.config import settings
+from app.database import SessionLocal, get_engine
+from app.models.chats import ChatMessage, add_months, create_partition_sql, partition_month, partition_name
+from app.services import archive as module
+from app.services.archive import MessageArchive, archive_partition, attached_partitions, create_partitions
+
+THREAD, USER = uuid.uuid4(), uuid.uuid4()
+
+
+def test_month_arithmetic_and_names():
+    assert add_months(datetime(2026, 11, 1), 2) == datetime(2027, 1, 1)
+    assert add_months(datetime(2026, 1, 1), -13) == datetime(2024, 12, 1)
+    name = partition_name(datetime(2026, 3, 1))
+    assert name == "chat_chatmessage_p2026_03"
+    assert partition_month(name) == datetime(2026, 3, 1)
+    assert partition_month("chat_chatmessage_default") is None
+    assert partition_month("core_user") is None
+    assert "FROM ('2026-12-01') TO ('2027-01-01')" in create_partition_sql(datetime(2026, 12, 1))
+
+
+def record(month, n, thread_id=THREAD):
+    return {
+        "id": str(uuid.UUID(int=month.month * 100 + n)), "thread_id": str(thread_id), "user_id": str(USER),
+        "message": f"{month:%b} {n}", "timestamp": (month + timedelta(days=n)).isoformat(),
+    }
+
+
+def write_partition(directory, month, threads):
+    # The files archive_partition writes: one gzip member per thread, an index, a manifest entry
+    name = partition_name(month)
+    index = {}
+    with open(os.path.join(directory, f"{name}.ndjson.gz"), "wb") as out:
+        for thread_id, records in threads.items():
+            module._write_member(out, index, thread_id, [orjson.dumps(r) for r in records])
+    module._write_json(os.path.join(directory, f"{name}.index.json"), index)
+    manifest = module._read_manifest(directory)
+    manifest["partitions"].append({
+        "name": name, "from": month.isoformat(), "to": add_months(month, 1).isoformat(),
+        "rows": sum(map(len, threads.values())), "data": f"{name}.ndjson.gz", "index": f"{name}.index.json",
+    })
+    module._write_json(os.path.join(directory, module.MANIFEST), manifest)
+
+
+@pytest.fixture
+def archived(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(module, "MANIFEST_CHECK_INTERVAL", 0)
+    january, february = datetime(2020, 1, 1), datetime(2020, 2, 1)
+    other = uuid.uuid4()
+    write_partition(tmp_path, january, {THREAD: [record(january, n) for n in range(3)], other: [record(january, 9, other)]})
+    write_partition(tmp_path, february, {THREAD: [record(february, n) for n in range(3)]})
+    return MessageArchive()
+
+
+def messages(records):
+    return [r[3] for r in records]
+
+
+def test_reads_page_across_archived_months(archived):
+    async def run():
+        assert await archived.has_thread(THREAD)
+        assert not await archived.has_thread(uuid.uuid4())
+        assert archived.stats()["partitions"] == 2
+        assert archived.covers(datetime(2020, 2, 28)) and not archived.covers(datetime(2020, 3, 1))
+
+        segments = archived._threads[THREAD]
+        # Newest first from the end, then older pages before a cursor
+        assert messages(archived._read(segments, None, None, 4)) == ["Feb 2", "Feb 1", "Feb 0", "Jan 2"]
+        cursor = (datetime(2020, 2, 1), uuid.UUID(int=200))
+        assert messages(archived._read(segments, cursor, None, 10)) == ["Jan 2", "Jan 1", "Jan 0"]
+        # Oldest first after a cursor
+        cursor = (datetime(2020, 1, 2), uuid.UUID(int=101))
+        assert messages(archived._read(segments, None, cursor, 2)) == ["Jan 2", "Feb 0"]
+
+        # The whole thread, oldest first, for exports
+        assert messages([r async for r in archived.records(THREAD)]) == ["Jan 0", "Jan 1", "Jan 2", "Feb 0", "Feb 1", "Feb 2"]
+
+    asyncio.run(run())
+
+
+def test_archive_partition_end_to_end(rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(module, "MANIFEST_CHECK_INTERVAL", 0)
+    # Long before any real data, so only this test's rows are in it
+    month = datetime(2001, 1, 1)
+    name = partition_name(month)
+
+    async def run():
+        async with get_engine().connect() as conn:
+            if await attached_partitions(conn) is None:
+                pytest.skip("chat_chatmessage is not partitioned")
+        alice, bob = await rows.user("alice"), await rows.user("bob")
+        thread = await rows.thread(alice, bob)
+        await create_partitions([month])
+        try:
+            async with SessionLocal() as db:
+                for n in range(3):
+                    db.add(ChatMessage(thread_id=thread.id, user_id=alice.id, message=f"old {n}", timestamp=month + timedelta(days=n)))
+                await db.commit()
+
+            assert await archive_partition(name, month) == 3
+            async with get_engine().connect() as conn:
+                assert name not in await attached_partitions(conn)
+
+            archive = MessageArchive()
+            async with SessionLocal() as db:
+                page = await archive.messages(db, thread.id, limit=2)
+            assert [m["message"] for m in page] == ["old 2", "old 1"]
+            assert page[0]["user"]["id"] == alice.id
+        finally:
+            async with get_engine().begin() as conn:
+                await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+
+    rows.run(run())
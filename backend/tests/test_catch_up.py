@@ -0,0 +1,52 @@
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.schemas.events import message_data, user_data
+from app.services import catch_up
+from app.services.catch_up import messages_since, parse_since
+from app.services.ingest import MessageIngestor
+from app.services.recent_messages import BACKLOG_SIZE
+
+
+def test_parse_since():
+    message_id = uuid.uuid4()
+    assert parse_since("2026-01-02T03:04:05.123456", str(message_id)) == (datetime(2026, 1, 2, 3, 4, 5, 123456), message_id)
+    # Aware timestamps are converted to the naive UTC the database stores
+    assert parse_since("2026-01-02T05:04:05+02:00", None) == (datetime(2026, 1, 2, 3, 4, 5), uuid.UUID(int=0))
+    assert parse_since(None, str(message_id)) is None
+    assert parse_since("yesterday", None) is None
+    assert parse_since("2026-01-02T03:04:05", "not-a-uuid") is None
+
+
+def test_reconnect_gets_what_it_missed(rows, monkeypatch):
+    monkeypatch.setattr(catch_up.recent_messages, "_backlog", deque(maxlen=BACKLOG_SIZE))
+
+    async def run():
+        alice, bob, carol = await rows.user("alice"), await rows.user("bob"), await rows.user("carol")
+        with_bob, elsewhere = await rows.thread(alice, bob), await rows.thread(bob, carol)
+
+        ingestor = MessageIngestor()
+        seen = ingestor.submit(with_bob.id, alice.id, "seen")
+        missed = [ingestor.submit(with_bob.id, bob.id, f"missed {n}") for n in range(3)]
+        ingestor.submit(elsewhere.id, carol.id, "not alice's")
+        # A millisecond apart, so the order doesn't depend on the random ids
+        for n, msg in enumerate(ingestor._pending):
+            msg.timestamp = seen.timestamp + timedelta(milliseconds=n)
+        await ingestor.flush()
+
+        # Broadcast but not committed yet
+        pending = message_data(uuid.uuid4(), with_bob.id, user_data(bob), "in flight", seen.timestamp + timedelta(seconds=1))
+        catch_up.recent_messages.add(pending)
+
+        messages, complete = await messages_since(alice.id, (seen.timestamp, seen.id))
+        assert [m["message"] for m in messages] == ["missed 0", "missed 1", "missed 2", "in flight"]
+        assert complete
+
+        monkeypatch.setattr(settings, "CATCH_UP_LIMIT", 2)
+        messages, complete = await messages_since(alice.id, (seen.timestamp, seen.id))
+        assert [m["id"] for m in messages] == [missed[0].id, missed[1].id]
+        assert not complete
+
+    rows.run(run())
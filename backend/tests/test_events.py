@@ -0,0 +1,43 @@
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import orjson
+
+from app.schemas.chats import MessageOut, ThreadOut
+from app.schemas.events import dumps, json_response, message_data, thread_data, user_data
+
+ALICE = SimpleNamespace(
+    id=uuid.uuid4(), username="alice", phone_number="+10000000000", display_name="Alice", is_bot=False,
+)
+
+
+class DriverUUID(uuid.UUID):
+    """Like asyncpg's UUID: a subclass orjson doesn't encode natively."""
+
+
+def test_message_matches_the_pydantic_model():
+    data = message_data(uuid.uuid4(), DriverUUID(int=7), user_data(ALICE), "hi", datetime(2026, 1, 1, 12, 30, 0, 123456))
+    expected = MessageOut.model_validate(data).model_dump(mode="json")
+    assert orjson.loads(dumps(data)) == expected
+
+
+def test_thread_matches_the_pydantic_model():
+    base = dict(
+        id=uuid.uuid4(), first_person_id=ALICE.id, second_person_id=uuid.uuid4(), is_group=False, name=None,
+        updated=datetime(2026, 1, 2),
+    )
+    for thread in (
+        SimpleNamespace(**base, last_message_id=None, last_message_preview=None, last_message_at=None, last_message_user_id=None),
+        SimpleNamespace(**base, last_message_id=uuid.uuid4(), last_message_preview="hello",
+                        last_message_at=datetime(2026, 1, 2), last_message_user_id=ALICE.id),
+    ):
+        expected = ThreadOut.from_thread(thread).model_dump(mode="json")
+        assert orjson.loads(dumps(thread_data(thread))) == expected
+
+
+def test_json_response_is_encoded_as_is():
+    response = json_response([user_data(ALICE)], headers={"X-Older-Cursor": "abc"})
+    assert response.media_type == "application/json"
+    assert response.headers["X-Older-Cursor"] == "abc"
+    assert orjson.loads(response.body) == [{**vars(ALICE), "id": str(ALICE.id)}]
@@ -0,0 +1,132 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from app.core.config import settings
+from app.services import ingest
+from app.services.ingest import MAX_FLUSH_ATTEMPTS, MessageIngestor
+
+
+class FakeDatabase:
+    """Stands in for MessageIngestor._write: records each batch, refusing some rows or everything."""
+
+    def __init__(self):
+        self.batches = []
+        self.saved = []
+        self.refuse = set()
+        self.down = False
+
+    async def write(self, batch):
+        self.batches.append([msg.message for msg in batch])
+        if self.down:
+            raise OperationalError("INSERT", {}, ConnectionRefusedError("database is down"))
+        if any(msg.message in self.refuse for msg in batch):
+            raise DataError("INSERT", {}, ValueError("row refused"))
+        self.saved.extend(msg.message for msg in batch)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(MessageIngestor, "_write", lambda self, batch: database.write(batch))
+
+    # Dropped messages are retracted from their thread; there is no thread to find here
+    async def no_thread(db, thread_id):
+        return None
+    monkeypatch.setattr(ingest, "get_thread_info", no_thread)
+    return database
+
+
+def submit_all(ingestor, texts):
+    thread_id, user_id = uuid.uuid4(), uuid.uuid4()
+    return [ingestor.submit(thread_id, user_id, text) for text in texts]
+
+
+def test_flush_writes_one_batch(database, monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_FLUSH_BATCH_SIZE", 3)
+
+    async def run():
+        ingestor = MessageIngestor()
+        msgs = submit_all(ingestor, ["a", "b", "c", "d"])
+        await ingestor.flush()
+        assert database.batches == [["a", "b", "c"]]
+        assert [msg.persisted.done() for msg in msgs] == [True, True, True, False]
+        await ingestor.flush()
+        assert database.saved == ["a", "b", "c", "d"]
+        assert ingestor.stats() == {"pending": 0}
+
+    asyncio.run(run())
+
+
+def test_full_batch_wakes_the_flusher(database, monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_FLUSH_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "MESSAGE_FLUSH_INTERVAL_MS", 60_000)
+
+    async def run():
+        ingestor = MessageIngestor()
+        await ingestor.start()
+        try:
+            msgs = submit_all(ingestor, ["a", "b"])
+            # Long before the interval is up
+            await asyncio.wait_for(asyncio.gather(*(msg.persisted for msg in msgs)), 1.0)
+        finally:
+            await ingestor.stop()
+        assert database.batches == [["a", "b"]]
+
+    asyncio.run(run())
+
+
+def test_unreachable_database_requeues_in_order(database):
+    async def run():
+        ingestor = MessageIngestor()
+        msgs = submit_all(ingestor, ["a", "b"])
+        database.down = True
+        with pytest.raises(OperationalError):
+            await ingestor.flush()
+        # Nothing split: the whole batch goes back as it was
+        assert database.batches == [["a", "b"]]
+        assert [msg.attempts for msg in msgs] == [1, 1]
+        submit_all(ingestor, ["c"])
+
+        database.down = False
+        await ingestor.flush()
+        assert database.saved == ["a", "b", "c"]
+        assert all(msg.persisted.done() and msg.persisted.exception() is None for msg in msgs)
+
+    asyncio.run(run())
+
+
+def test_gives_up_after_max_attempts(database):
+    async def run():
+        ingestor = MessageIngestor()
+        (msg,) = submit_all(ingestor, ["a"])
+        database.down = True
+        for _ in range(MAX_FLUSH_ATTEMPTS):
+            with pytest.raises(OperationalError):
+                await ingestor.flush()
+        assert ingestor.stats() == {"pending": 0}
+        assert isinstance(msg.persisted.exception(), OperationalError)
+
+    asyncio.run(run())
+
+
+def test_refused_row_is_dropped_alone(database):
+    async def run():
+        ingestor = MessageIngestor()
+        texts = ["a", "b", "poison", "c", "d", "e"]
+        msgs = submit_all(ingestor, texts)
+        database.refuse = {"poison"}
+        # Nothing to retry, so the flush itself succeeds
+        await ingestor.flush()
+
+        assert database.saved == ["a", "b", "c", "d", "e"]
+        assert ingestor.stats() == {"pending": 0}
+        for text, msg in zip(texts, msgs):
+            error = msg.persisted.exception()
+            assert isinstance(error, DataError) if text == "poison" else error is None
+        # Split in halves until the refused row was on its own
+        assert ["poison"] in database.batches
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import orjson
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.api.chat import add_members, remove_member
+from app.core.principal import Principal
+from app.database import SessionLocal
+from app.models.chats import ThreadMember
+from app.schemas.chats import MembersAdd
+
+
+async def members(thread_id):
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(ThreadMember.user_id, ThreadMember.is_admin).where(ThreadMember.thread_id == thread_id)
+        )
+        return dict(result.all())
+
+
+async def remove(thread, user, by):
+    async with SessionLocal() as db:
+        await remove_member(thread.id, user.id, db=db, current_user=Principal.from_user(by))
+
+
+def test_last_admin_leaving_promotes_the_longest_standing_member(rows):
+    async def run():
+        alice, bob, carol = await rows.user("alice"), await rows.user("bob"), await rows.user("carol")
+        group = await rows.group(alice, bob, carol)
+
+        await remove(group, alice, by=alice)
+        assert await members(group.id) == {bob.id: True, carol.id: False}
+
+        # Not the last admin: nobody else is promoted
+        async with SessionLocal() as db:
+            await add_members(group.id, MembersAdd(user_ids=[alice.id]), db=db, current_user=Principal.from_user(bob))
+        await remove(group, carol, by=carol)
+        assert await members(group.id) == {bob.id: True, alice.id: False}
+
+    rows.run(run())
+
+
+def test_only_admins_remove_others(rows):
+    async def run():
+        alice, bob, carol = await rows.user("alice"), await rows.user("bob"), await rows.user("carol")
+        group = await rows.group(alice, bob, carol)
+
+        with pytest.raises(HTTPException) as refused:
+            await remove(group, carol, by=bob)
+        assert refused.value.status_code == 403
+
+        outsider = await rows.user("dave")
+        with pytest.raises(HTTPException) as missing:
+            await remove(group, outsider, by=alice)
+        assert missing.value.status_code == 404
+        assert len(await members(group.id)) == 3
+
+    rows.run(run())
+
+
+def test_adding_an_existing_member_is_skipped(rows):
+    async def run():
+        alice, bob, carol = await rows.user("alice"), await rows.user("bob"), await rows.user("carol")
+        group = await rows.group(alice, bob)
+        async with SessionLocal() as db:
+            added = await add_members(
+                group.id, MembersAdd(user_ids=[bob.id, carol.id]), db=db, current_user=Principal.from_user(alice)
+            )
+        assert {member["user"]["id"] for member in orjson.loads(added.body)} == {str(u.id) for u in (alice, bob, carol)}
+        assert await members(group.id) == {alice.id: True, bob.id: False, carol.id: False}
+
+    rows.run(run())
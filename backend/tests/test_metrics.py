@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.metrics import MetricsMiddleware, Registry
+
+
+def test_counter_and_histogram_exposition():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("route",))
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    requests.inc('/say "hi"\n')
+    requests.inc('/say "hi"\n', amount=2)
+    latency.observe(0.05)
+    latency.observe(0.1)
+    latency.observe(5.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/say \\"hi\\"\\n"} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.15",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_callbacks_are_read_at_scrape_time():
+    registry = Registry()
+    state = {"size": 1}
+    registry.callback("size", "Size.", lambda: state["size"])
+    registry.callback("by_engine", "Per engine.", lambda: {"primary": 2, "replica": None}, labelnames=("engine",))
+    registry.callback("pairs_total", "Pairs.", lambda: {("a", "b"): 1.5}, type="counter", labelnames=("x", "y"))
+    registry.callback("unknown", "Not loaded yet.", lambda: None)
+    registry.callback("broken", "Raises.", lambda: 1 / 0)
+    state["size"] = 7
+
+    lines = registry.render().splitlines()
+    assert "size 7" in lines
+    assert 'by_engine{engine="primary"} 2' in lines
+    # A None value is left out rather than reported as zero
+    assert not any(line.startswith(("by_engine{engine=\"replica\"", "unknown ")) for line in lines)
+    assert "# TYPE pairs_total counter" in lines and 'pairs_total{x="a",y="b"} 1.5' in lines
+    # One failing callback doesn't take the scrape down
+    assert "# TYPE broken gauge" not in lines
+
+
+def test_duplicate_names_are_refused():
+    registry = Registry()
+    registry.counter("events_total", "Events.")
+    with pytest.raises(ValueError):
+        registry.histogram("events_total", "Events.")
+
+
+def test_middleware_labels_by_route_template(monkeypatch):
+    from app.core import metrics
+    registry = Registry()
+    monkeypatch.setattr(metrics, "http_requests", registry.counter("http_requests_total", "", ("method", "route", "status")))
+    monkeypatch.setattr(metrics, "http_request_duration", registry.histogram("http_request_duration_seconds", "", ("method", "route")))
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/threads/{thread_id}/")
+        await send({"type": "http.response.start", "status": 404})
+
+    async def send(message):
+        pass
+
+    async def run():
+        middleware = MetricsMiddleware(app)
+        for path in ("/threads/1/", "/threads/2/", "/metrics"):
+            await middleware({"type": "http", "path": path, "method": "GET"}, None, send)
+
+    asyncio.run(run())
+    assert metrics.http_requests._values == {("GET", "/threads/{thread_id}/", 404): 2}
+
+
+def test_app_metrics_render(capsys):
+    # Every scrape-time callback the app registers can read its component, even before startup
+    import app.api.metrics  # noqa: F401  registers them
+    from app.core.metrics import registry
+    output = registry.render()
+    assert "Error rendering metric" not in capsys.readouterr().out
+    for name in ("ws_connections", "bot_queue_depth", "principal_cache_size", "recent_messages_threads", "ingest_pending_messages"):
+        assert f"# TYPE {name} gauge" in output
@@ -0,0 +1,124 @@
+import asyncio
+import uuid
+
+from app.schemas.events import dumps
+from app.services.presence import PresenceTracker
+from app.websockets.manager import manager
+
+
+def presence_event(node, online=(), offline=(), recorded=()):
+    # What another worker's PresenceTracker publishes
+    return dumps({"type": "presence", "data": {
+        "node": node, "online": list(online), "offline": list(offline), "recorded": list(recorded),
+    }}).decode()
+
+
+def state(tracker, user_id):
+    change = tracker._changes.get(user_id)
+    return None if change is None else (change.was_online, change.is_online)
+
+
+def test_offline_only_after_the_last_socket():
+    async def run():
+        tracker = PresenceTracker()
+        user_id = uuid.uuid4()
+        tracker.connect(user_id)
+        tracker.connect(user_id)
+        assert state(tracker, user_id) == (False, True)
+
+        tracker.disconnect(user_id)
+        assert tracker.is_online(user_id)
+        assert state(tracker, user_id) == (False, True)
+
+        tracker.disconnect(user_id)
+        assert not tracker.is_online(user_id)
+        # Online and offline again before a flush: nothing to announce
+        assert state(tracker, user_id) == (False, False)
+
+        # A disconnect without a connect changes nothing
+        tracker.disconnect(user_id)
+        assert tracker.stats()["online_users"] == 0
+
+    asyncio.run(run())
+
+
+def test_offline_deferred_while_another_worker_holds_the_user():
+    async def run():
+        tracker = PresenceTracker()
+        user_id = uuid.uuid4()
+        # Sorts after this worker's node id, so this worker settles a tie
+        other = "~" + manager.backend.node_id
+        tracker.on_remote_event(presence_event(other, online=[str(user_id)]))
+        assert tracker.stats()["online_elsewhere"] == 1
+
+        tracker.connect(user_id)
+        # Already online elsewhere: the row is refreshed, not announced as a change
+        assert state(tracker, user_id) == (True, True)
+        tracker._changes.clear()
+
+        tracker.disconnect(user_id)
+        assert state(tracker, user_id) is None
+        assert tracker.stats()["deferred_offline"] == 1
+
+        # The other worker's socket closes too, and it deferred to us as well
+        tracker.on_remote_event(presence_event(other, offline=[str(user_id)]))
+        assert tracker.stats() == {"online_users": 0, "pending_changes": 1, "online_elsewhere": 0, "deferred_offline": 0}
+        assert state(tracker, user_id) == (True, False)
+
+    asyncio.run(run())
+
+
+def test_offline_recorded_by_exactly_one_worker():
+    async def run():
+        user_id = uuid.uuid4()
+        for other, recorded, expected in (
+            # The sender already recorded it
+            ("~", [str(user_id)], None),
+            # Both deferred; the worker with the smaller node id records it
+            ("~", [], (True, False)),
+            ("", [], None),
+        ):
+            tracker = PresenceTracker()
+            tracker.on_remote_event(presence_event(other, online=[str(user_id)]))
+            tracker.connect(user_id)
+            tracker._changes.clear()
+            tracker.disconnect(user_id)
+            tracker.on_remote_event(presence_event(other, offline=[str(user_id)], recorded=recorded))
+            assert state(tracker, user_id) == expected
+            assert tracker.stats()["deferred_offline"] == 0
+
+    asyncio.run(run())
+
+
+def test_connect_elsewhere_overtakes_an_unflushed_offline():
+    async def run():
+        tracker = PresenceTracker()
+        user_id = uuid.uuid4()
+        tracker.connect(user_id)
+        tracker._changes.clear()
+        tracker.disconnect(user_id)
+        assert state(tracker, user_id) == (True, False)
+
+        tracker.on_remote_event(presence_event("other", online=[str(user_id)]))
+        assert state(tracker, user_id) is None
+
+    asyncio.run(run())
+
+
+def test_silent_worker_expires():
+    async def run():
+        tracker = PresenceTracker()
+        user_id = uuid.uuid4()
+        tracker.on_remote_event(presence_event("other", online=[str(user_id)]))
+        tracker.connect(user_id)
+        tracker._changes.clear()
+        tracker.disconnect(user_id)
+        assert tracker.stats()["deferred_offline"] == 1
+
+        # Nothing from the other worker for three refresh intervals: it's gone
+        tracker._remote[user_id]["other"] -= 3600
+        tracker._refresh()
+        assert tracker.stats()["deferred_offline"] == 0
+        assert state(tracker, user_id) == (True, False)
+
+    asyncio.run(run())
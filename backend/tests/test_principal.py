@@ -0,0 +1,89 @@
+import time
+import uuid
+from types import SimpleNamespace
+
+from app.core import principal
+from app.core.principal import Principal, PrincipalCache
+
+
+def make_principal(name="alice"):
+    return Principal(
+        id=uuid.uuid4(), username=name, phone_number="+10000000000",
+        display_name=name.title(), is_bot=False, is_active=True,
+    )
+
+
+def test_invalidate_user_drops_all_their_tokens():
+    cache = PrincipalCache(max_size=10, ttl=60)
+    alice, bob = make_principal("alice"), make_principal("bob")
+    cache.put("a1", alice)
+    cache.put("a2", alice)
+    cache.put("b1", bob)
+    assert cache.get("a1") is alice
+
+    cache.invalidate_user(alice.id)
+    assert cache.get("a1") is None and cache.get("a2") is None
+    assert cache.get("b1") is bob
+    assert cache.generation == 1
+
+
+def test_load_that_raced_an_invalidation_is_not_cached():
+    cache = PrincipalCache(max_size=10, ttl=60)
+    alice = make_principal()
+    generation = cache.generation
+    # The account changes while the request is still reading the old row
+    cache.invalidate_user(alice.id)
+    cache.put("a1", alice, generation=generation)
+    assert cache.get("a1") is None
+
+    cache.put("a1", alice, generation=cache.generation)
+    assert cache.get("a1") is alice
+
+
+def test_entry_never_outlives_the_token():
+    cache = PrincipalCache(max_size=10, ttl=60)
+    alice = make_principal()
+    cache.put("expired", alice, token_exp=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache.put("short", alice, token_exp=time.time() + 0.05)
+    assert cache.get("short") is alice
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 2}
+
+
+def test_least_recently_used_is_evicted():
+    cache = PrincipalCache(max_size=2, ttl=60)
+    alice, bob, carol = make_principal("alice"), make_principal("bob"), make_principal("carol")
+    cache.put("a", alice)
+    cache.put("b", bob)
+    cache.get("a")
+    cache.put("c", carol)
+    assert cache.get("b") is None
+    assert cache.get("a") is alice and cache.get("c") is carol
+
+    # Evicted tokens don't linger in the per-user index
+    cache.invalidate_user(bob.id)
+    assert bob.id not in cache._tokens_by_user
+
+
+def test_commit_invalidates_and_tells_the_other_workers(monkeypatch):
+    cache = PrincipalCache(max_size=10, ttl=60)
+    monkeypatch.setattr(principal, "principal_cache", cache)
+    told = []
+    monkeypatch.setattr(principal, "invalidation_listeners", [told.append])
+    alice = make_principal()
+    cache.put("a1", alice)
+
+    # Flushed but rolled back: nothing happened
+    session = SimpleNamespace(info={"principal_invalidations": {alice.id}})
+    principal._after_rollback(session)
+    principal._after_commit(session)
+    assert cache.get("a1") is alice and told == []
+
+    session.info["principal_invalidations"] = {alice.id}
+    principal._after_commit(session)
+    assert cache.get("a1") is None
+    assert told == [{alice.id}]
+    assert session.info == {}
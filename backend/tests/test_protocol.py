@@ -0,0 +1,114 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.schemas.events import dumps, message_data, message_event, user_data
+from app.websockets import protocol as wire
+from app.websockets.manager import Connection, ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(wire.msgpack.unpackb(data))
+
+
+def person(name):
+    return user_data(SimpleNamespace(
+        id=uuid.uuid4(), username=name, phone_number="+10000000000", display_name=name.title(), is_bot=False,
+    ))
+
+
+def said(sender, text):
+    return wire.Outgoing(message_event(message_data(uuid.uuid4(), uuid.uuid4(), sender, text, datetime(2026, 1, 1))))
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def summary(frame):
+    # Each event as the profile it introduces or the text it carries
+    return [event["data"]["username"] if event["type"] == "user" else event["data"]["message"] for event in frame]
+
+
+@pytest.mark.parametrize("protocol", [
+    wire.V2_JSON,
+    pytest.param(wire.V2_MSGPACK, marks=pytest.mark.skipif(wire.msgpack is None, reason="msgpack not installed")),
+])
+def test_v2_batches_and_sends_each_profile_once(protocol):
+    async def run():
+        socket = FakeSocket()
+        connection = Connection(ConnectionManager(), "me", socket, protocol)
+        connection.start()
+        try:
+            alice, bob = person("alice"), person("bob")
+            for event in (said(alice, "one"), said(alice, "two"), said(bob, "three")):
+                connection.enqueue(event)
+            await wait_for(lambda: socket.sent)
+            # One frame for the burst, each profile ahead of its first message
+            assert [summary(frame) for frame in socket.sent] == [["alice", "one", "two", "bob", "three"]]
+            message = socket.sent[0][1]["data"]
+            assert "user" not in message and message["user_id"] == str(alice["id"])
+
+            connection.enqueue(said(alice, "four"))
+            await wait_for(lambda: len(socket.sent) == 2)
+            assert summary(socket.sent[1]) == ["four"]
+        finally:
+            connection.stop()
+
+    asyncio.run(run())
+
+
+def test_profiles_are_resent_past_the_limit(monkeypatch):
+    monkeypatch.setattr(wire, "KNOWN_USERS_LIMIT", 1)
+    connection = Connection(ConnectionManager(), "me", FakeSocket(), wire.V2_JSON)
+    alice, bob = person("alice"), person("bob")
+    for sender in (alice, bob, alice):
+        assert connection.enqueue(said(sender, "hi"))
+    assert connection.queue.qsize() == 6
+
+
+def test_v1_gets_the_full_event():
+    connection = Connection(ConnectionManager(), "me", FakeSocket())
+    event = said(person("alice"), "hi")
+    assert connection.enqueue(event)
+    assert json.loads(connection.queue.get_nowait()) == json.loads(dumps(event.event))
+    assert connection.queue.empty()
+
+
+def test_each_form_is_encoded_once():
+    alice = person("alice")
+    event = said(alice, "hi")
+    compact = event.compact(wire.V2_JSON)
+    assert event.compact(wire.V2_JSON) is compact
+    assert event.profile(wire.V2_JSON) is event.profile(wire.V2_JSON)
+    assert event.text() is event.text()
+
+    # Forwarded from another worker as v1 text: same compact form
+    remote = wire.Outgoing(text=event.text())
+    assert json.loads(remote.compact(wire.V2_JSON)) == json.loads(compact)
+    assert json.loads(remote.profile(wire.V2_JSON))["data"]["id"] == str(alice["id"])
+
+
+def test_frame_joins_encoded_events():
+    events = [{"type": "a"}, {"type": "b"}]
+    assert json.loads(wire.frame(wire.V2_JSON, [wire.encode(wire.V2_JSON, e) for e in events])) == events
+    if wire.msgpack is not None:
+        packed = wire.frame(wire.V2_MSGPACK, [wire.encode(wire.V2_MSGPACK, e) for e in events])
+        assert wire.msgpack.unpackb(packed) == events
+    assert wire.negotiate(["chat.v9", wire.V2_JSON]) == wire.V2_JSON
+    assert wire.negotiate(["chat.v9"]) is None
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import uuid
+
+from app.websockets import pubsub
+from app.websockets.manager import Connection, ConnectionManager
+from app.websockets.pubsub import LocalSocketBackend, PostgresBackend
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+def attach(manager, user_id):
+    socket = FakeSocket()
+    connection = Connection(manager, str(user_id), socket)
+    manager.active_connections[str(user_id)] = {socket: connection}
+    connection.start()
+    return socket
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def test_local_socket_backend_delivers_between_workers(tmp_path):
+    async def run():
+        path = str(tmp_path / "hub.sock")
+        first = ConnectionManager(LocalSocketBackend(path))
+        second = ConnectionManager(LocalSocketBackend(path))
+        await first.start()
+        await second.start()
+        try:
+            user_id = uuid.uuid4()
+            on_first, on_second = attach(first, user_id), attach(second, user_id)
+            heard = []
+            first.remote_listeners.append(heard.append)
+
+            await first.broadcast_to_user(user_id, {"type": "new_message", "data": {"message": "hi"}})
+            await wait_for(lambda: on_second.sent)
+            # Give an echo back to the publisher time to arrive, if the backend sent one
+            await asyncio.sleep(0.1)
+
+            assert on_second.sent == [{"type": "new_message", "data": {"message": "hi"}}]
+            # Delivered locally once, and its own event didn't come back through the hub
+            assert on_first.sent == [{"type": "new_message", "data": {"message": "hi"}}]
+            assert heard == []
+        finally:
+            await second.stop()
+            await first.stop()
+
+    asyncio.run(run())
+
+
+def test_backend_drops_its_own_events():
+    delivered = []
+    backend = LocalSocketBackend("/nonexistent")
+    backend._deliver = lambda user_ids, data: delivered.append((user_ids, data))
+    other = LocalSocketBackend("/nonexistent")
+
+    backend._dispatch(backend._encode(["a"], "own"))
+    backend._dispatch(other._encode(["a", "b"], "theirs"))
+    backend._dispatch(other._encode([], "for workers"))
+
+    assert delivered == [(["a", "b"], "theirs"), ([], "for workers")]
+
+
+def test_incomplete_chunked_events_are_swept(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pubsub.time, "monotonic", lambda: now[0])
+    delivered = []
+    backend = PostgresBackend("postgresql://unused", "chat_events")
+    backend._deliver = lambda user_ids, data: delivered.append(data)
+    # From another worker, so it isn't dropped as our own
+    payload = PostgresBackend("postgresql://unused", "chat_events")._encode(["a"], "x" * 10)
+
+    # One part of two arrives and the other is lost
+    backend._on_notify(None, 0, "chat_events", f"#lost:0:2|{payload[:5]}")
+    assert "lost" in backend._chunks
+
+    now[0] += pubsub.CHUNK_TIMEOUT + 1
+    backend._on_notify(None, 0, "chat_events", f"#next:0:2|{payload[:5]}")
+    backend._on_notify(None, 0, "chat_events", f"#next:1:2|{payload[5:]}")
+
+    assert "lost" not in backend._chunks
+    assert backend._chunks == {}
+    assert delivered == ["x" * 10]
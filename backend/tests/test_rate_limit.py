@@ -0,0 +1,92 @@
+import pytest
+
+from app.core import rate_limit
+from app.core.rate_limit import TokenBuckets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_limited(clock):
+    buckets = TokenBuckets(rate=2.0, burst=3.0)
+    assert [buckets.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a") == pytest.approx(0.5)
+    assert buckets.limited == 1
+    # Other keys have their own bucket
+    assert buckets.take("b") == 0.0
+
+
+def test_refill_up_to_burst(clock):
+    buckets = TokenBuckets(rate=2.0, burst=3.0)
+    for _ in range(3):
+        buckets.take("a")
+    clock.now += 0.5
+    assert buckets.take("a") == 0.0
+    assert buckets.take("a") > 0
+
+    # However long it idles, it holds no more than burst
+    clock.now += 60
+    assert [buckets.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a") > 0
+
+
+def test_retry_after(clock):
+    buckets = TokenBuckets(rate=4.0, burst=2.0)
+    buckets.take("a", cost=2.0)
+    clock.now += 0.125
+    # Half a token back, so a cost of 2 waits for the other 1.5
+    assert buckets.take("a", cost=2.0) == pytest.approx(0.375)
+    # A refused take spends nothing: waiting the advised time is enough
+    clock.now += 0.375
+    assert buckets.take("a", cost=2.0) == 0.0
+
+
+def test_zero_rate_disables(clock):
+    buckets = TokenBuckets(rate=0.0, burst=1.0)
+    assert all(buckets.take("a") == 0.0 for _ in range(100))
+    assert buckets.stats() == {"buckets": 0, "slots": 0, "limited": 0}
+
+
+def test_sweep_releases_refilled_buckets(clock):
+    buckets = TokenBuckets(rate=1.0, burst=2.0)
+    for key in range(4):
+        buckets.take(key)
+    clock.now += 1.0
+    buckets.take(0)
+    # Not yet refilled: nothing swept
+    assert buckets.stats()["buckets"] == 4
+
+    clock.now += 2.0
+    buckets.take(0)
+    buckets.take(0)
+    # Two takes sweep four slots: 1-3 were idle long enough, 0 was just used
+    assert buckets.stats()["buckets"] == 1
+    # A swept key starts again from a full bucket
+    assert [buckets.take(1) for _ in range(2)] == [0.0, 0.0]
+
+
+def test_slots_are_reused(clock):
+    buckets = TokenBuckets(rate=1.0, burst=2.0)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.release("a")
+    buckets.take("c")
+    assert buckets.stats() == {"buckets": 2, "slots": 2, "limited": 0}
+
+    # Keys that come and go keep the arrays at the number active at once
+    for n in range(100):
+        clock.now += 10
+        buckets.take(("conn", n))
+    assert buckets.stats()["slots"] <= 3
@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app import database
+from app.api import deps
+from app.core.config import settings
+from app.schemas.events import dumps
+
+
+class Publisher:
+    """Stands in for the connection manager: keeps what was published to the other workers."""
+
+    def __init__(self):
+        self.published = []
+
+    async def publish_to_workers(self, message):
+        self.published.append(message)
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    # A read engine distinct from the primary; nothing connects to either
+    monkeypatch.setattr(database, "engine", object())
+    monkeypatch.setattr(database, "read_engine", object())
+    monkeypatch.setattr(database, "_last_write", {})
+    publisher = Publisher()
+    monkeypatch.setattr(deps, "manager", publisher)
+    monkeypatch.setattr(deps, "_unpublished_writes", set())
+    return publisher
+
+
+def test_writer_reads_from_the_primary_for_a_while(replica, monkeypatch):
+    async def run():
+        alice, bob = uuid.uuid4(), uuid.uuid4()
+        database.record_write(alice)
+        assert database.wrote_recently(alice)
+        assert not database.wrote_recently(bob)
+
+        monkeypatch.setattr(settings, "DB_READ_YOUR_WRITES_WINDOW", 0)
+        assert not database.wrote_recently(alice)
+
+    asyncio.run(run())
+
+
+def test_without_a_replica_nothing_is_recorded(monkeypatch):
+    monkeypatch.setattr(database, "_last_write", {})
+    monkeypatch.setattr(database, "read_engine", database.engine)
+    alice = uuid.uuid4()
+    database.record_write(alice)
+    assert not database.wrote_recently(alice)
+
+
+def test_writes_in_one_pass_reach_other_workers_as_one_event(replica):
+    async def run():
+        alice, bob = uuid.uuid4(), uuid.uuid4()
+        database.record_write(alice)
+        database.record_write(alice, bob)
+        await asyncio.sleep(0.01)
+        assert len(replica.published) == 1
+        published = replica.published[0]
+        assert published["type"] == "user_writes"
+        assert set(published["data"]["user_ids"]) == {alice, bob}
+
+        # Received on another worker
+        database._last_write.clear()
+        deps._on_remote_event(dumps(published).decode())
+        assert database.wrote_recently(alice) and database.wrote_recently(bob)
+
+    asyncio.run(run())
+
+
+def test_read_session_follows_the_callers_writes(replica, monkeypatch):
+    monkeypatch.setattr(deps, "SessionLocal", lambda: FakeSession("primary"))
+    monkeypatch.setattr(deps, "ReadSessionLocal", lambda: FakeSession("replica"))
+
+    async def session_for(user_id):
+        sessions = deps.get_read_db(current_user=type("Caller", (), {"id": user_id}))
+        session = await sessions.__anext__()
+        await sessions.aclose()
+        return session.name
+
+    async def run():
+        alice = uuid.uuid4()
+        assert await session_for(alice) == "replica"
+        database.record_write(alice)
+        assert await session_for(alice) == "primary"
+
+    asyncio.run(run())
+
+
+class FakeSession:
+    def __init__(self, name):
+        self.name = name
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
@@ -0,0 +1,127 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.schemas.events import dumps
+from app.services import recent_messages as module
+from app.services.recent_messages import RecentMessages, message_row_data
+
+THREAD = uuid.uuid4()
+START = datetime(2026, 1, 1)
+
+
+def row(n, thread_id=THREAD):
+    return SimpleNamespace(
+        id=uuid.UUID(int=n), thread_id=thread_id, message=f"message {n}", timestamp=START + timedelta(seconds=n),
+        user_id=uuid.UUID(int=0), username="alice", phone_number="+10000000000", display_name="Alice", is_bot=False,
+    )
+
+
+class FakeSession:
+    """Stands in for SessionLocal(): every query returns the newest committed rows."""
+
+    def __init__(self, committed):
+        self.committed = committed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query):
+        rows = sorted(self.committed, key=lambda r: r.timestamp, reverse=True)[:settings.RECENT_MESSAGES_PER_THREAD + 1]
+        return SimpleNamespace(all=lambda: rows)
+
+
+@pytest.fixture
+def committed(monkeypatch):
+    committed = []
+    monkeypatch.setattr(module, "SessionLocal", lambda: FakeSession(committed))
+    monkeypatch.setattr(settings, "RECENT_MESSAGES_PER_THREAD", 3)
+    monkeypatch.setattr(settings, "BROADCAST_BACKEND", "memory")
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 1)
+    return committed
+
+
+def ids(messages):
+    return [m["id"].int for m in messages]
+
+
+def test_fill_merges_broadcast_but_uncommitted_messages(committed):
+    async def run():
+        cache = RecentMessages()
+        committed.extend(row(n) for n in (1, 2))
+        # Broadcast, not yet visible to the fill's read
+        cache.add(message_row_data(row(3)))
+        cache.add(message_row_data(row(9, thread_id=uuid.uuid4())))
+
+        messages, more = await cache.latest(THREAD, 3)
+        assert ids(messages) == [1, 2, 3]
+        assert not more
+
+        # Already loaded: a new broadcast goes straight into the ring
+        cache.add(message_row_data(row(4)))
+        messages, more = await cache.latest(THREAD, 3)
+        assert ids(messages) == [2, 3, 4]
+        assert more
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    asyncio.run(run())
+
+
+def test_retract_keeps_the_message_out_of_later_fills(committed):
+    async def run():
+        cache = RecentMessages()
+        committed.append(row(1))
+        dropped = message_row_data(row(2))
+        cache.add(dropped)
+        assert ids((await cache.latest(THREAD, 3))[0]) == [1, 2]
+
+        await cache.retract(THREAD, dropped["id"])
+        assert cache.broadcast_since((START, uuid.UUID(int=0))) == []
+        assert ids((await cache.latest(THREAD, 3))[0]) == [1]
+
+        # Another worker's retraction
+        cache.add(message_row_data(row(3)))
+        cache.on_remote_event(dumps({"type": "recent_messages_retract", "data": {"thread_id": THREAD, "id": uuid.UUID(int=3)}}).decode())
+        assert ids((await cache.latest(THREAD, 3))[0]) == [1]
+
+    asyncio.run(run())
+
+
+def test_discard_reloads_on_next_read(committed):
+    async def run():
+        cache = RecentMessages()
+        committed.append(row(1))
+        await cache.latest(THREAD, 3)
+        assert cache.stats()["threads"] == 1 and cache.size > 0
+
+        committed.append(row(2))
+        cache.discard(THREAD)
+        assert cache.stats() == {"threads": 0, "bytes": 0, "hits": 0, "misses": 1}
+        assert ids((await cache.latest(THREAD, 3))[0]) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_disabled_when_workers_cannot_see_each_other(committed, monkeypatch):
+    async def run():
+        cache = RecentMessages()
+        # More than the cache holds per thread
+        assert await cache.latest(THREAD, 4) is None
+
+        monkeypatch.setattr(settings, "WEB_CONCURRENCY", 2)
+        assert not cache.enabled
+        assert await cache.latest(THREAD, 3) is None
+        cache.add(message_row_data(row(1)))
+        assert cache.broadcast_since((START, uuid.UUID(int=0))) == []
+
+        monkeypatch.setattr(settings, "BROADCAST_BACKEND", "postgres")
+        assert cache.enabled
+
+    asyncio.run(run())
@@ -0,0 +1,13 @@
+from app.core.config import settings
+from app.websockets.router import frame_bytes
+
+
+def test_frame_bytes_counts_utf8_bytes_of_text():
+    cap = settings.WS_MAX_FRAME_BYTES
+    assert frame_bytes(b"x" * cap) == cap
+    assert frame_bytes("x" * cap) == cap
+    # Under the cap in characters, over it in bytes
+    assert frame_bytes("é" * (cap // 2 + 1)) == cap + 2
+    assert frame_bytes("😀" * (cap // 4 + 1)) == cap + 4
+    # Text too short to reach the cap in any encoding isn't encoded
+    assert frame_bytes("😀" * (cap // 4)) <= cap
@@ -0,0 +1,236 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.database import SessionLocal
+from app.models.chats import ChatMessage
+from app.services import bots, tasks
+from app.services.bots import FakeBot
+from app.services.tasks import BotWorkerPool, stream_bot_response
+
+
+class Recorder:
+    """Stands in for the connection manager: keeps what the bot would have broadcast."""
+
+    def __init__(self):
+        self.events = []
+
+    async def broadcast_to_thread(self, thread, event):
+        self.events.append(event)
+
+    def types(self):
+        return [event["type"] for event in self.events]
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def test_pool_coalesces_bursts(monkeypatch):
+    replies = []
+    release = None
+
+    async def handle_bot_response(thread_id, executor=None):
+        replies.append(thread_id)
+        await release.wait()
+        return None
+
+    monkeypatch.setattr(tasks, "handle_bot_response", handle_bot_response)
+    monkeypatch.setattr(settings, "BOT_CONCURRENCY", 1)
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        pool = BotWorkerPool()
+        await pool.start()
+        try:
+            busy, other = uuid.uuid4(), uuid.uuid4()
+            # A burst while queued is one reply
+            for _ in range(3):
+                pool.submit(busy)
+            pool.submit(other)
+            await wait_for(lambda: replies == [busy])
+            assert pool.stats()["coalesced"] == 2
+
+            # Messages arriving mid-reply schedule exactly one follow-up, after the queue
+            pool.submit(busy)
+            pool.submit(busy)
+            release.set()
+            await wait_for(lambda: pool.stats()["generated"] == 3)
+            assert replies == [busy, other, busy]
+            assert pool.stats()["coalesced"] == 3
+        finally:
+            await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_pool_drops_when_full_or_stopped(monkeypatch):
+    async def handle_bot_response(thread_id, executor=None):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(tasks, "handle_bot_response", handle_bot_response)
+    monkeypatch.setattr(settings, "BOT_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "BOT_QUEUE_SIZE", 1)
+
+    async def run():
+        pool = BotWorkerPool()
+        pool.submit(uuid.uuid4())
+        assert pool.stats()["dropped"] == 1
+
+        await pool.start()
+        try:
+            pool.submit(uuid.uuid4())
+            await wait_for(lambda: pool.stats()["running"] == 1)
+            pool.submit(uuid.uuid4())
+            pool.submit(uuid.uuid4())
+            assert pool.stats()["queued"] == 1
+            assert pool.stats()["dropped"] == 2
+        finally:
+            await pool.stop()
+
+    asyncio.run(run())
+
+
+class SlowBot(FakeBot):
+    """Streams its first word, then stalls."""
+
+    def stream_response(self, history):
+        words = super().stream_response(history)
+        yield next(words)
+        time.sleep(1.0)
+        yield from words
+
+
+@pytest.fixture
+def bot_thread(rows, monkeypatch):
+    """A 1:1 thread with a bot whose last message is from the user; yields (thread, user, bot)."""
+    monkeypatch.setattr(settings, "BOT_BACKEND", "fake")
+    monkeypatch.setattr(bots, "_bot", None)
+
+    async def create():
+        user, bot = await rows.user("alice"), await rows.user("bot", is_bot=True)
+        thread = await rows.thread(user, bot)
+        async with SessionLocal() as db:
+            db.add(ChatMessage(thread_id=thread.id, user_id=user.id, message="hello bot", timestamp=datetime.utcnow()))
+            await db.commit()
+        return thread, user, bot
+
+    return rows.run(create())
+
+
+async def bot_messages(thread_id, bot_id):
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(ChatMessage.message).where(ChatMessage.thread_id == thread_id, ChatMessage.user_id == bot_id)
+        )
+        return result.scalars().all()
+
+
+def test_pool_replies_with_fake_bot(rows, bot_thread, monkeypatch):
+    thread, user, bot = bot_thread
+    recorder = Recorder()
+    monkeypatch.setattr(tasks, "manager", recorder)
+
+    async def run():
+        pool = BotWorkerPool()
+        await pool.start()
+        try:
+            pool.submit(thread.id)
+            await wait_for(lambda: pool.stats()["generated"] == 1)
+        finally:
+            await pool.stop()
+        assert await bot_messages(thread.id, bot.id) == ["You said: hello bot"]
+        assert recorder.types() == ["message_delta"] * 4 + ["new_message"]
+        assert pool.stats()["ttft_last"] is not None
+
+    rows.run(run())
+
+
+def test_pool_abandons_slow_generation(rows, bot_thread, monkeypatch):
+    thread, user, bot = bot_thread
+    recorder = Recorder()
+    monkeypatch.setattr(tasks, "manager", recorder)
+    monkeypatch.setattr(tasks, "get_bot", SlowBot)
+    monkeypatch.setattr(settings, "BOT_TIMEOUT", 0.3)
+
+    async def run():
+        pool = BotWorkerPool()
+        await pool.start()
+        try:
+            pool.submit(thread.id)
+            await wait_for(lambda: pool.stats()["timeouts"] == 1)
+        finally:
+            await pool.stop()
+        assert await bot_messages(thread.id, bot.id) == []
+        # The half-streamed reply is withdrawn
+        assert recorder.types() == ["message_delta", "message_aborted"]
+        assert pool.stats()["generated"] == 0
+
+    rows.run(run())
+
+
+class BrokenBot(FakeBot):
+    """Fails after streaming `after` words."""
+
+    def __init__(self, after):
+        self.after = after
+
+    def stream_response(self, history):
+        words = super().stream_response(history)
+        for _ in range(self.after):
+            yield next(words)
+        raise RuntimeError("model went away")
+
+
+def stream(bot, recorder, monkeypatch):
+    monkeypatch.setattr(tasks, "manager", recorder)
+    history = [{"role": "user", "message": "stream this please"}]
+    thread, message_id, thread_id = object(), str(uuid.uuid4()), str(uuid.uuid4())
+    return stream_bot_response(bot, history, None, thread, message_id, thread_id, {"id": "bot"}, time.perf_counter())
+
+
+def test_stream_relays_deltas_in_order(monkeypatch):
+    recorder = Recorder()
+
+    async def run():
+        text, ttft = await stream(FakeBot(), recorder, monkeypatch)
+        assert text == "You said: stream this please"
+        assert ttft is not None
+        assert [event["data"]["seq"] for event in recorder.events] == list(range(5))
+        assert "".join(event["data"]["delta"] for event in recorder.events) == text
+        assert len({event["data"]["id"] for event in recorder.events}) == 1
+
+    asyncio.run(run())
+
+
+def test_stream_failure_aborts_the_partial_reply(monkeypatch):
+    recorder = Recorder()
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await stream(BrokenBot(after=2), recorder, monkeypatch)
+        assert recorder.types() == ["message_delta", "message_delta", "message_aborted"]
+        assert recorder.events[-1]["data"]["id"] == recorder.events[0]["data"]["id"]
+
+    asyncio.run(run())
+
+
+def test_stream_failure_before_any_delta_sends_nothing(monkeypatch):
+    recorder = Recorder()
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await stream(BrokenBot(after=0), recorder, monkeypatch)
+        assert recorder.events == []
+
+    asyncio.run(run())
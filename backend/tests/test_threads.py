@@ -0,0 +1,64 @@
+import uuid
+from datetime import datetime, timedelta
+
+import orjson
+from sqlalchemy import select
+
+from app.api.chat import get_threads
+from app.core.principal import Principal
+from app.database import SessionLocal
+from app.models.chats import Thread
+from app.services.ingest import MessageIngestor
+from app.services.threads import PREVIEW_LENGTH, record_last_message
+
+
+async def summary(thread_id):
+    async with SessionLocal() as db:
+        return (await db.execute(
+            select(Thread.last_message_id, Thread.last_message_preview, Thread.updated).where(Thread.id == thread_id)
+        )).one()
+
+
+def test_summary_never_moves_backwards(rows):
+    async def run():
+        alice, bob = await rows.user("alice"), await rows.user("bob")
+        thread = await rows.thread(alice, bob)
+        newer, older = uuid.uuid4(), uuid.uuid4()
+        now = datetime.utcnow()
+        async with SessionLocal() as db:
+            await record_last_message(db, thread.id, newer, bob.id, "x" * 1000, now)
+            # A writer that was slower to commit an earlier message
+            await record_last_message(db, thread.id, older, alice.id, "earlier", now - timedelta(seconds=1))
+            await db.commit()
+
+        last_message_id, preview, updated = await summary(thread.id)
+        assert last_message_id == newer
+        assert preview == "x" * PREVIEW_LENGTH
+        assert updated == now
+
+    rows.run(run())
+
+
+def test_batched_write_points_each_thread_at_its_newest_message(rows):
+    async def run():
+        alice, bob, carol = await rows.user("alice"), await rows.user("bob"), await rows.user("carol")
+        with_bob, with_carol = await rows.thread(alice, bob), await rows.thread(alice, carol)
+
+        ingestor = MessageIngestor()
+        ingestor.submit(with_bob.id, alice.id, "first")
+        newest = ingestor.submit(with_bob.id, bob.id, "second")
+        ingestor.submit(with_carol.id, alice.id, "hello carol")
+        await ingestor.flush()
+        assert (await summary(with_bob.id))[:2] == (newest.id, "second")
+
+        # The inbox is ordered by the summary: the thread with the newest message first
+        later = ingestor.submit(with_carol.id, carol.id, "later")
+        await ingestor.flush()
+        async with SessionLocal() as db:
+            response = await get_threads(before=None, limit=50, db=db, current_user=Principal.from_user(alice))
+        inbox = orjson.loads(response.body)
+        assert [t["id"] for t in inbox] == [str(with_carol.id), str(with_bob.id)]
+        assert inbox[0]["last_message"]["message"] == "later"
+        assert later.persisted.done()
+
+    rows.run(run())
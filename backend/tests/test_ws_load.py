@@ -0,0 +1,29 @@
+import json
+from types import SimpleNamespace
+
+from bench import ws_load
+
+
+def test_percentile_picks_from_sorted_values():
+    values = list(range(1, 101))
+    assert ws_load.percentile(values, 50) == 51
+    assert ws_load.percentile(values, 99) == 100
+    assert ws_load.percentile(values, 100) == 100
+    assert ws_load.percentile([7], 99) == 7
+
+
+def test_small_run_delivers_every_message(rows, tmp_path):
+    # Against the real app and database, like the benchmark itself
+    output = tmp_path / "run.json"
+    args = SimpleNamespace(
+        users=4, rate=20.0, duration=1.0, rest_share=0.25, drain=5.0, rest_workers=2,
+        batch=4, concurrency=4, bcrypt_rounds=4, output=str(output),
+    )
+    rows.run(ws_load.main(args))
+
+    report = json.loads(output.read_text())
+    assert report["connections"] == 4
+    assert report["messages_delivered"] == report["messages_sent"] == 20
+    assert report["messages_lost"] == report["messages_unsent"] == 0
+    assert report["send_errors"] == {"rest": 0, "ws": 0}
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["max"]